@@ -17,23 +17,41 @@ if sys.version_info < min_py:
 # Other standard distro imports
 ###
 import argparse
+from   concurrent.futures import ThreadPoolExecutor
 import contextlib
 import curses
 import curses.panel
 from   curses import wrapper
 from   datetime import datetime
 import getpass
-import fcntl
+import json
 import logging
-import re
 import shutil
+import signal
+import threading
 import time
 import math
+import queue
+import random
+import zlib
 mynetid = getpass.getuser()
 
 import view_utils
 from view_utils import *
-from   wrapper import trap
+from   anomaly import AnomalyDetector, RED_FLAGS
+from   cgroups import CGROUP_SCRIPT, SEPARATOR, job_usage, parse_cgroups
+from   drilldown import DetailCache, format_detail, parse_meminfo
+from   forecast import Forecast, describe_wait
+from   history_store import HistoryStore
+from   hostlist import NodeSet
+from   jobs import JobIndex
+import placement
+from   procstat import parse_stat, utilization
+from   profiling import RefreshProfiler, profile_thread
+from   sessions import ProbeSessions
+from   snapshot_cache import CACHE_NAME, SHARED_DIR, SharedSnapshot, load_snapshot, parse_users, save_snapshot
+from   timings import RefreshTimer
+from   wrapper import trap, configure_trap, trap_config
 from window_view_utils import *
 
 ###
@@ -53,7 +71,18 @@ __email__ = 'hpc@richmond.edu'
 __status__ = 'in progress'
 __license__ = 'MIT'
 
-DAT_FILE=os.path.join(os.getcwd(), 'info.dat')
+history = None
+collectors = []
+details = None
+timer = RefreshTimer()
+profiler = None
+
+# How often the map looks for keys and new rows while a refresh runs.
+POLL_MS = 100
+
+# Set when the map is closed, to stop the probes of a refresh that is
+# still running.
+stopping = threading.Event()
 
 suffix_keys = tuple("*~#!%$@^-")
 suffix_values = (
@@ -75,184 +104,888 @@ states = dict(zip(state_keys, state_values))
 
 
 
-@trap
-def get_actual_cores_usage(node:str) -> int:
+def probe_script(cgroups:bool=False, counters:str='grep ^cpu /proc/stat') -> str:
     """
-    ssh to the node and get the number of cores that is actually used.
+    The shell commands that get the load, the memory, and the CPU
+    counters (by default, those of each core), and, with cgroups, what
+    each job on the node is using.
     """
-    cmd = "ssh -o ConnectTimeout=1 {} 'cat /proc/loadavg'"
-    result = view_utils.dorunrun(cmd.format(node), return_datatype = str)[:5]
+    remote = f"cat /proc/loadavg; head -3 /proc/meminfo; {counters}"
+    return f"{remote}; {CGROUP_SCRIPT}" if cgroups else remote
 
-    return 'None' if not result else result
 
-@trap 
-def get_actual_mem_usage(node:str) -> int:
+def probe_command(node:str, cgroups:bool=False) -> List[str]:
     """
-    ssh to the node and calculate how much memory is used.
+    One ssh per node runs the probe_script.
     """
-    pattern = re.compile(r'\d+')
+    return ['ssh', '-o', 'ConnectTimeout=1', node, probe_script(cgroups)]
 
-    cmd = "ssh -o ConnectTimeout=1 {} 'head -2 cat /proc/meminfo'"
-    result = view_utils.dorunrun(cmd.format(node), return_datatype = str) 
-   
-
-    if result == '':
-        res = 'None'
-    else:
-        result = result.split("/n")
-        memvals = re.findall(pattern, result[0])
 
-        memtotal = int(memvals[0])
-        memused = int(memvals[1])
+def parse_probe(stdout:str) -> SloppyDict:
+    """
+    From the output of probe_command: the 1 minute load average, the
+    used memory in GB (what is not available, so that the page cache
+    does not count as used), the /proc/stat counters, and the node's uptime
+    and its jobs' cgroup counters. The load and memory are None, the
+    counters empty, and the cgroups None if they are not in the output.
+    """
+    stdout, sep, jobs = stdout.partition(SEPARATOR)
+    lines = stdout.split('\n')
+    try:
+        load = float(lines[0].split()[0])
+    except (IndexError, ValueError) as e:
+        load = None
 
-        res = math.ceil((memtotal-memused)/1000000)
+    memory = parse_meminfo("\n".join(lines[1:4]))
+    available = memory.get('MemAvailable', memory.get('MemFree'))
+    mem = (math.ceil(memory['MemTotal'] - available)
+        if 'MemTotal' in memory and available is not None else None)
+    uptime, jobs = parse_cgroups(sep + jobs)
+    return SloppyDict(load=load, mem=mem, counters=parse_stat("\n".join(lines[4:])),
+        cgroups=None if uptime is None else (uptime, jobs))
 
-    return res
 
 @trap
-def get_list_of_nodes() -> dict:
+def get_list_of_nodes(cluster:str=None) -> Dict[str, NodeSet]:
     """
     Gets the current list of nodes as a dictionary whose
-    keys are the node names, and whose values are the state 
-    abbreviation and a boolean to indicate whether the node
-    is reachable.
+    keys are the state abbreviations, and whose values are
+    the nodes in that state. sinfo gives the nodes as hostlist
+    expressions, and they are kept that way. cluster is for
+    sinfo -M; by default, it is the local cluster.
     """
-    result = dorunrun('sinfo -o "%n %t"', return_datatype = str)
-    info = result.split('\n')[1:]
-    node_dict = {}
-    for line in info:
-        node, state = line.split()
-        node_dict[node] = state
+    cmd = 'sinfo -h -o "%t %N"' if cluster is None else f'sinfo -M {cluster} -h -o "%t %N"'
+    result = dorunrun(cmd, return_datatype = str)
+    states = {}
+    for line in ( _ for _ in result.split('\n') if _.strip() and not _.startswith('CLUSTER:') ):
+        state, nodes = line.split(None, 1)
+        states[state] = states.get(state, NodeSet()) | NodeSet(nodes)
+
+    return states
 
-    return node_dict
 
 @trap
-def get_info() -> dict:
-    global logger, myargs
-    logger.info(piddly("get_info"))
+def nodes_by_state(data:SloppyTree, watched:NodeSet) -> Dict[str, NodeSet]:
     """
-    Get the map with all the cores and memory information
+    The watched nodes, by their state in this refresh's sinfo data.
     """
-    global DAT_FILE, suffixes, states
+    if not isinstance(data, dict): return {}
+    names = {}
+    for line in ( _ for _ in data.stdout.split('\n')[1:] if _ ):
+        node, status = line.split()[0], line.split()[3]
+        if node in watched: names.setdefault(status, []).append(node)
+    return { status: NodeSet(nodes) for status, nodes in names.items() }
 
-    data = SeekINFO()
-    core_map_and_mem = []
-    actually_used_cores = {}   
-    actually_used_mem = {}
-    
-    # multiprocessing to ssh to each node and get info on
-    # actually used memory and cores
-    fork_ssh(myargs.input) 
-   
-    # fork_ssh writes to info.dat
-    # collect information into the dictionary
-    with open(DAT_FILE) as infodat:
-        #infodat.seek(0)
-        
-        for line in infodat.readlines():
-            node = core = mem = ""
+
+def reachable(state:str) -> bool:
+    """
+    Nodes with a state suffix, and down nodes, are not probed.
+    """
+    return state[-1] not in suffixes and state[1:] not in 'd'
+
+class Collector: pass
+
+class Collector:
+    """
+    Collects the snapshots of one cluster. Without --clusters there is
+    one Collector, for the local cluster; with it, there is one for each
+    of the clusters, and get_info runs them at the same time. Each has
+    its own nodes, anomaly detector and cached snapshot.
+    """
+    __slots__ = {
+        'cluster': 'name of the cluster for sinfo -M, or None for the local one',
+        'nodes': 'NodeSet of the nodes in --input, or None to watch the nodes that sinfo reports',
+        'reachable': 'NodeSet of the nodes that could be probed in the last refresh',
+        'detector': 'AnomalyDetector for the nodes of this cluster',
+        'counters': 'node -> its /proc/stat counters at the last probe',
+        'cgroups': 'node -> its uptime and its jobs\' cgroup counters at the last probe',
+        'last': 'the last snapshot, whose values are shown until the staggered probes replace them',
+        'sessions': 'the ProbeSessions of the nodes, with --sessions'
+        }
+
+    __values__ = (None, None, None, None, None, None, None, None)
+
+    __defaults__ = dict(zip(__slots__.keys(), __values__))
+
+    def __init__(self, cluster:str=None, nodes:NodeSet=None) -> None:
+        for k, v in Collector.__defaults__.items():
+            setattr(self, k, v)
+        self.cluster = cluster
+        self.nodes = nodes
+        self.reachable = NodeSet()
+        self.detector = AnomalyDetector()
+        self.counters = {}
+        self.cgroups = {}
+        self.last = {}
+
+
+    def key(self, node:str) -> str:
+        """
+        The node's key in the snapshot. Node names need not be unique
+        across clusters, so with --clusters they are qualified.
+        """
+        return node if self.cluster is None else f"{self.cluster}:{node}"
+
+
+    def label(self, phase:str) -> str:
+        return phase if self.cluster is None else f"{self.cluster}.{phase}"
+
+
+    def busy_cores(self, node:str, load:Optional[float],
+        counters:Dict[str, Tuple[int, int]]) -> Optional[float]:
+        """
+        The number of cores that were busy since the node's last probe,
+        from the change in its /proc/stat counters, which are kept for
+        the next probe. The load average lags, and counts the tasks that
+        are waiting for I/O, so it is only used when there is nothing to
+        compare with: on the first probe, or if the counters are missing.
+        """
+        previous = self.counters.pop(node, None)
+        if counters: self.counters[node] = counters
+        if not previous or not counters: return load
+
+        busy = [ u for cpu, u in utilization(previous, counters).items() if cpu != 'cpu' ]
+        return round(sum(busy), 2) if busy else load
+
+
+    def job_usage(self, node:str, cgroups:Optional[Tuple[float, dict]],
+        jobs:List[SloppyDict]=()) -> Optional[List[dict]]:
+        """
+        The cores and memory used by each job on the node since its last
+        probe, with what the job was allocated on the node if the job is
+        in jobs (from squeue, with --jobs). None if the probe did not
+        read the cgroups.
+        """
+        previous = self.cgroups.pop(node, None)
+        if cgroups is None: return None
+        self.cgroups[node] = cgroups
+        return with_allocations(job_usage(previous, cgroups), jobs)
+
+
+    def stream(self, nodes:NodeSet) -> Iterator[Tuple[str, SloppyDict, Optional[float]]]:
+        """
+        With --sessions, the latest reading of each node from its probe
+        session, which is started if the node does not have one yet, as
+        probe_nodes would yield it. The readings already have the busy
+        cores and the jobs' usage. Nothing was probed, so the seconds
+        are None, and the probe latencies are left out of the timer.
+        Nodes with no recent reading have None for their values.
+        """
+        global logger, myargs
+
+        if self.sessions is None:
+            self.sessions = ProbeSessions(
+                script=probe_script(getattr(myargs, 'cgroups', False), counters='head -1 /proc/stat'),
+                parse=parse_probe, interval=myargs.refresh or 60, timeout=myargs.probe_timeout)
+
+        for node, reading in self.sessions.readings(nodes, myargs.probe_timeout):
+            if reading is None:
+                logger.error("no recent reading from the session of %s", node)
+                reading = SloppyDict(busy=None, mem=None, job_usage=None, time=time.monotonic())
+            yield node, reading, None
+
+
+    def close(self) -> None:
+        """
+        End the probe sessions, if there are any.
+        """
+        if self.sessions is not None:
+            self.sessions.close()
+            self.sessions = None
+
+
+    @property
+    def cache_name(self) -> str:
+        return CACHE_NAME if self.cluster is None else f"snapshot-{self.cluster}.bin"
+
+
+    def collect(self, on_progress:Callable=None) -> dict:
+        """
+        A fresh snapshot of the cluster. With --shared, it comes from the
+        viewers' shared cache if another viewer collected it recently
+        enough, and otherwise from collect_now, after waiting for any
+        other viewer that is collecting it already.
+        """
+        global myargs, timer
+
+        if getattr(myargs, 'shared', None) is None:
+            snapshot = self.collect_now(on_progress)
+        else:
+            shared = SharedSnapshot(directory=myargs.shared, key=self.shared_key,
+                ttl=myargs.shared_ttl or myargs.refresh or 60,
+                trusted=getattr(myargs, 'shared_trust', None) or ())
+            with timer.phase(self.label('shared')):
+                snapshot, collected = shared.get_or_collect(lambda: self.collect_now(on_progress))
+            if not collected and on_progress is not None: on_progress(snapshot)
+
+        if not getattr(myargs, 'no_cache', True):
+            with timer.phase(self.label('save')):
+                save_snapshot(snapshot, selection(self.cluster), self.cache_name)
+        return snapshot
+
+
+    def find(self, request:SloppyDict, probed:Dict[str, tuple],
+        max_age:float) -> Optional[SloppyDict]:
+        """
+        One check for --wait-for. sinfo is cheap, so it is run every time,
+        but only the nodes that SLURM says have room for the request are
+        probed, and of those only the ones whose state or allocation has
+        changed since they were last probed, or that were last probed
+        more than max_age seconds ago.
+
+        probed -- node -> (its sinfo state and allocation, and when it was
+            probed); it is kept from one check to the next.
+
+        returns -- the record of the first node that fits, or None.
+        """
+        global myargs
+
+        data = SeekINFO(self.cluster)
+        if not isinstance(data, dict): return None
+        now = time.time()
+        records = parse_sinfo(data, self.watched(data))
+        candidates = {}
+        state = lambda rec: (rec.status, rec.alloc_cores, rec.alloc_mem)
+        for node, rec in records.items():
+            if not placement.may_fit(rec, request):
+                probed.pop(self.key(node), None)
+                continue
+            last = probed.get(self.key(node))
+            if last is None or last[0] != state(rec) or now - last[1] > max_age:
+                candidates.setdefault(rec.status, []).append(node)
+
+        logger.debug("probing %s", candidates)
+        list_of_nodes = { state: NodeSet(nodes) for state, nodes in candidates.items() }
+        with contextlib.closing(probe_nodes(list_of_nodes)) as probes:
+            for node, sample, seconds in probes:
+                rec = records[node]
+                probed[self.key(node)] = (state(rec), now)
+                rec.used_cores = self.busy_cores(node, sample.load, sample.counters)
+                rec.used_mem = sample.mem
+                if self.cluster is not None: rec.cluster = self.cluster
+                if placement.fits(rec, request): return rec
+        return None
+
+
+    @property
+    def spread(self) -> float:
+        """
+        Seconds over which the probes of a refresh are started: none
+        unless --stagger is given, and otherwise as much of the refresh
+        interval as leaves the last probe its --probe-timeout before
+        the next refresh.
+        """
+        global myargs
+        if not getattr(myargs, 'stagger', False) or not myargs.refresh: return 0.0
+        return max(0.0, myargs.refresh - myargs.probe_timeout)
+
+
+    @property
+    def shared_key(self) -> str:
+        """
+        A shared snapshot is only used by viewers that would have
+        collected the same thing.
+        """
+        global myargs
+        return (f"{selection(self.cluster)}|jobs={getattr(myargs, 'jobs', False)}"
+            f"|cgroups={getattr(myargs, 'cgroups', False)}"
+            f"|releases={bool(getattr(myargs, 'place', None))}")
+
+
+    def collect_now(self, on_progress:Callable=None) -> dict:
+        """
+        Collect the sinfo data and the results of probing the nodes into
+        one record per node, with the flags from the anomaly detector
+        attached. The used cores and memory are None for the nodes that
+        could not be probed.
+
+        The stages overlap: sinfo (and squeue, with --jobs) run at the same
+        time as the probes, so that a refresh takes about as long as the
+        slower of sinfo and the slowest probe, rather than their sum.
+        With --stagger, the probes of the nodes that were reachable in the
+        last refresh are spread over the interval instead, and the refresh
+        lasts about as long as the interval. With --sessions, nothing is
+        started: the latest readings of the nodes' sessions are taken.
+
+        on_progress -- if given, it is called with the snapshot as soon as
+            the sinfo data are in, and then with the snapshot and the record
+            that changed as each probe finishes. Records whose probe has not
+            finished yet have probing set to True.
+        """
+        global logger, myargs, timer
+
+        # The forecast for --place needs the jobs' end times, which come
+        # from the same squeue query as the jobs for --jobs.
+        jobs = getattr(myargs, 'jobs', False) or bool(getattr(myargs, 'place', None))
+        events = queue.Queue()
+
+        def query(name:str, f:Callable) -> None:
+            result = None
             try:
-                node, core, mem = line.split()
-                actually_used_cores[node] = core 
-                actually_used_mem[node] = mem
-            except Exception as e:
-                logger.error(piddly(f"Failed to read {line=}"))
+                with timer.phase(self.label(name)):
+                    result = f(self.cluster)
+            finally:
+                events.put((name, result))
+
+        def probe(nodes:NodeSet, spread:float=0.0) -> None:
+            try:
+                streaming = getattr(myargs, 'sessions', False)
+                for result in (self.stream(nodes) if streaming else probe_nodes(nodes, spread)):
+                    events.put(('probe', result))
+            finally:
+                events.put(('probed', None))
+
+        # The nodes that were reachable in the last refresh are probed
+        # while sinfo runs. Few nodes change state between refreshes,
+        # so when sinfo answers, most of the probes are under way.
+        previous = self.reachable
+        waiting = {'sinfo', 'squeue'} if jobs else {'sinfo'}
+        answers = {}
+        early = {}
+        snapshot = None
+
+        with ThreadPoolExecutor(max_workers=4, initializer=profile_thread) as pool:
+            pool.submit(query, 'sinfo', SeekINFO)
+            if jobs: pool.submit(query, 'squeue', JobIndex.query)
+            pool.submit(probe, previous, self.spread)
+            running = 1
+
+            with timer.phase(self.label('ssh')):
+                while waiting or running:
+                    name, value = events.get()
+                    if name == 'probe':
+                        node, sample, seconds = value
+                        if seconds is not None: timer.probe(self.key(node), seconds)
+                        if snapshot is None: early[node] = sample
+                        else: self.apply(snapshot, node, sample, answers.get('squeue'), on_progress)
+                        continue
+                    if name == 'probed':
+                        running -= 1
+                        continue
+
+                    waiting.discard(name)
+                    answers[name] = value
+                    if waiting: continue
+
+                    with timer.phase(self.label('parse')):
+                        snapshot = self.reconcile(answers['sinfo'], answers.get('squeue'))
+                    on_progress is not None and on_progress(snapshot)
+                    for node, sample in early.items():
+                        self.apply(snapshot, node, sample, answers.get('squeue'), on_progress)
+                    early = {}
+                    if self.sessions is not None and isinstance(answers['sinfo'], dict):
+                        self.sessions.retain(self.reachable)
+
+                    # The nodes that were added, or have come back.
+                    if self.reachable - previous:
+                        pool.submit(probe, self.reachable - previous)
+                        running += 1
+
+        with timer.phase(self.label('detect')):
+            for rec in snapshot.values():
+                rec.flags = self.detector.update(rec)
+
+        self.last = snapshot if self.spread else {}
+        return snapshot
+
+
+    def watched(self, data:SloppyTree) -> NodeSet:
+        """
+        The nodes to watch in this refresh: the ones in --input, which
+        are read once, or else every node in this refresh's sinfo data,
+        so that nodes that are added to the cluster are picked up. Either
+        way, only those in --nodes, if it is given.
+        """
+        global myargs
+
+        if self.nodes is None and myargs.input:
+            self.nodes = get_host_names(myargs, self.cluster)
+        if self.nodes is not None:
+            return self.nodes
+
+        nodes = NodeSet( line.split()[0] for line in data.stdout.split('\n')[1:] if line.strip() )
+        if getattr(myargs, 'nodes', ""):
+            nodes &= NodeSet(myargs.nodes)
+        return nodes
+
+
+    def reconcile(self, data:SloppyTree, index:JobIndex=None) -> dict:
+        """
+        One record per watched node from the sinfo data, with the jobs
+        from index, if any. The nodes that can be probed are marked as
+        probing, and remembered for the next refresh. With --stagger, they
+        keep what they used at their last probe until the next one. If
+        sinfo failed, the snapshot is empty, and the reachable nodes are
+        unchanged.
+        """
+        if not isinstance(data, dict):
+            logger.error(piddly("sinfo failed: %s"), data)
+            return {}
+
+        watched = self.watched(data)
+        snapshot = {}
+        for node, rec in parse_sinfo(data, watched).items():
+            if index is not None:
+                if getattr(myargs, 'jobs', False): index.attach(rec)
+                rec.releases = index.releases(node)
+            if self.cluster is not None: rec.cluster = self.cluster
+            snapshot[self.key(node)] = rec
+
+        self.reachable = NodeSet()
+        for state, nodes in nodes_by_state(data, watched).items():
+            if not reachable(state): continue
+            self.reachable |= nodes
+            for node in nodes:
+                rec = snapshot.get(self.key(node))
+                if rec is None: continue
+                rec.probing = True
+                last = self.last.get(self.key(node))
+                if last is not None and last.used_cores is not None:
+                    rec.update(used_cores=last.used_cores, used_mem=last.used_mem,
+                        flags=last.get('flags', ()))
+                    if 'job_usage' in last: rec.job_usage = last.job_usage
+        return snapshot
+
+
+    def apply(self, snapshot:dict, node:str, sample:SloppyDict,
+        index:JobIndex=None, on_progress:Callable=None) -> None:
+        """
+        Put the result of a probe into the node's record. Nodes that
+        sinfo no longer shows as reachable, or that are not watched any
+        more, are left alone.
+        """
+        rec = snapshot.get(self.key(node))
+        if rec is None or not rec.get('probing'): return
+        jobs = index.on(node) if index is not None else ()
+        streamed = 'busy' in sample
+        rec.used_cores = sample.busy if streamed else self.busy_cores(node, sample.load, sample.counters)
+        rec.used_mem = sample.mem
+        if getattr(myargs, 'cgroups', False):
+            rec.job_usage = (with_allocations(sample.job_usage, jobs) if streamed
+                else self.job_usage(node, sample.cgroups, jobs))
+        del rec.probing
+        on_progress is not None and on_progress(snapshot, rec)
+
+
+def with_allocations(usage:Optional[List[dict]], jobs:Iterable[SloppyDict]) -> Optional[List[dict]]:
+    """
+    Add what each job was allocated on the node, for the jobs that are
+    in jobs (from squeue, with --jobs).
+    """
+    if usage is None: return None
+    allocated = { job.id: job for job in jobs }
+    for job in usage:
+        if job['id'] in allocated:
+            job['alloc_cores'] = allocated[job['id']].cpus_per_node
+            job['alloc_mem'] = allocated[job['id']].mem
+    return usage
+
+
+def make_collectors() -> List[Collector]:
+    """
+    One Collector for each cluster in --clusters, or one for the local
+    cluster.
+    """
+    global myargs
+
+    clusters = [ _ for _ in getattr(myargs, 'clusters', "").split(',') if _ ]
+    if not clusters:
+        return [ Collector(None, myargs.input if isinstance(myargs.input, NodeSet) else None) ]
+    return [ Collector(cluster) for cluster in clusters ]
+
+
+@trap
+def collect_all(on_progress:Callable=None) -> dict:
+    """
+    Run the collectors at the same time, so that a refresh takes about
+    as long as the slowest cluster. The progress reports come back to
+    this thread, which is the only one that may draw.
+    """
+    global collectors
+
+    events = queue.Queue()
+    forward = None if on_progress is None else lambda snapshot, rec=None: events.put((snapshot, rec))
+    merged = {}
+
+    with ThreadPoolExecutor(max_workers=len(collectors), initializer=profile_thread) as pool:
+        futures = [ pool.submit(collector.collect, forward) for collector in collectors ]
+        while True:
+            try:
+                snapshot, rec = events.get(timeout=0.05)
+            except queue.Empty:
+                if all(f.done() for f in futures) and events.empty(): break
+                continue
+            if rec is None:
+                merged.update(snapshot)
+                on_progress(merged)
+            else:
+                on_progress(merged, rec)
+
+        for f in futures:
+            merged.update(f.result())
+    return merged
+
 
+@trap
+def parse_sinfo(data:SloppyTree, watched:NodeSet) -> dict:
+    """
+    One record for each watched node in the sinfo data, with the used
+    cores and memory left as None for the probes to fill in.
+    """
+    global logger
+
+    snapshot = {}
     for line in ( _ for _ in data.stdout.split('\n')[1:] if _ ):
-        
         try: 
             node, free, total, status, true_cores, cores = line.split()
-            cores = cores.split('/')
-            allocated_mem = (int(total) - int(free))/1000 # GB
-            alloc_cores = row(cores[0], true_cores)
-            alloc_mem = str(math.ceil(allocated_mem))
-
-            used_cores = actually_used_cores[node]
-            used_mem = actually_used_mem[node]
-            #print(node, used_cores, used_mem)
-            total_mem_formatted = str(math.ceil(int(total)/1000))
-
-            if used_cores == 'None':# or used_mem == 'None':
-                suffix = ""
-                text = ""
-        
-                if status[-1] in suffixes:
-                    status, suffix = status[:-1], status[-1]
-                    text = states.get(status, 'status unknown')
-                    if suffix: text = f"{text} and {suffixes.get('suffix', 'N/A')}"
-                core_map_and_mem.append(f"{node} is {text}.")
-            else:
-                core_map_and_mem.append(f"{node} {alloc_cores} {used_cores.rjust(10)} | {alloc_mem.rjust(6)}  {used_mem.rjust(6)}  {total_mem_formatted.rjust(6)} ")
+            if node not in watched: continue
+
+            # sinfo reports the free memory of a down node as N/A.
+            free = free if free.isdigit() else total
+            snapshot[node] = SloppyDict(
+                node = node,
+                status = status,
+                alloc_cores = int(cores.split('/')[0]),
+                total_cores = int(true_cores),
+                used_cores = None,
+                alloc_mem = math.ceil((int(total) - int(free))/1000), # GB
+                used_mem = None,
+                total_mem = math.ceil(int(total)/1000)
+                )
         except Exception as e:
-            logger.info(piddly(f"{e}"))
+            logger.info(piddly("%s"), e)
+
+    return snapshot
 
-    return core_map_and_mem
 
 @trap
-def fork_ssh(list_of_nodes:dict) -> None:
-    '''
-    Multiprocesses to ssh to each node and retrieve this information 
-    in parallel, significantly speeding up the process.
-    '''
-    global DAT_FILE, logger
-    
-    try:
-        os.unlink(DAT_FILE)
-    except FileNotFoundError as e:
-        # This is OK; the file has already been deleted.
-        pass
+def format_node(rec:SloppyDict) -> str:
+    """
+    One line of the map for one node.
+    """
+    global suffixes, states
 
-    except Exception as e:
-        # This is something else, let's find out what happened.
-        logger.error(piddly(f"Cannot continue. Unable to clear {DAT_FILE} because {e}."))
-        sys.exit(os.EX_IOERR)
+    if rec.get('probing') and rec.used_cores is None:
+        return (f"{rec.node} {row(rec.alloc_cores, rec.total_cores)} {'probing...'.rjust(10)} | "
+            f"{str(rec.alloc_mem).rjust(6)}  {'...'.rjust(6)}  {str(rec.total_mem).rjust(6)}")
 
-    pids = set()
+    if rec.used_cores is None:
+        status = rec.status
+        suffix = ""
+        text = states.get(status, 'status unknown')
 
-    reachable_nodes = { node : state 
-        for node, state in list_of_nodes.items() 
-            if state[-1] not in suffixes and state[1:] not in 'd' }
+        if status[-1] in suffixes:
+            status, suffix = status[:-1], status[-1]
+            text = states.get(status, 'status unknown')
+            if suffix: text = f"{text} and {suffixes.get(suffix, 'N/A')}"
+        return f"{rec.node} is {text}."
 
-    unreachable_nodes = { node : state 
-        for node, state in list_of_nodes.items() 
-            if node not in reachable_nodes }
+    alloc_cores = row(rec.alloc_cores, rec.total_cores)
+    used_cores = f"{rec.used_cores:.2f}"
+    used_mem = 'None' if rec.used_mem is None else str(rec.used_mem)
+    flags = f" !{','.join(rec.flags)}" if rec.get('flags') else ""
+    users = f" {' '.join(f'{user}({cpus})' for user, cpus in rec.users)}" if rec.get('users') else ""
+    return (f"{rec.node} {alloc_cores} {used_cores.rjust(10)} | {str(rec.alloc_mem).rjust(6)}  "
+        f"{used_mem.rjust(6)}  {str(rec.total_mem).rjust(6)} {flags}{users}{format_jobs(rec)}")
 
-    if len(unreachable_nodes): logger.info(piddly(f"{unreachable_nodes.keys()=}"))
 
-    for node in reachable_nodes:            
+def format_jobs(rec:SloppyDict, n:int=3) -> str:
+    """
+    The n jobs using the most cores on the node, from --cgroups, as
+    id:used/allocated cores; jobs that were only seen once show ? for
+    the cores they used.
+    """
+    usage = rec.get('job_usage')
+    if not usage: return ""
+    busiest = sorted(usage, key=lambda job: -(job['cores'] or 0))[:n]
+    used = lambda job: '?' if job['cores'] is None else f"{job['cores']:.1f}"
+    return " jobs " + " ".join(
+        f"{job['id']}:{used(job)}/{job.get('alloc_cores', '?')}" for job in busiest)
 
-        # Parent process records the child's PID.
-        if (pid := os.fork()):
-            pids.add(pid)
-            continue
 
-        with open(DAT_FILE, 'a+') as infodat:
-            try:
-                cores_used = -1
-                mem_used = -1
-                cores_used = get_actual_cores_usage(node)
-                mem_used   = get_actual_mem_usage(node)    
-
-                # each child process locks, writes to and unlocks the file
-                fcntl.lockf(infodat, fcntl.LOCK_EX)
-                infodat.write(f'{node} {cores_used} {mem_used}\n')
-                infodat.close()
-                
-            except Exception as e:
-                logger.error(piddly(f"query of {node} failed. {e}"))
-                pass
+@trap
+def node_color(rec:SloppyDict) -> str:
+    """
+    red if the node is down, uses more cores than it has, or has been
+    flagged by the anomaly detector; yellow if it is more than 75% full;
+    green otherwise. Nodes that are still being probed for the first
+    time are white.
+    """
+    if rec.get('probing') and rec.used_cores is None:
+        return 'white'
+    if rec.used_cores is None or rec.used_cores > rec.total_cores:
+        return 'red'
+    if RED_FLAGS.intersection(rec.get('flags', ())):
+        return 'red'
+    if busy_fraction(rec) >= 0.75:
+        return 'yellow'
+    return 'green'
+
+
+def busy_fraction(rec:SloppyDict) -> float:
+    """
+    The larger of the allocated fractions of the cores and the memory.
+    This is what how_busy() gets from sinfo, but taken from the record,
+    so that drawing a row does not run sinfo again.
+    """
+    cores = rec.alloc_cores / rec.total_cores if rec.total_cores else 0
+    mem = rec.alloc_mem / rec.total_mem if rec.total_mem else 0
+    return max(cores, mem)
+
+
+@trap
+def record_history(snapshot:dict) -> None:
+    """
+    Add the nodes that answered to the --history store, if there is one.
+    """
+    global history, timer
+
+    if history is None: return
+    now = time.time()
+    with timer.phase('history'):
+        for node, rec in snapshot.items():
+            if rec.used_cores is None: continue
+            history.append(node, now, rec)
+
+
+@trap
+def get_info(on_progress:Callable=None, record:bool=True) -> dict:
+    """
+    Get the cores and memory information for the map, one record per
+    node, with the flags from the anomaly detector attached. on_progress
+    is passed to the collectors. Without record, the snapshot is not
+    added to the --history store, and the caller does that.
+    """
+    global collectors, logger, timer
+    logger.debug("get_info")
+
+    timer = RefreshTimer()
+    if not collectors: collectors = make_collectors()
+    if len(collectors) == 1:
+        snapshot = collectors[0].collect(on_progress)
+    else:
+        snapshot = collect_all(on_progress)
+    if record: record_history(snapshot)
+    return snapshot
+
+
+def selection(cluster:str=None) -> str:
+    """
+    Identifies the nodes that were asked for, so that a cached snapshot
+    is only used for the same nodes.
+    """
+    global myargs
+    source = myargs.input_file or ""
+    return f"{cluster or ''}|{os.path.abspath(source) if source else ''}|{myargs.nodes}"
 
-            finally:
-                logger.info(piddly(f"{node} {cores_used} {mem_used}"))
-                os._exit(os.EX_OK)
 
-    # make sure all the child processes finished before the function 
-    # returns.
-    while pids:
-        # The zero in the argument means we wait for any child.
-        # The resulting pid is the child that sent us a SIGCHLD.
-        pid, exit_code, _ = os.wait3(0) 
-        pids.remove(pid)
+def record_key(rec:SloppyDict) -> str:
+    return f"{rec.cluster}:{rec.node}" if rec.get('cluster') else rec.node
+
+
+def in_order(snapshot:dict) -> List[SloppyDict]:
+    return sorted(snapshot.values(), key=lambda rec: (rec.get('cluster', ''), rec.node))
+
+
+def sections(records:Iterable[SloppyDict]) -> Iterator[Union[str, SloppyDict]]:
+    """
+    The records, with a heading before those of each cluster when
+    there is more than one.
+    """
+    cluster = None
+    for rec in records:
+        if rec.get('cluster') and rec.cluster != cluster:
+            cluster = rec.cluster
+            yield f"--- {cluster} " + "-" * 40
+        yield rec
+
+
+def suggestions(records:Iterable[SloppyDict]) -> List[SloppyDict]:
+    """
+    The best nodes for the --place request, one from each cluster.
+    """
+    global myargs
+    if not getattr(myargs, 'place', None): return []
+    return placement.suggest(records, myargs.place)
+
+
+def forecasts(records:Iterable[SloppyDict]) -> List[Tuple[float, SloppyDict]]:
+    """
+    The nodes that will have room for the --place request soonest, by
+    the end times of the running jobs, one from each cluster.
+    """
+    global myargs
+    if not getattr(myargs, 'place', None): return []
+    return Forecast(records).earliest(myargs.place)
+
+
+def suggestion_line(records:Iterable[SloppyDict]) -> str:
+    """
+    The best fit in each cluster, and, for the clusters where nothing
+    fits now, when something will.
+    """
+    global myargs
+    records = list(records)
+    best = suggestions(records)
+    line = (f"Best fit for {placement.describe_request(myargs.place)}: " +
+        (", ".join(placement.describe(rec) for rec in best) if best else "nothing fits now"))
+
+    fitted = { rec.get('cluster', '') for rec in best }
+    soonest = [ f"{record_key(rec)} at {describe_wait(t)}" for t, rec in forecasts(records)
+        if rec.get('cluster', '') not in fitted ]
+    return f"{line}; soonest: {', '.join(soonest)}" if soonest else line
+
+
+def profiled() -> ContextManager:
+    """
+    Profile one refresh if --profile was given; otherwise, do nothing.
+    """
+    global profiler
+    return contextlib.nullcontext() if profiler is None else profiler.refresh()
+
+
+@trap
+def wait_for() -> int:
+    """
+    Check every --wait-interval seconds until a node fits the request
+    in --wait-for, and print its name, for scripts. A message goes to
+    stderr as well, with a bell if it is a terminal. Gives up after
+    --wait-timeout seconds, if that is given.
+    """
+    global collectors, logger, myargs
+
+    request = myargs.wait_for
+    collectors = make_collectors()
+    probed = {}
+    started = time.monotonic()
+    while True:
+        for collector in collectors:
+            rec = collector.find(request, probed, myargs.refresh or 60)
+            if rec is None: continue
+
+            print(record_key(rec))
+            sys.stdout.flush()
+            bell = '\a' if sys.stderr.isatty() else ''
+            sys.stderr.write(f"{bell}{placement.describe(rec)} fits {placement.describe_request(request)}.\n")
+            return os.EX_OK
+
+        if myargs.wait_timeout and time.monotonic() - started + myargs.wait_interval > myargs.wait_timeout:
+            sys.stderr.write(f"No node fit {placement.describe_request(request)} in {myargs.wait_timeout:.0f} seconds.\n")
+            return os.EX_TEMPFAIL
+        time.sleep(myargs.wait_interval)
+
+
+@trap
+def headless() -> None:
+    """
+    Print the map without curses, either once, or every --refresh
+    seconds. --format json prints one JSON object per refresh, with
+    the nodes in each state as hostlist expressions.
+    """
+    global logger, myargs, timer
+
+    while True:
+        started = time.monotonic()
+        with profiled():
+            info = in_order(get_info())
+            stamp = datetime.now()
+
+            with timer.phase('render'):
+                if myargs.format == 'json':
+                    nodes = [ dict(rec, color=node_color(rec)) for rec in info ]
+                    by_state = {}
+                    for rec in info:
+                        by_state.setdefault(rec.get('cluster'), {}).setdefault(rec.status, []).append(rec.node)
+                    states = { cluster: { k: str(NodeSet(v)) for k, v in sorted(names.items()) }
+                        for cluster, names in by_state.items() }
+                    states = states.get(None, {}) if list(states) == [None] else states
+                    place = [ record_key(rec) for rec in suggestions(info) ]
+                    soonest = [ dict(node=record_key(rec), time=datetime.fromtimestamp(t).isoformat(timespec='seconds'))
+                        for t, rec in forecasts(info) ]
+                else:
+                    lines = [ _ if isinstance(_, str) else format_node(_) for _ in sections(info) ]
+                    myargs.place and lines.append(suggestion_line(info))
+
+        if myargs.format == 'json':
+            result = {"time": stamp.isoformat(timespec='seconds'),
+                "nodes": nodes, "states": states, "timings": timer.as_dict()}
+            if myargs.place: result.update(placement=place, forecast=soonest)
+            print(json.dumps(result))
+        else:
+            print("\n".join(lines))
+            print(f'Last updated {stamp.strftime("%m/%d/%Y %H:%M:%S")}')
+            print(timer.breakdown())
+        sys.stdout.flush()
+        logger.info("%s", Lazy(timer.breakdown))
+
+        if not myargs.refresh: break
+        time.sleep(next_refresh(started))
+
+
+def next_refresh(started:float) -> float:
+    """
+    Seconds to wait before the next refresh. A staggered refresh takes
+    most of the interval, so the interval is kept from the start of one
+    refresh to the start of the next; otherwise it is the pause between
+    them.
+    """
+    global myargs
+    if not getattr(myargs, 'stagger', False):
+        return myargs.refresh
+    return max(0.0, started + myargs.refresh - time.monotonic())
+
+def staggered(nodes:Iterable[str], spread:float, jitter:float=0.5) -> Dict[str, float]:
+    """
+    When to start each node's probe, in seconds from now, so that the
+    probes are spread evenly over spread seconds. Each node keeps its
+    place from one refresh to the next, so that it is still probed
+    once per interval; the places come from a hash of the name, so that
+    neighbouring nodes, which often share a switch, are not probed
+    together. Each start is moved by up to jitter of a slot, so that
+    viewers on different hosts do not fall into step.
+    """
+    nodes = sorted(nodes, key=lambda node: (zlib.crc32(node.encode()), node))
+    slot = spread / len(nodes) if nodes else 0.0
+    return { node: slot * (i + 0.5 + jitter * (random.random() - 0.5))
+        for i, node in enumerate(nodes) }
+
+
+@trap
+def probe_nodes(list_of_nodes:Union[NodeSet, Dict[str, NodeSet]],
+    spread:float=0.0) -> Iterator[Tuple[str, SloppyDict, float]]:
+    '''
+    Probe the reachable nodes in parallel, and yield the results as
+    each probe finishes, so that the fastest nodes can be shown without
+    waiting for the slowest. list_of_nodes maps each state to the nodes
+    in that state, or is a NodeSet of nodes that are all to be probed.
+    If spread is given, the probes are started over that many seconds,
+    as staggered() places them, rather than all at once.
+
+    yields -- (node, sample, seconds) tuples, where the sample is from
+        parse_probe; its values are None, or empty, if the probe failed.
+    '''
+    global logger, myargs
+
+    if isinstance(list_of_nodes, NodeSet): list_of_nodes = {'idle': list_of_nodes}
+    reachable_nodes = NodeSet()
+    unreachable_nodes = NodeSet()
+    for state, nodes in list_of_nodes.items():
+        if reachable(state): reachable_nodes |= nodes
+        else: unreachable_nodes |= nodes
+
+    if unreachable_nodes: logger.info("unreachable nodes: %s", unreachable_nodes)
+
+    cgroups = getattr(myargs, 'cgroups', False)
+    offsets = staggered(reachable_nodes, spread) if spread else None
+    commands = { node: probe_command(node, cgroups) for node in (offsets or reachable_nodes) }
+    for node, result in dorunrun_many(commands, offsets=offsets, cancel=stopping,
+            max_concurrent=myargs.probe_concurrency, timeout=myargs.probe_timeout):
+        sample = parse_probe(result['stdout'] if result['OK'] else "")
+        if not result['OK']:
+            logger.error("query of %s failed. %s %s", node, result['name'], result['stderr'])
+        logger.debug("%s %s %s", node, sample.load, sample.mem)
+        yield node, sample, result['elapsed']
+
 
 @trap
 def how_busy(n:str) -> int:
@@ -281,6 +1014,100 @@ def how_busy(n:str) -> int:
 
     return max(busy_cores, busy_mem) #, cores[1], true_cores
 
+class BackgroundRefresh: pass
+
+class BackgroundRefresh:
+    """
+    Runs each refresh in a thread of its own, so that the map reads the
+    keys while the probes are out; a staggered refresh takes most of
+    the interval. Only the thread that calls poll() draws: the refresh
+    sends it the records as they arrive, and the finished snapshot is
+    added to the --history store on that thread as well.
+
+    Usage:
+        refresher = BackgroundRefresh()
+        refresher.start()
+        while refresher.running:
+            whole, changed = refresher.poll()
+    """
+    __slots__ = {
+        'updates': 'what the refresh has sent and poll() has not yet taken',
+        'collected': 'the snapshot of the refresh that has just finished',
+        'thread': 'the thread of the refresh under way, or None',
+        'shown': 'the records as they stand, by record_key',
+        'started': 'time.monotonic() when the last refresh started',
+        'stamp': 'datetime when the last refresh finished'
+        }
+
+    __values__ = (None, None, None, None, None, None)
+
+    __defaults__ = dict(zip(__slots__.keys(), __values__))
+
+    def __init__(self) -> None:
+        for k, v in BackgroundRefresh.__defaults__.items():
+            setattr(self, k, v)
+        self.updates = queue.SimpleQueue()
+        self.collected = []
+        self.shown = {}
+        self.started = time.monotonic()
+        self.stamp = datetime.now()
+
+
+    @property
+    def running(self) -> bool:
+        return self.thread is not None
+
+
+    def start(self) -> None:
+        """
+        Start a refresh, unless one is under way.
+        """
+        if self.thread is not None: return
+        self.started = time.monotonic()
+        self.thread = threading.Thread(target=self.run, name='refresh', daemon=True)
+        self.thread.start()
+
+
+    def run(self) -> None:
+        def progress(snapshot:dict, rec:SloppyDict=None) -> None:
+            self.updates.put((dict(snapshot), None) if rec is None else (None, SloppyDict(rec)))
+        with profiled():
+            self.collected.append(get_info(progress, record=False))
+
+
+    def poll(self) -> Tuple[bool, List[SloppyDict]]:
+        """
+        Take what the refresh has sent since the last poll into shown:
+        all the records when the sinfo data arrive, and then one at a
+        time. Returns whether all of shown may have changed (those data
+        arrived, or the refresh finished), and the records that changed
+        one at a time.
+        """
+        whole = False
+        changed = []
+        while True:
+            try:
+                snapshot, rec = self.updates.get_nowait()
+            except queue.Empty:
+                break
+            if rec is None:
+                self.shown, whole = snapshot, True
+            else:
+                self.shown[record_key(rec)] = rec
+                changed.append(rec)
+
+        if self.thread is not None and not self.thread.is_alive():
+            self.thread = None
+            if self.collected:
+                self.shown = self.collected.pop()
+                record_history(self.shown)
+                self.stamp = datetime.now()
+                logger.info("%s", Lazy(timer.breakdown))
+            whole = True
+
+        return whole, changed
+
+
 @trap
 def map_cores(stdscr: object) -> None:
 
@@ -290,7 +1117,7 @@ def map_cores(stdscr: object) -> None:
     coded here.
     """
 
-    global logger, myargs
+    global details, logger, myargs
 
     # initialize the color, use ID to refer to it later in the code
     # params: ID, font color, background color
@@ -315,6 +1142,7 @@ def map_cores(stdscr: object) -> None:
 
     window2 = curses.newwin(0,0, 1,1)
     help_win = curses.newwin(0,0, 1,1)
+    details = DetailCache(ttl=myargs.detail_ttl, timeout=myargs.probe_timeout)
 
     window2.bkgd(' ', WHITE_AND_BLACK)
     help_win.bkgd(' ', WHITE_AND_BLACK)
@@ -326,15 +1154,43 @@ def map_cores(stdscr: object) -> None:
     curses.panel.update_panels()
     curses.doupdate()
 
+    detail_win = curses.newwin(0,0, 1,1)
+    detail_win.bkgd(' ', WHITE_AND_BLACK)
+    detail_panel = curses.panel.new_panel(detail_win)
+    detail_panel.hide()
+    window2.keypad(True)
+
     running = True
     help_win_up = False
+    detail_up = False
     x = 0
+
+    # The refresh is separate from the drawing, so that moving the
+    # selection or opening a node's details does not collect again.
+    need_refresh = True
+    info = []
+    selected = 0
+
+    colors = {'red':RED_AND_BLACK, 'yellow':YELLOW_AND_BLACK, 'green':GREEN_AND_BLACK,
+        'white':WHITE_AND_BLACK}
+    if not myargs.no_cache:
+        draw_stale(window2, colors, WHITE_AND_BLACK)
+
+    refresher = BackgroundRefresh()
+    redraw = False
+
+    rows = {}
+    def draw_row(rec:SloppyDict, highlight:bool=False) -> None:
+        window2.addstr(rows[record_key(rec)], 0, format_node(rec),
+            colors[node_color(rec)] | (curses.A_REVERSE if highlight else 0))
+        window2.clrtoeol()
     
     while ( running ):
         #display the cores map for each node
         try:
             # window with help message
             if help_win_up:
+                redraw = True
                 window2.clear()
                 window2.refresh()
                 left_panel.hide()
@@ -346,7 +1202,7 @@ def map_cores(stdscr: object) -> None:
                 help_win.addstr(4, 0, example_map()[1], GREEN_AND_BLACK)
                 help_win.addstr(5, 0, help_msg(), WHITE_AND_BLACK)
     
-                help_win.addstr(24, 0, "Press b to return to the main screen.")
+                help_win.addstr(28, 0, "Press b to return to the main screen.")
                 help_win.refresh()
                 ch = help_win.getch()
                 if ch == curses.KEY_RESIZE:    
@@ -359,7 +1215,46 @@ def map_cores(stdscr: object) -> None:
                     help_win_up = False
                     help_panel.hide()
                     help_win.clear()
+                    left_panel.show()
                     continue    
+
+            # the details of the selected node, fetched on demand.
+            elif detail_up:
+                redraw = True
+                window2.clear()
+                window2.refresh()
+                left_panel.hide()
+                detail_panel.show()
+
+                rec = info[selected]
+                detail_win.clear()
+                detail_win.addstr(0, 0, f"Fetching the details of {record_key(rec)} ...", WHITE_AND_BLACK)
+                detail_win.refresh()
+                detail = details.get(rec.node, rec.get('cluster'), refresh=(detail_up == 'refresh'))
+                detail_win.clear()
+                height, width = detail_win.getmaxyx()
+                for idx, line in enumerate(format_detail(detail)[:height-2]):
+                    detail_win.addstr(idx, 0, line[:width-1], WHITE_AND_BLACK)
+                detail_win.addstr(height-2, 0, "Press b to return to the map, r to fetch the details again.", WHITE_AND_BLACK)
+                detail_win.refresh()
+
+                ch = detail_win.getch()
+                if ch == curses.KEY_RESIZE:
+                    height,width = stdscr.getmaxyx()
+                    detail_win.resize(height, width)
+                    detail_panel.replace(detail_win)
+                    detail_panel.move(0,0)
+                if ch == ord('r'):
+                    detail_up = 'refresh'
+                    continue
+                if ch == ord('b'):
+                    detail_up = False
+                    detail_panel.hide()
+                    detail_win.clear()
+                    left_panel.show()
+                else:
+                    detail_up = True
+                continue
                      
             # map the main window with CPU usage map and memory usage information.
             else:
@@ -367,28 +1262,51 @@ def map_cores(stdscr: object) -> None:
                 window2.addstr(0, 0, header(), WHITE_AND_BLACK)
                 window2.addstr(1, 0, subheader(), WHITE_AND_BLACK)            
 
-                info = get_info()
-                
-                for idx, node in enumerate(sorted(info)):
-                    if 'is' in node: # red, if the node status is down or if numof cores used is > 52
-                        window2.addstr(idx+2, 0, node, RED_AND_BLACK)
-                    elif (float(node.split()[2])>52.00):
-                        window2.addstr(idx+2, 0, node, RED_AND_BLACK)
-                    elif how_busy(node) >= 0.75: #if node is more than 75% full
-                        window2.addstr(idx+2, 0, node, YELLOW_AND_BLACK)
-                    else:
-                        window2.addstr(idx+2, 0, node, GREEN_AND_BLACK)
-                window2.addstr(len(info)+2, 0, f'Last updated {datetime.now().strftime("%m/%d/%Y %H:%M:%S")}', WHITE_AND_BLACK)
-                window2.addstr(len(info)+3, 0, "Press q to quit, h for help OR any other key to refresh.", WHITE_AND_BLACK)
+                if need_refresh and not refresher.running:
+                    refresher.start()
+                    need_refresh = False
+
+                whole, changed = refresher.poll()
+                redraw = redraw or whole or any(record_key(rec) not in rows for rec in changed)
+
+                if changed or redraw: info = in_order(refresher.shown)
+                selected = min(selected, max(len(info) - 1, 0))
+                current = record_key(info[selected]) if info else None
+
+                if not redraw:
+                    for rec in changed:
+                        draw_row(rec, record_key(rec) == current)
+                else:
+                    redraw = False
+                    with timer.phase('draw'):
+                        lines = list(sections(info))
+                        rows.clear()
+                        for idx, item in enumerate(lines):
+                            if isinstance(item, str):
+                                window2.addstr(idx+2, 0, item, WHITE_AND_BLACK)
+                                window2.clrtoeol()
+                            else:
+                                rows[record_key(item)] = idx + 2
+                                draw_row(item, record_key(item) == current)
+                    bottom = len(lines) + 2
+                    window2.addstr(bottom, 0, f'Last updated {refresher.stamp.strftime("%m/%d/%Y %H:%M:%S")}  [{timer.summary()}]', WHITE_AND_BLACK)
+                    window2.clrtoeol()
+                    if myargs.place:
+                        bottom += 1
+                        window2.addstr(bottom, 0, suggestion_line(info), WHITE_AND_BLACK)
+                        window2.clrtoeol()
+                    window2.addstr(bottom+1, 0, "Press q to quit, h for help, arrows and Enter for a node's details, OR any other key to refresh.", WHITE_AND_BLACK)
+                    window2.clrtoeol()
                 window2.refresh()    
-        except:
+        except Exception as e:
             pass 
         
         #work around window resize
-        window2.timeout(myargs.refresh*1000)
+        window2.timeout(POLL_MS if refresher.running else int(next_refresh(refresher.started)*1000))
         k = window2.getch()
+        redraw = redraw or k != -1
         if k == -1:
-            pass
+            need_refresh = need_refresh or not refresher.running
         elif k == curses.KEY_RESIZE:    
             height,width = stdscr.getmaxyx()
             window2.resize(height, width)
@@ -396,11 +1314,23 @@ def map_cores(stdscr: object) -> None:
             left_panel.move(0,0)
         elif k == ord('q'): 
             running = False
+            stopping.set()
             curses.endwin()
 
         # help message panel
         elif k == ord('h'):
             help_win_up = True
+
+        # move the selection, and open the details of the selected node.
+        elif k in (curses.KEY_UP, ord('k')):
+            selected = max(selected - 1, 0)
+        elif k in (curses.KEY_DOWN, ord('j')):
+            selected = min(selected + 1, max(len(info) - 1, 0))
+        elif k in (curses.KEY_ENTER, 10, 13, ord('d')):
+            detail_up = bool(info)
+
+        else:
+            need_refresh = True
         
         curses.panel.update_panels()
         curses.doupdate()
@@ -410,7 +1340,47 @@ def map_cores(stdscr: object) -> None:
 
 
 @trap
-def get_host_names(myargs:argparse.Namespace) -> dict:
+def draw_stale(window:object, colors:dict, text_color:int) -> None:
+    """
+    Draw the cached snapshot, dimmed and labelled with its age, so that
+    there is something to look at while the first refresh is collected.
+    """
+    global collectors, myargs
+
+    if not collectors: collectors = make_collectors()
+    snapshot = {}
+    when = None
+    for collector in collectors:
+        cached = load_snapshot(selection(collector.cluster), collector.cache_name)
+        if cached is None: continue
+        when = cached[0] if when is None else min(when, cached[0])
+        snapshot.update(cached[1])
+    if when is None: return
+
+    lines = list(sections(in_order(snapshot)))
+    try:
+        window.addstr(0, 0, header(), text_color)
+        window.addstr(1, 0, subheader(), text_color)
+        for idx, item in enumerate(lines):
+            if isinstance(item, str):
+                window.addstr(idx+2, 0, item, text_color | curses.A_DIM)
+            else:
+                window.addstr(idx+2, 0, format_node(item), colors[node_color(item)] | curses.A_DIM)
+        age = time.time() - when
+        window.addstr(len(lines)+2, 0, f'STALE: snapshot from {datetime.fromtimestamp(when).strftime("%m/%d/%Y %H:%M:%S")} '
+            f'({age:.0f}s old). Collecting a fresh one ...', text_color | curses.A_BOLD)
+        window.refresh()
+    except curses.error as e:
+        pass
+
+
+@trap
+def get_host_names(myargs:argparse.Namespace, cluster:str=None) -> NodeSet:
+    """
+    The nodes to watch: those in the --input file (names or hostlist
+    expressions), or else all the nodes that sinfo knows about in the
+    cluster, limited to the --nodes expression if one was given.
+    """
     global logger
 
     hosts = tuple()
@@ -419,11 +1389,17 @@ def get_host_names(myargs:argparse.Namespace) -> dict:
         if not hosts or hosts == os.EX_NOINPUT:
             logger.info(piddly(f"Unable to use {myargs.input}"))
             sys.exit(os.EX_NOINPUT)
-        return dict.fromkeys(hosts, "")
+        nodes = NodeSet(hosts)
 
     else:
-        return  get_list_of_nodes()
-        
+        nodes = NodeSet()
+        for state_nodes in get_list_of_nodes(cluster).values():
+            nodes |= state_nodes
+
+    if getattr(myargs, 'nodes', ""):
+        nodes &= NodeSet(myargs.nodes)
+    return nodes
+
 
 @trap
 def piddly(s:str) -> str:
@@ -435,11 +1411,29 @@ def piddly(s:str) -> str:
 @trap
 def activityview_main() -> int:
     #wrapper(draw_menu)
-    global logger, myargs
+    global logger, myargs, history, profiler
     logger.info(piddly("Entered activityview_main"))
 
-    myargs.input=get_host_names(myargs)
-    wrapper(map_cores)
+    myargs.input_file = myargs.input
+    if myargs.history:
+        history = HistoryStore(myargs.history)
+    if myargs.profile:
+        profiler = RefreshProfiler(myargs.profile, 
+            keep=myargs.profile_keep, top=myargs.profile_top)
+
+    if myargs.wait_for:
+        return wait_for()
+
+    # Exit normally when killed, so that the probe sessions are ended.
+    if myargs.sessions:
+        signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(os.EX_OK))
+    try:
+        headless() if myargs.headless else wrapper(map_cores)
+    finally:
+        stopping.set()
+        history is not None and history.close()
+        for collector in collectors:
+            collector.close()
     return os.EX_OK
 
 
@@ -451,17 +1445,74 @@ if __name__ == '__main__':
     parser.add_argument('-r', '--refresh', type=int, default=60, 
         help="Refresh interval defaults to 60 seconds. Set to 0 to only run once.")
     parser.add_argument('-i', '--input', type=str, default="",
-        help="If present, --input is interpreted to be a whitespace delimited file of host names.")
+        help="If present, --input is interpreted to be a whitespace delimited file of host names or hostlist expressions.")
+    parser.add_argument('-M', '--clusters', type=str, default="",
+        help="If present, a comma separated list of SLURM clusters (as for sinfo -M) to show together, each in its own section.")
+    parser.add_argument('--cgroups', action='store_true',
+        help="Also read the cgroup of each SLURM job on the probed nodes, to show the cores and memory that each job uses.")
+    parser.add_argument('--jobs', action='store_true',
+        help="Show the users with the most CPUs on each node, from one squeue query per refresh. "
+        "The JSON output also lists the top jobs.")
+    parser.add_argument('--place', type=placement.parse_request, default=None,
+        help="Suggest the best node in each cluster for a job of this size, e.g., cores=16,mem=64G.")
+    parser.add_argument('--wait-for', type=placement.parse_request, default=None,
+        help="Wait until a node fits a job of this size, e.g., cores=16,mem=64G, then print its name and exit.")
+    parser.add_argument('--wait-interval', type=float, default=10.0,
+        help="Seconds between the checks of --wait-for. Defaults to 10.")
+    parser.add_argument('--wait-timeout', type=float, default=None,
+        help="Give up waiting after this many seconds, and exit with status 75.")
+    parser.add_argument('-n', '--nodes', type=str, default="",
+        help="If present, only the nodes in this SLURM hostlist expression (e.g., spdr[01-30,50-61]) are shown.")
     parser.add_argument('-o', '--output', type=str, default="",
         help="Output file name")
-    parser.add_argument('-v', '--verbose', type=int, default=logging.DEBUG, 
+    parser.add_argument('--probe-concurrency', type=int, default=64,
+        help="Number of nodes probed at once. Defaults to 64.")
+    parser.add_argument('--probe-timeout', type=float, default=10.0,
+        help="Seconds allowed for each node's probe. Defaults to 10.")
+    parser.add_argument('--sessions', action='store_true',
+        help="Keep one ssh session open to each node, which sends a sample every refresh interval, "
+        "instead of starting an ssh per node for each refresh.")
+    parser.add_argument('--stagger', action='store_true',
+        help="Spread the probes evenly over the refresh interval, instead of probing all the nodes at once. "
+        "The first refresh still probes them all at once.")
+    parser.add_argument('--shared', type=str, nargs='?', const=SHARED_DIR, default=None,
+        help=f"Share the snapshots with the other viewers on this host through a directory (defaults to {SHARED_DIR}), "
+        "so that only one of them collects in each interval.")
+    parser.add_argument('--shared-ttl', type=float, default=None,
+        help="Seconds for which a shared snapshot is used. Defaults to the refresh interval.")
+    parser.add_argument('--shared-trust', type=parse_users, default=(),
+        help="Comma separated users (names or uids) whose shared snapshots are used, as well as your own. "
+        "By default, only your own are used.")
+    parser.add_argument('--detail-ttl', type=float, default=15.0,
+        help="Seconds that the details of a node, shown with Enter in the map, are reused. Defaults to 15.")
+    parser.add_argument('--headless', action='store_true',
+        help="Print the map to stdout (or --output) instead of drawing it with curses.")
+    parser.add_argument('--format', type=str, default="text", choices=('text', 'json'),
+        help="The format of the --headless output.")
+    parser.add_argument('--history', type=str, default="",
+        help="If present, each refresh is recorded in this directory. Read it back with history_store.py.")
+    parser.add_argument('--no-cache', action='store_true',
+        help="Do not draw the last saved snapshot while the first refresh is collected, and do not save a new one.")
+    parser.add_argument('--profile', type=str, default="",
+        help="If present, CPU and allocation profiles of each refresh are written to this directory.")
+    parser.add_argument('--profile-keep', type=int, default=20,
+        help="Number of refreshes whose profiles are kept. Defaults to 20.")
+    parser.add_argument('--profile-top', type=int, default=25,
+        help="Number of functions and allocation sites in each profile's summary. Defaults to 25.")
+    parser.add_argument('--trap', type=str, default="bounded", choices=('full', 'bounded'),
+        help="How failures are dumped. full dumps every local of every frame; bounded (the default) "
+        "dumps a size-limited summary of each distinct failure once. ACTIVITYVIEW_TRAP=off in the "
+        "environment turns the dumps off.")
+    parser.add_argument('-v', '--verbose', type=int, default=logging.INFO, 
         help=f"Sets the loglevel. Values between {logging.NOTSET} and {logging.CRITICAL}.")
 
 
     myargs = parser.parse_args()
 
-    verbose = myargs.verbose if logging.NOTSET <= myargs.verbose <= logging.CRITICAL else logging.DEBUG
-    logger = view_utils.URLogger(level=myargs.verbose)
+    verbose = myargs.verbose if logging.NOTSET <= myargs.verbose <= logging.CRITICAL else logging.INFO
+    logger = view_utils.URLogger(level=verbose, queued=True, burst=10)
+    if trap_config['mode'] != 'off':
+        configure_trap(mode=myargs.trap)
     
     ###
     # Make an effort to ensure SLURM is on this system.
@@ -0,0 +1,165 @@
+# -*- coding: utf-8 -*-
+"""
+A streaming anomaly detector for the per-node samples. Each sample is
+folded into a handful of numbers kept for its node (an exponentially
+weighted moving average and variance of the load, and a counter per
+condition),
+so the cost of a sample does not depend on how much history there is.
+"""
+
+import typing
+from   typing import *
+
+###
+# Credits
+###
+__author__ = 'Alina Enikeeva'
+__copyright__ = 'Copyright 2022, University of Richmond'
+__credits__ = None
+__version__ = 0.1
+__maintainer__ = 'Alina Enikeeva, George Flanagin'
+__email__ = 'hpc@richmond.edu'
+__status__ = 'in progress'
+__license__ = 'MIT'
+
+
+###
+# Standard imports, starting with os and sys
+###
+min_py = (3, 8)
+import os
+import sys
+if sys.version_info < min_py:
+    print(f"This program requires Python {min_py[0]}.{min_py[1]}, or higher.")
+    sys.exit(os.EX_SOFTWARE)
+
+###
+# Other standard distro imports
+###
+import math
+
+###
+# imports that are a part of this project
+###
+from   wrapper import trap
+
+###
+# global objects
+###
+verbose = False
+
+# The names of the flags.
+OVERLOADED = 'overloaded'   # load far above the allocated cores.
+IDLE       = 'idle'         # cores allocated, but nothing running.
+MEMFULL    = 'memfull'      # memory in use is close to the total.
+SURGE      = 'surge'        # load jumped well above its recent average.
+
+# Flags that make a node's row red.
+RED_FLAGS = frozenset((OVERLOADED, MEMFULL))
+
+
+class NodeStats:
+    """
+    Everything the detector remembers about one node.
+    """
+    __slots__ = ('n', 'load_mean', 'load_var', 'streaks')
+
+    def __init__(self) -> None:
+        self.n = 0
+        self.load_mean = 0.0
+        self.load_var = 0.0
+        self.streaks = dict.fromkeys((OVERLOADED, IDLE, MEMFULL), 0)
+
+
+class AnomalyDetector: pass
+
+class AnomalyDetector:
+    """
+    Usage:
+        detector = AnomalyDetector()
+        for each new sample:
+            flags = detector.update(record)
+
+    record needs node, alloc_cores, total_cores, used_cores, used_mem
+    and total_mem. Nodes whose used_cores is None (they did not answer)
+    are not flagged, and their state is left alone.
+    """
+    __slots__ = {
+        'alpha': 'weight of the newest sample in the moving averages',
+        'sustain': 'consecutive samples for which a condition must hold',
+        'zscore': 'standard deviations above the mean that make a surge',
+        'warmup': 'samples needed before a surge can be detected',
+        'overload_margin': 'fraction of the cores by which load may exceed the allocation',
+        'idle_fraction': 'fraction of the allocated cores below which a node is idle',
+        'mem_fraction': 'fraction of the total memory at which memory is full',
+        'nodes': 'the NodeStats, by node name'
+        }
+
+    __values__ = (0.3, 3, 3.0, 5, 0.25, 0.1, 0.95, None)
+
+    __defaults__ = dict(zip(__slots__.keys(), __values__))
+
+    def __init__(self, **kwargs) -> None:
+        for k, v in AnomalyDetector.__defaults__.items():
+            setattr(self, k, v)
+
+        for k, v in kwargs.items():
+            if k in AnomalyDetector.__slots__:
+                setattr(self, k, v)
+
+        self.nodes = {}
+
+
+    def update(self, rec:dict) -> Tuple[str, ...]:
+        """
+        Fold one sample into its node's state and return the flags
+        that are raised after it.
+        """
+        load = rec['used_cores']
+        if load is None: return ()
+
+        stats = self.nodes.get(rec['node'])
+        if stats is None:
+            stats = self.nodes[rec['node']] = NodeStats()
+
+        flags = []
+
+        alloc = rec['alloc_cores']
+        total = rec['total_cores']
+
+        # Compare against the average *before* this sample is added. A
+        # surge must also be a sizeable fraction of the node.
+        sd = math.sqrt(stats.load_var)
+        if (stats.n >= self.warmup and
+            load - stats.load_mean > max(self.zscore * sd, 0.1 * total, 1.0)):
+            flags.append(SURGE)
+
+        if not stats.n:
+            stats.load_mean = load
+        else:
+            diff = load - stats.load_mean
+            incr = self.alpha * diff
+            stats.load_mean += incr
+            stats.load_var = (1 - self.alpha) * (stats.load_var + diff * incr)
+        stats.n += 1
+
+        conditions = {
+            OVERLOADED: load > total or load > alloc + max(self.overload_margin * total, 1),
+            IDLE: alloc > 0 and load < max(self.idle_fraction * alloc, 0.5),
+            MEMFULL: rec['used_mem'] is not None and bool(rec['total_mem']) and
+                rec['used_mem'] >= self.mem_fraction * rec['total_mem']
+            }
+
+        for name, holds in conditions.items():
+            stats.streaks[name] = stats.streaks[name] + 1 if holds else 0
+            if stats.streaks[name] >= self.sustain:
+                flags.append(name)
+
+        return tuple(sorted(flags))
+
+
+    def forget(self, node:str) -> None:
+        """
+        Drop a node's state, e.g., when it leaves the cluster.
+        """
+        self.nodes.pop(node, None)
@@ -0,0 +1,235 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Measure how a refresh scales with the size of the cluster. For each
+size, a simulated cluster (fake_cluster.py, linked as sinfo, squeue
+and ssh) is put on the PATH, and refresh_worker.py times one refresh
+against it. While the worker runs, its process tree is sampled for the
+number of processes and open file descriptors. When it exits, wait4 gives
+the CPU time and peak RSS of the worker and its children.
+
+    python3 bench/bench_refresh.py --sizes 30,300,3000 --latency 0.1 --hung 0.01
+
+This runs on any Linux box; it needs neither SLURM nor ssh.
+"""
+
+import typing
+from   typing import *
+
+###
+# Credits
+###
+__author__ = 'Alina Enikeeva'
+__copyright__ = 'Copyright 2022, University of Richmond'
+__credits__ = None
+__version__ = 0.1
+__maintainer__ = 'Alina Enikeeva, George Flanagin'
+__email__ = 'hpc@richmond.edu'
+__status__ = 'in progress'
+__license__ = 'MIT'
+
+###
+# Standard imports, starting with os and sys
+###
+min_py = (3, 8)
+import os
+import sys
+if sys.version_info < min_py:
+    print(f"This program requires Python {min_py[0]}.{min_py[1]}, or higher.")
+    sys.exit(os.EX_SOFTWARE)
+
+###
+# Other standard distro imports
+###
+import argparse
+import contextlib
+import json
+import shutil
+import signal
+import subprocess
+import tempfile
+import time
+
+###
+# global objects
+###
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+FAKE = os.path.join(BENCH_DIR, 'fake_cluster.py')
+WORKER = os.path.join(BENCH_DIR, 'refresh_worker.py')
+
+PHASES = ('node_list', 'sinfo', 'probe', 'get_info', 'how_busy', 'render')
+
+
+def fake_path(directory:str, commands:Iterable[str]=('sinfo', 'squeue', 'ssh')) -> str:
+    """
+    Make a bin directory whose commands are the fake cluster, and
+    return a PATH that finds them first.
+    """
+    bindir = os.path.join(directory, 'bin')
+    os.makedirs(bindir, exist_ok=True)
+    for command in commands:
+        link = os.path.join(bindir, command)
+        if not os.path.lexists(link):
+            os.symlink(FAKE, link)
+    return f"{bindir}{os.pathsep}{os.environ.get('PATH', '')}"
+
+
+def cluster_env(directory:str, nodes:int, myargs:argparse.Namespace) -> dict:
+    """
+    The environment for a simulated cluster of this size.
+    """
+    env = dict(os.environ)
+    env['PATH'] = fake_path(directory)
+    env.update({
+        'AV_BENCH_NODES': str(nodes),
+        'AV_BENCH_LATENCY': str(myargs.latency),
+        'AV_BENCH_FAIL': str(myargs.fail),
+        'AV_BENCH_HUNG': str(myargs.hung),
+        'AV_BENCH_HANG': str(myargs.hang),
+        'AV_BENCH_SEED': str(myargs.seed),
+        'AV_BENCH_ROOT': os.path.join(directory, 'nodes')
+        })
+    return env
+
+
+def process_tree(root:int) -> List[int]:
+    """
+    The pid of root, and of all its descendants.
+    """
+    children = {}
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit(): continue
+        try:
+            with open(f'/proc/{entry}/stat') as f:
+                stat = f.read()
+        except OSError:
+            continue
+        # The command name can contain spaces, so look after its ')'.
+        ppid = int(stat[stat.rindex(')')+2:].split()[1])
+        children.setdefault(ppid, []).append(int(entry))
+
+    tree = [root]
+    for pid in tree:
+        tree.extend(children.get(pid, ()))
+    return tree
+
+
+def open_fds(pid:int) -> int:
+    try:
+        return len(os.listdir(f'/proc/{pid}/fd'))
+    except OSError:
+        return 0
+
+
+def run_one(nodes:int, myargs:argparse.Namespace) -> dict:
+    """
+    Time one refresh of a cluster with this many nodes.
+    """
+    directory = tempfile.mkdtemp(prefix=f'av-bench-{nodes}-')
+    workdir = os.path.join(directory, 'run')
+    os.makedirs(workdir)
+    output = os.path.join(directory, 'results.json')
+
+    result = dict(nodes=nodes, status='ok', peak_procs=0, peak_fds=0, peak_worker_fds=0)
+    start = time.perf_counter()
+    proc = subprocess.Popen([sys.executable, WORKER, output],
+        cwd=workdir, env=cluster_env(directory, nodes, myargs),
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+        start_new_session=True)
+
+    try:
+        while True:
+            pid, status, rusage = os.wait4(proc.pid, os.WNOHANG)
+            if pid: break
+
+            tree = process_tree(proc.pid)
+            result['peak_procs'] = max(result['peak_procs'], len(tree))
+            result['peak_fds'] = max(result['peak_fds'], sum(open_fds(_) for _ in tree))
+            result['peak_worker_fds'] = max(result['peak_worker_fds'], open_fds(proc.pid))
+
+            if time.perf_counter() - start > myargs.timeout:
+                result['status'] = 'timeout'
+                os.killpg(proc.pid, signal.SIGKILL)
+                pid, status, rusage = os.wait4(proc.pid, 0)
+                break
+            time.sleep(myargs.interval)
+    finally:
+        proc.returncode = -1
+
+    result['wall'] = time.perf_counter() - start
+    if result['status'] == 'ok' and os.waitstatus_to_exitcode(status):
+        result['status'] = f"exit {os.waitstatus_to_exitcode(status)}"
+    result['cpu'] = rusage.ru_utime + rusage.ru_stime
+    result['maxrss_mb'] = rusage.ru_maxrss / 1024
+
+    with contextlib.suppress(OSError, ValueError):
+        with open(output) as f:
+            result.update(json.load(f))
+
+    # Killing the worker's session also takes care of any hung ssh.
+    with contextlib.suppress(OSError):
+        os.killpg(proc.pid, signal.SIGKILL)
+    myargs.keep or shutil.rmtree(directory, ignore_errors=True)
+    return result
+
+
+def report(results:List[dict]) -> None:
+    """
+    One line per cluster size. Phases that did not finish are shown
+    as a dash.
+    """
+    columns = ('nodes', 'status', 'answered', 'wall') + PHASES + (
+        'peak_procs', 'peak_fds', 'peak_worker_fds', 'cpu', 'maxrss_mb')
+    print(" ".join(_.rjust(max(len(_), 8)) for _ in columns))
+    for result in results:
+        cells = []
+        for c in columns:
+            v = result.get('phases', {}).get(c, result.get(c, '-'))
+            v = f"{v:.3f}" if isinstance(v, float) else str(v)
+            cells.append(v.rjust(max(len(c), 8)))
+        print(" ".join(cells))
+
+
+def bench_refresh_main(myargs:argparse.Namespace) -> int:
+    results = []
+    for size in ( int(_) for _ in myargs.sizes.split(',') ):
+        results.append(run_one(size, myargs))
+        if not myargs.json:
+            sys.stderr.write(f"{size} nodes: {results[-1]['status']} in {results[-1]['wall']:.2f}s\n")
+
+    if myargs.json:
+        print(json.dumps(results, indent=4))
+    else:
+        report(results)
+
+    return os.EX_OK if all(_['status'] == 'ok' for _ in results) else os.EX_SOFTWARE
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(prog="bench_refresh",
+        description="Measure activityview's refresh against simulated clusters of several sizes.")
+
+    parser.add_argument('--sizes', type=str, default="30,100,500,1000,5000",
+        help="Comma separated cluster sizes.")
+    parser.add_argument('--latency', type=float, default=0.05,
+        help="Mean seconds for each ssh command.")
+    parser.add_argument('--fail', type=float, default=0.0,
+        help="Fraction of nodes whose ssh fails.")
+    parser.add_argument('--hung', type=float, default=0.0,
+        help="Fraction of nodes whose ssh hangs.")
+    parser.add_argument('--hang', type=float, default=600.0,
+        help="Seconds that a hung ssh hangs.")
+    parser.add_argument('--seed', type=int, default=0,
+        help="Seed for the simulated cluster.")
+    parser.add_argument('--timeout', type=float, default=300.0,
+        help="Seconds to allow each cluster size before giving up on it.")
+    parser.add_argument('--interval', type=float, default=0.1,
+        help="Seconds between samples of the process tree.")
+    parser.add_argument('--keep', action='store_true',
+        help="Keep the scratch directories.")
+    parser.add_argument('--json', action='store_true',
+        help="Print the results as JSON.")
+
+    myargs = parser.parse_args()
+    sys.exit(bench_refresh_main(myargs))
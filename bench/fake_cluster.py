@@ -0,0 +1,376 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+A simulated SLURM cluster for benchmarks. This one file stands in for
+sinfo, squeue and ssh; it decides which one it is from the name it was
+called by, so put symlinks with those names that point to it on the
+PATH.
+
+The cluster is described by environment variables:
+
+    AV_BENCH_CLUSTERS -- comma separated cluster names, which are also
+                         the prefixes of their node names (spdr). The
+                         first one is the local cluster; sinfo -M picks
+                         the others.
+    AV_BENCH_NODES    -- number of nodes in each cluster (30).
+    AV_BENCH_CORES    -- cores per node (52).
+    AV_BENCH_LATENCY  -- mean seconds an ssh command takes (0.05).
+    AV_BENCH_FAIL     -- fraction of nodes whose ssh fails at once (0).
+    AV_BENCH_HUNG     -- fraction of nodes whose ssh hangs (0).
+    AV_BENCH_HANG     -- seconds that a hung ssh hangs before failing (600).
+    AV_BENCH_SINFO    -- seconds that sinfo takes (0).
+    AV_BENCH_DOWN     -- fraction of nodes that sinfo reports as down (0.03).
+    AV_BENCH_PERIOD   -- seconds between changes in the allocations (60).
+    AV_BENCH_SEED     -- makes the cluster reproducible (0).
+    AV_BENCH_ROOT     -- where the fake /proc trees are written.
+
+ssh does not interpret the remote command; it runs it with sh after
+pointing /proc and /sys at a fake tree for the node (as ./proc and
+./sys, relative to the node's directory), with a cgroup for each of
+the node's jobs. The remote commands can change without this
+file having to know about them.
+"""
+
+import typing
+from   typing import *
+
+###
+# Credits
+###
+__author__ = 'Alina Enikeeva'
+__copyright__ = 'Copyright 2022, University of Richmond'
+__credits__ = None
+__version__ = 0.1
+__maintainer__ = 'Alina Enikeeva, George Flanagin'
+__email__ = 'hpc@richmond.edu'
+__status__ = 'in progress'
+__license__ = 'MIT'
+
+###
+# Standard imports, starting with os and sys
+###
+min_py = (3, 8)
+import os
+import sys
+if sys.version_info < min_py:
+    print(f"This program requires Python {min_py[0]}.{min_py[1]}, or higher.")
+    sys.exit(os.EX_SOFTWARE)
+
+###
+# Other standard distro imports
+###
+from   datetime import datetime
+import random
+import shutil
+import subprocess
+import tempfile
+import time
+import zlib
+
+###
+# global objects
+###
+def env(name:str, default:str) -> str:
+    return os.environ.get(f"AV_BENCH_{name}", default)
+
+CLUSTERS = env('CLUSTERS', 'spdr').split(',')
+NODES   = int(env('NODES', '30'))
+CORES   = int(env('CORES', '52'))
+LATENCY = float(env('LATENCY', '0.05'))
+FAIL    = float(env('FAIL', '0'))
+HUNG    = float(env('HUNG', '0'))
+HANG    = float(env('HANG', '600'))
+SINFO   = float(env('SINFO', '0'))
+DOWN    = float(env('DOWN', '0.03'))
+PERIOD  = float(env('PERIOD', '60'))
+SEED    = env('SEED', '0')
+ROOT    = env('ROOT', os.path.join(tempfile.gettempdir(), f"av-bench-{os.getuid()}"))
+
+BOOT = 1.6e9
+MEMORIES = (384000, 768000, 1536000)
+USERS = ('alice', 'bob', 'carol', 'dave', 'erin', 'frank', 'grace', 'heidi')
+WIDTH = max(2, len(str(NODES)))
+
+
+def node_names(cluster:str=None) -> List[str]:
+    """
+    The nodes of one cluster, or of all of them.
+    """
+    clusters = CLUSTERS if cluster is None else [cluster]
+    return [ f"{c}{i:0{WIDTH}d}" for c in clusters for i in range(1, NODES+1) ]
+
+
+def rng(node:str, *salt:object) -> random.Random:
+    """
+    A generator that always gives the same numbers for the same node
+    and salt.
+    """
+    return random.Random(zlib.crc32(f"{SEED}/{node}/{'/'.join(map(str, salt))}".encode()))
+
+
+def node_kind(node:str) -> str:
+    """
+    down, fail, hung, or up. The fraction of each kind is set in the
+    environment.
+    """
+    x = rng(node, 'kind').random()
+    for kind, fraction in (('down', DOWN), ('fail', FAIL), ('hung', HUNG)):
+        if x < fraction: return kind
+        x -= fraction
+    return 'up'
+
+
+def node_state(node:str, now:float) -> dict:
+    """
+    What the scheduler thinks of the node right now. The allocation
+    changes every PERIOD seconds.
+    """
+    r = rng(node, 'state', int(now // PERIOD))
+    total = MEMORIES[rng(node, 'memory').randrange(len(MEMORIES))]
+    if node_kind(node) == 'down':
+        return dict(state='down*', alloc=0, mem_total=total, mem_free=0)
+
+    alloc = r.choice((0, r.randrange(1, CORES), CORES))
+    state = 'idle' if not alloc else 'alloc' if alloc == CORES else 'mix'
+    mem_free = int(total * (1 - r.random() * alloc / CORES))
+    return dict(state=state, alloc=alloc, mem_total=total, mem_free=mem_free)
+
+
+###
+# sinfo
+###
+def sinfo(argv:List[str]) -> int:
+    fmt = '%P %a %l %D %t %N'
+    header = True
+    clusters = None
+    for i, arg in enumerate(argv):
+        if arg == '-o': fmt = argv[i+1]
+        elif arg.startswith('--format='): fmt = arg.split('=', 1)[1]
+        elif arg in ('-h', '--noheader'): header = False
+        elif arg == '-M': clusters = argv[i+1]
+        elif arg.startswith('--clusters='): clusters = arg.split('=', 1)[1]
+
+    time.sleep(SINFO)
+    if clusters is None:
+        return sinfo_cluster(CLUSTERS[0], fmt, header)
+
+    names = CLUSTERS if clusters == 'all' else clusters.split(',')
+    for cluster in names:
+        if cluster not in CLUSTERS:
+            sys.stderr.write(f"sinfo: error: No cluster named {cluster}\n")
+            return 1
+    for cluster in names:
+        print(f"CLUSTER: {cluster}")
+        sinfo_cluster(cluster, fmt, header)
+    return os.EX_OK
+
+
+def sinfo_cluster(cluster:str, fmt:str, header:bool) -> int:
+    now = time.time()
+    titles = {'%n':'HOSTNAMES', '%N':'NODELIST', '%e':'FREE_MEM', '%m':'MEMORY',
+        '%t':'STATE', '%T':'STATE', '%c':'CPUS', '%C':'CPUS(A/I/O/T)', '%P':'PARTITION', '%R':'PARTITION'}
+    fields = fmt.split()
+    if header: print(" ".join(titles.get(_, _) for _ in fields))
+
+    for node in node_names(cluster):
+        s = node_state(node, now)
+        down = s['state'].startswith('down')
+        values = {
+            '%n': node, '%N': node, '%P': 'basic*', '%R': 'basic',
+            '%e': 'N/A' if down else str(s['mem_free']),
+            '%m': str(s['mem_total']),
+            '%t': s['state'], '%T': s['state'],
+            '%c': str(CORES),
+            '%C': f"{s['alloc']}/{CORES - s['alloc'] if not down else 0}/{CORES if down else 0}/{CORES}"
+            }
+        print(" ".join(values.get(_, _) for _ in fields))
+    return os.EX_OK
+
+
+###
+# squeue
+###
+def running_jobs(cluster:str, now:float) -> List[dict]:
+    """
+    The jobs that account for each node's allocation. A node's cores
+    are split among one to three jobs, and some whole-node jobs run on
+    several neighbouring nodes.
+    """
+    period = int(now // PERIOD)
+    jobs = []
+    current = None
+    for node in node_names(cluster):
+        alloc = node_state(node, now)['alloc']
+        if not alloc:
+            current = None
+            continue
+
+        r = rng(node, 'jobs', period)
+        if alloc == CORES and current is not None and current['whole'] and r.random() < 0.6:
+            current['nodes'].append(node)
+            current['cpus'] += alloc
+            continue
+
+        cuts = sorted(r.sample(range(1, alloc), min(alloc-1, r.randrange(3)))) if alloc > 1 else []
+        parts = [ b - a for a, b in zip([0] + cuts, cuts + [alloc]) ]
+        for i, cpus in enumerate(parts):
+            start = period * PERIOD - r.uniform(0, 10) * PERIOD
+            jobs.append(dict(id=1000000 + zlib.crc32(f"{node}/{period}/{i}".encode()) % 9000000,
+                user=r.choice(USERS), cpus=cpus, nodes=[node], mem=f"{r.choice((4, 8, 16, 32))}G",
+                whole=(alloc == CORES and len(parts) == 1),
+                start=start, end=start + r.uniform(1, 30) * PERIOD))
+        current = jobs[-1]
+    return jobs
+
+
+def hostlist(nodes:List[str]) -> str:
+    """
+    Consecutive nodes of one cluster as a hostlist expression.
+    """
+    if len(nodes) == 1: return nodes[0]
+    prefix = nodes[0].rstrip('0123456789')
+    return f"{prefix}[{nodes[0][len(prefix):]}-{nodes[-1][len(prefix):]}]"
+
+
+def squeue(argv:List[str]) -> int:
+    fmt = '%.18i %.9P %.8j %.8u %.2t %.10M %.6D %R'
+    header = True
+    clusters = None
+    for i, arg in enumerate(argv):
+        if arg == '-o': fmt = argv[i+1]
+        elif arg.startswith('--format='): fmt = arg.split('=', 1)[1]
+        elif arg in ('-h', '--noheader'): header = False
+        elif arg == '-M': clusters = argv[i+1]
+
+    time.sleep(SINFO)
+    now = time.time()
+    stamp = lambda t: datetime.fromtimestamp(t).strftime('%Y-%m-%dT%H:%M:%S')
+    codes = ('%i', '%u', '%C', '%m', '%D', '%N', '%e', '%S', '%P', '%T', '%t', '%j')
+    names = [CLUSTERS[0]] if clusters is None else CLUSTERS if clusters == 'all' else clusters.split(',')
+    for cluster in names:
+        if clusters is not None: print(f"CLUSTER: {cluster}")
+        if header: print(fmt)
+        for job in running_jobs(cluster, now):
+            values = {'%i': str(job['id']), '%u': job['user'], '%C': str(job['cpus']),
+                '%m': job['mem'], '%D': str(len(job['nodes'])), '%N': hostlist(job['nodes']),
+                '%e': stamp(job['end']), '%S': stamp(job['start']), '%P': 'basic',
+                '%T': 'RUNNING', '%t': 'R', '%j': f"job{job['id'] % 1000}"}
+            line = fmt
+            for code in codes:
+                line = line.replace(code, values[code])
+            print(line)
+    return os.EX_OK
+
+
+###
+# ssh
+###
+def write_proc(node:str, now:float) -> str:
+    """
+    Write the fake /proc files for a node, and return the directory
+    that stands in for /proc.
+    """
+    s = node_state(node, now)
+    r = rng(node, 'load', int(now // PERIOD))
+    load = s['alloc'] * r.uniform(0.2, 1.4)
+    used_kb = (s['mem_total'] - s['mem_free']) * 1000
+    total_kb = s['mem_total'] * 1000
+
+    proc = os.path.join(ROOT, node, 'proc')
+    os.makedirs(proc, exist_ok=True)
+
+    # Counters in /proc/stat must only ever go up, so they are driven
+    # by the clock.
+    ticks = int(now * 100)
+    busy = min(load, CORES) / CORES
+    cpu = lambda n: (f"{int(ticks * n * busy * 0.9)} 0 {int(ticks * n * busy * 0.1)} "
+        f"{int(ticks * n * (1 - busy))} 0 0 0 0 0 0")
+
+    files = {
+        'loadavg': f"{load:.2f} {load:.2f} {load:.2f} 3/{400 + s['alloc']} {os.getpid()}\n",
+        'meminfo': (f"MemTotal:       {total_kb} kB\nMemFree:        {total_kb - used_kb} kB\n"
+            f"MemAvailable:   {total_kb - used_kb} kB\n"),
+        'stat': (f"cpu  {cpu(CORES)}\n" + "".join(f"cpu{i} {cpu(1)}\n" for i in range(CORES)) +
+            f"btime {int(now) - 86400}\n"),
+        'uptime': f"{now - BOOT:.2f} {(now - BOOT) * CORES * (1 - busy):.2f}\n"
+        }
+    for name, text in files.items():
+        tmp = os.path.join(proc, f".{name}.{os.getpid()}")
+        with open(tmp, 'w') as f:
+            f.write(text)
+        os.replace(tmp, os.path.join(proc, name))
+    write_cgroups(node, now)
+    return proc
+
+
+def write_cgroups(node:str, now:float) -> None:
+    """
+    Write a cgroup v2 directory for each job on the node, as slurmstepd
+    does, with CPU time that grows with the job's cores.
+    """
+    cluster = next(( c for c in CLUSTERS if node.startswith(c) ), CLUSTERS[0])
+    scope = os.path.join(ROOT, node, 'sys', 'fs', 'cgroup', 'system.slice', 'slurmstepd.scope')
+    shutil.rmtree(scope, ignore_errors=True)
+    for job in running_jobs(cluster, now):
+        if node not in job['nodes']: continue
+        cpus = job['cpus'] // len(job['nodes'])
+        share = rng(node, 'cgroup', job['id'], int(now // PERIOD)).uniform(0.1, 1.2)
+        d = os.path.join(scope, f"job_{job['id']}")
+        os.makedirs(d, exist_ok=True)
+        with open(os.path.join(d, 'cpu.stat'), 'w') as f:
+            f.write(f"usage_usec {int((now - BOOT) * 1e6 * cpus * share)}\nuser_usec 0\nsystem_usec 0\n")
+        with open(os.path.join(d, 'memory.current'), 'w') as f:
+            f.write(f"{int(cpus * share * 2e9)}\n")
+
+
+def ssh(argv:List[str]) -> int:
+    takes_value = set('bcDEeFIiJLlmOoPpQRSWw')
+    args = iter(argv)
+    host = None
+    for arg in args:
+        if arg.startswith('-') and len(arg) == 2 and arg[1] in takes_value:
+            next(args, None)
+        elif arg.startswith('-'):
+            continue
+        else:
+            host = arg
+            break
+    command = " ".join(args)
+
+    if host is None:
+        sys.stderr.write("usage: ssh destination [command]\n")
+        return 255
+
+    kind = node_kind(host) if host in set(node_names()) else 'unknown'
+    if kind in ('down', 'fail', 'unknown'):
+        time.sleep(LATENCY)
+        sys.stderr.write(f"ssh: connect to host {host} port 22: Connection timed out\n")
+        return 255
+    if kind == 'hung':
+        time.sleep(HANG)
+        return 255
+
+    time.sleep(random.expovariate(1 / LATENCY) if LATENCY else 0)
+    proc = write_proc(host, time.time())
+    # Relative paths, so that the output looks like it came from /proc.
+    os.chdir(os.path.dirname(proc))
+    command = command.replace('/proc/', "./proc/").replace('/sys/', "./sys/")
+    if 'while :' not in command:
+        os.execvp('sh', ['sh', '-c', command])
+
+    # A command that loops, like a probe session, reads the files again
+    # and again, so they are rewritten every second while it runs.
+    child = subprocess.Popen(['sh', '-c', command])
+    while child.poll() is None:
+        time.sleep(1)
+        write_proc(host, time.time())
+    return child.returncode
+
+
+if __name__ == '__main__':
+    me = os.path.basename(sys.argv[0])
+    commands = {'sinfo': sinfo, 'squeue': squeue, 'ssh': ssh}
+    if me not in commands:
+        sys.stderr.write(f"Link this file as one of {', '.join(commands)}.\n")
+        sys.exit(os.EX_USAGE)
+    sys.exit(commands[me](sys.argv[1:]))
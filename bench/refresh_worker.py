@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+"""
+Run one refresh of activityview against whatever sinfo and ssh are on
+the PATH, timing each phase, and write the timings as JSON to the file
+named on the command line. bench_refresh.py runs this in a scratch
+directory, because activityview writes its log file to $PWD.
+"""
+
+import typing
+from   typing import *
+
+###
+# Credits
+###
+__author__ = 'Alina Enikeeva'
+__copyright__ = 'Copyright 2022, University of Richmond'
+__credits__ = None
+__version__ = 0.1
+__maintainer__ = 'Alina Enikeeva, George Flanagin'
+__email__ = 'hpc@richmond.edu'
+__status__ = 'in progress'
+__license__ = 'MIT'
+
+###
+# Standard imports, starting with os and sys
+###
+min_py = (3, 8)
+import os
+import sys
+if sys.version_info < min_py:
+    print(f"This program requires Python {min_py[0]}.{min_py[1]}, or higher.")
+    sys.exit(os.EX_SOFTWARE)
+
+###
+# Other standard distro imports
+###
+import argparse
+import json
+import logging
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+###
+# imports that are a part of this project
+###
+import activityview
+import view_utils
+
+
+def timed(phases:dict, name:str, f:Callable, *args) -> object:
+    """
+    Call f, and record how long it took under name.
+    """
+    start = time.perf_counter()
+    result = f(*args)
+    phases[name] = time.perf_counter() - start
+    return result
+
+
+def refresh_worker_main(myargs:argparse.Namespace) -> int:
+    phases = {}
+    results = {"phases": phases}
+
+    def save() -> None:
+        with open(myargs.output, 'w') as f:
+            json.dump(results, f)
+
+    activityview.logger = view_utils.URLogger(level=logging.WARNING)
+    activityview.myargs = argparse.Namespace(input="", refresh=0,
+        headless=True, format='text', history="",
+        probe_concurrency=myargs.probe_concurrency, probe_timeout=myargs.probe_timeout)
+
+    nodes = timed(phases, 'node_list', activityview.get_host_names, activityview.myargs)
+    activityview.myargs.input = nodes
+    results['nodes'] = len(nodes)
+    save()
+
+    # The phases of a refresh, one at a time, and then the refresh as
+    # a whole, as the TUI and --headless call it.
+    data = timed(phases, 'sinfo', view_utils.SeekINFO)
+    save()
+    timed(phases, 'probe', lambda: list(activityview.probe_nodes(activityview.nodes_by_state(data, nodes))))
+    save()
+    snapshot = timed(phases, 'get_info', activityview.get_info)
+    save()
+
+    records = sorted(snapshot.values(), key=lambda rec: rec.node)
+    timed(phases, 'how_busy', lambda: [ activityview.how_busy(rec.node) for rec in records ])
+    timed(phases, 'render', lambda: [ (activityview.format_node(rec), activityview.node_color(rec))
+        for rec in records ])
+
+    results['answered'] = sum(1 for rec in records if rec.used_cores is not None)
+    results['instrumented'] = activityview.timer.as_dict()
+    save()
+    return os.EX_OK
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(prog="refresh_worker",
+        description="Time one activityview refresh against the sinfo and ssh on the PATH.")
+
+    parser.add_argument('output', type=str,
+        help="File for the JSON results.")
+
+    parser.add_argument('--probe-concurrency', type=int, default=64,
+        help="Number of nodes probed at once.")
+    parser.add_argument('--probe-timeout', type=float, default=10.0,
+        help="Seconds allowed for each node's probe.")
+
+    myargs = parser.parse_args()
+    sys.exit(refresh_worker_main(myargs))
@@ -0,0 +1,339 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Leave activityview refreshing for a long time against a simulated
+cluster, and watch for leaks. The refreshes run in this process as
+map_cores runs them: in a BackgroundRefresh thread, with the queued
+logger of activityview's __main__, the rows drawn (into strings) on
+this thread as they arrive. They run every --cadence seconds rather
+than every minute, and the allocations of the simulated cluster
+change every --period seconds. The child processes of --sessions are
+not counted as left behind. Every --sample seconds, the RSS, the open file
+descriptors, the child processes and the memory traced by tracemalloc
+are recorded; the first --warmup refreshes are the baseline.
+
+    python3 bench/soak.py --duration 7200 --nodes 300 --jobs --cgroups
+
+The soak fails (exit status 70) if, at the end, any of them has grown
+past its bound, or if any refresh left a child process behind. The
+code that allocated the most since the baseline is listed either way.
+"""
+
+import typing
+from   typing import *
+
+###
+# Credits
+###
+__author__ = 'Alina Enikeeva'
+__copyright__ = 'Copyright 2022, University of Richmond'
+__credits__ = None
+__version__ = 0.1
+__maintainer__ = 'Alina Enikeeva, George Flanagin'
+__email__ = 'hpc@richmond.edu'
+__status__ = 'in progress'
+__license__ = 'MIT'
+
+###
+# Standard imports, starting with os and sys
+###
+min_py = (3, 8)
+import os
+import sys
+if sys.version_info < min_py:
+    print(f"This program requires Python {min_py[0]}.{min_py[1]}, or higher.")
+    sys.exit(os.EX_SOFTWARE)
+
+###
+# Other standard distro imports
+###
+import argparse
+import gc
+import json
+import logging
+import shutil
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+###
+# imports that are a part of this project
+###
+from   bench_refresh import fake_path, open_fds, process_tree
+
+###
+# global objects
+###
+MB = 1024 * 1024
+
+
+def rss_mb() -> float:
+    """
+    The resident set size of this process, from /proc.
+    """
+    with open('/proc/self/status') as f:
+        for line in f:
+            if line.startswith('VmRSS:'):
+                return int(line.split()[1]) / 1024
+    return 0.0
+
+
+def session_of(pid:int) -> Optional[int]:
+    """
+    The session id of the process, or None if it has gone.
+    """
+    try:
+        with open(f'/proc/{pid}/stat') as f:
+            stat = f.read()
+    except OSError as e:
+        return None
+    return int(stat[stat.rindex(')')+2:].split()[3])
+
+
+def sample(start:float, refreshes:int) -> dict:
+    """
+    What this process is holding right now.
+    """
+    gc.collect()
+    traced, _ = tracemalloc.get_traced_memory()
+    return dict(elapsed=round(time.monotonic() - start, 1), refreshes=refreshes,
+        rss_mb=round(rss_mb(), 2), fds=open_fds(os.getpid()),
+        children=len(process_tree(os.getpid())) - 1, traced_mb=round(traced / MB, 2))
+
+
+def growth_sites(baseline:tracemalloc.Snapshot, n:int) -> List[str]:
+    """
+    The n lines of code that allocated the most since the baseline,
+    leaving out the soak's own bookkeeping.
+    """
+    import bench_refresh
+    now = tracemalloc.take_snapshot().filter_traces((
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, __file__),
+        tracemalloc.Filter(False, bench_refresh.__file__),
+        tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+        ))
+    return [ str(stat) for stat in now.compare_to(baseline, 'lineno')[:n] if stat.size_diff > 0 ]
+
+
+def check(baseline:dict, last:dict, worst_children:int, myargs:argparse.Namespace) -> List[str]:
+    """
+    The bounds that the soak went past, if any.
+    """
+    failures = []
+    bounds = (('rss_mb', myargs.max_rss_growth), ('fds', myargs.max_fd_growth),
+        ('traced_mb', myargs.max_traced_growth))
+    for key, bound in bounds:
+        if last[key] - baseline[key] > bound:
+            failures.append(f"{key} grew by {last[key] - baseline[key]:.2f} (bound {bound})")
+    if worst_children > myargs.max_children:
+        failures.append(f"{worst_children} child processes were left after a refresh (bound {myargs.max_children})")
+    return failures
+
+
+def soak_main(myargs:argparse.Namespace) -> int:
+    directory = tempfile.mkdtemp(prefix='av-soak-')
+    os.environ.update({
+        'PATH': fake_path(directory),
+        'AV_BENCH_NODES': str(myargs.nodes),
+        'AV_BENCH_LATENCY': str(myargs.latency),
+        'AV_BENCH_FAIL': str(myargs.fail),
+        'AV_BENCH_HUNG': str(myargs.hung),
+        'AV_BENCH_HANG': str(myargs.hang),
+        'AV_BENCH_PERIOD': str(myargs.period),
+        'AV_BENCH_SEED': str(myargs.seed),
+        'AV_BENCH_ROOT': os.path.join(directory, 'nodes'),
+        'XDG_CACHE_HOME': os.path.join(directory, 'cache')
+        })
+    # activityview writes its log file to $PWD.
+    os.makedirs(os.path.join(directory, 'run'))
+    os.chdir(os.path.join(directory, 'run'))
+
+    import activityview
+    from   history_store import HistoryStore
+    import placement
+    import view_utils
+
+    # The logger, the options and the refresh are those of the map, so
+    # that what leaks there leaks here.
+    activityview.logger = view_utils.URLogger(level=myargs.verbose, queued=True, burst=10)
+    activityview.myargs = argparse.Namespace(input="", input_file="", nodes="", clusters="",
+        refresh=myargs.cadence, headless=False, format='text',
+        history=os.path.join(directory, 'history') if myargs.history else "",
+        probe_concurrency=myargs.probe_concurrency, probe_timeout=myargs.probe_timeout,
+        jobs=myargs.jobs, cgroups=myargs.cgroups, place=placement.parse_request('cores=8,mem=16G'),
+        stagger=myargs.stagger, sessions=myargs.sessions,
+        no_cache=False, shared=None, shared_ttl=None)
+    if myargs.history:
+        activityview.history = HistoryStore(activityview.myargs.history)
+    refresher = activityview.BackgroundRefresh()
+
+    def refresh() -> int:
+        """
+        One refresh, run and drawn as map_cores runs and draws it, but
+        into strings.
+        """
+        rows = {}
+        def draw(rec:view_utils.SloppyDict) -> None:
+            rows[activityview.record_key(rec)] = (activityview.format_node(rec),
+                activityview.node_color(rec))
+
+        refresher.start()
+        while True:
+            running = refresher.running
+            whole, changed = refresher.poll()
+            if whole:
+                rows.clear()
+                for rec in refresher.shown.values(): draw(rec)
+            for rec in changed: draw(rec)
+            if not running: break
+            time.sleep(activityview.POLL_MS / 1000)
+
+        info = activityview.in_order(refresher.shown)
+        lines = [ _ if isinstance(_, str) else activityview.format_node(_)
+            for _ in activityview.sections(info) ]
+        lines.append(activityview.suggestion_line(info))
+        lines.append(activityview.timer.summary())
+        return len(lines)
+
+    def left_behind() -> int:
+        """
+        The child processes of this one, less the probe sessions and
+        what they run, which are meant to outlive the refreshes. Each
+        session is started in a (Unix) session of its own.
+        """
+        sessions = set()
+        for collector in activityview.collectors:
+            if collector.sessions is None: continue
+            with collector.sessions.arrived:
+                sessions.update(_.proc.pid for _ in collector.sessions.sessions.values()
+                    if _.proc is not None)
+        return sum(1 for pid in process_tree(os.getpid())[1:]
+            if session_of(pid) not in sessions | {None})
+
+    tracemalloc.start(myargs.frames)
+    start = time.monotonic()
+    samples = []
+    baseline = traced_baseline = None
+    worst_children = 0
+    refreshes = 0
+    next_sample = start
+
+    try:
+        while time.monotonic() - start < myargs.duration:
+            refresh()
+            refreshes += 1
+            worst_children = max(worst_children, left_behind())
+
+            if refreshes == myargs.warmup:
+                baseline = sample(start, refreshes)
+                traced_baseline = tracemalloc.take_snapshot()
+                samples.append(baseline)
+                next_sample = time.monotonic() + myargs.sample
+            elif refreshes > myargs.warmup and time.monotonic() >= next_sample:
+                samples.append(sample(start, refreshes))
+                next_sample += myargs.sample
+                if not myargs.json:
+                    print(" ".join(f"{k}={v}" for k, v in samples[-1].items()))
+                    sys.stdout.flush()
+            time.sleep(activityview.next_refresh(refresher.started))
+
+        if baseline is None:
+            sys.stderr.write(f"Only {refreshes} refreshes ran, fewer than --warmup {myargs.warmup}.\n")
+            return os.EX_USAGE
+
+        samples.append(sample(start, refreshes))
+        failures = check(baseline, samples[-1], worst_children, myargs)
+        sites = growth_sites(traced_baseline, myargs.top)
+
+    finally:
+        tracemalloc.stop()
+        activityview.stopping.set()
+        activityview.history is not None and activityview.history.close()
+        for collector in activityview.collectors:
+            collector.close()
+        activityview.logger.close()
+        os.chdir(os.path.dirname(directory))
+        myargs.keep or shutil.rmtree(directory, ignore_errors=True)
+
+    if myargs.json:
+        print(json.dumps(dict(samples=samples, growth_sites=sites, failures=failures,
+            worst_children=worst_children), indent=4))
+    else:
+        print(f"\n{refreshes} refreshes in {samples[-1]['elapsed']:.0f}s; growth since refresh {myargs.warmup}:")
+        for key in ('rss_mb', 'fds', 'traced_mb'):
+            print(f"  {key}: {baseline[key]} -> {samples[-1][key]}")
+        print(f"  most child processes left after a refresh: {worst_children}")
+        print("Top growth sites:")
+        for site in sites: print(f"  {site}")
+        for failure in failures: print(f"FAIL: {failure}")
+
+    return os.EX_SOFTWARE if failures else os.EX_OK
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(prog="soak",
+        description="Refresh activityview against a simulated cluster for a long time, and check for leaks.")
+
+    parser.add_argument('--duration', type=float, default=3600.0,
+        help="Seconds to keep refreshing.")
+    parser.add_argument('--cadence', type=float, default=0.5,
+        help="Seconds between the refreshes.")
+    parser.add_argument('--sample', type=float, default=60.0,
+        help="Seconds between the samples.")
+    parser.add_argument('--warmup', type=int, default=20,
+        help="Refreshes before the baseline is taken.")
+    parser.add_argument('--nodes', type=int, default=100,
+        help="Nodes in the simulated cluster.")
+    parser.add_argument('--latency', type=float, default=0.01,
+        help="Mean seconds for each ssh command.")
+    parser.add_argument('--fail', type=float, default=0.02,
+        help="Fraction of nodes whose ssh fails.")
+    parser.add_argument('--hung', type=float, default=0.0,
+        help="Fraction of nodes whose ssh hangs.")
+    parser.add_argument('--hang', type=float, default=600.0,
+        help="Seconds that a hung ssh hangs.")
+    parser.add_argument('--period', type=float, default=5.0,
+        help="Seconds between changes in the simulated allocations.")
+    parser.add_argument('--seed', type=int, default=0,
+        help="Seed for the simulated cluster.")
+    parser.add_argument('--probe-concurrency', type=int, default=64,
+        help="Number of nodes probed at once.")
+    parser.add_argument('--probe-timeout', type=float, default=2.0,
+        help="Seconds allowed for each node's probe.")
+    parser.add_argument('--jobs', action='store_true',
+        help="Also query squeue, as with activityview --jobs.")
+    parser.add_argument('--cgroups', action='store_true',
+        help="Also read the job cgroups, as with activityview --cgroups.")
+    parser.add_argument('--stagger', action='store_true',
+        help="Spread the probes over the --cadence, as with activityview --stagger.")
+    parser.add_argument('--sessions', action='store_true',
+        help="Keep a probe session open to each node, as with activityview --sessions.")
+    parser.add_argument('--history', action='store_true',
+        help="Record each refresh in a history store, as with activityview --history.")
+    parser.add_argument('-v', '--verbose', type=int, default=logging.INFO,
+        help="The loglevel of activityview's log file, which is written in the scratch directory.")
+
+    parser.add_argument('--max-rss-growth', type=float, default=20.0,
+        help="MB by which the RSS may grow after the warmup.")
+    parser.add_argument('--max-fd-growth', type=int, default=2,
+        help="Open file descriptors that may be added after the warmup.")
+    parser.add_argument('--max-traced-growth', type=float, default=10.0,
+        help="MB by which the memory traced by tracemalloc may grow after the warmup.")
+    parser.add_argument('--max-children', type=int, default=0,
+        help="Child processes that may be left after a refresh.")
+    parser.add_argument('--frames', type=int, default=1,
+        help="Frames of traceback that tracemalloc keeps for each allocation.")
+    parser.add_argument('--top', type=int, default=10,
+        help="Number of growth sites to list.")
+
+    parser.add_argument('--keep', action='store_true',
+        help="Keep the scratch directory.")
+    parser.add_argument('--json', action='store_true',
+        help="Print the samples and the results as JSON.")
+
+    myargs = parser.parse_args()
+    sys.exit(soak_main(myargs))
@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+"""
+What each job on a node is using, from the accounting files of the
+cgroup that SLURM puts it in. One short shell loop, added to the probe
+of the node, prints a line per job:
+
+    job_1234567 <CPU microseconds> <memory bytes>
+
+so the cost grows with the number of jobs on the node, not with the
+number of processes, and no sstat is needed. Both cgroup v2
+(.../slurmstepd.scope/job_N) and v1 (.../slurm/uid_U/job_N) layouts
+are read. The CPU time is a counter, so the cores a job uses come from
+two probes, like the busy cores of the node.
+"""
+
+import typing
+from   typing import *
+
+###
+# Credits
+###
+__author__ = 'Alina Enikeeva'
+__copyright__ = 'Copyright 2022, University of Richmond'
+__credits__ = None
+__version__ = 0.1
+__maintainer__ = 'Alina Enikeeva, George Flanagin'
+__email__ = 'hpc@richmond.edu'
+__status__ = 'in progress'
+__license__ = 'MIT'
+
+
+###
+# Standard imports, starting with os and sys
+###
+min_py = (3, 8)
+import os
+import sys
+if sys.version_info < min_py:
+    print(f"This program requires Python {min_py[0]}.{min_py[1]}, or higher.")
+    sys.exit(os.EX_SOFTWARE)
+
+###
+# global objects
+###
+verbose = False
+
+SEPARATOR = '@@cgroups'
+
+V2_JOBS = '/sys/fs/cgroup/system.slice/slurmstepd.scope/job_*'
+V1_JOBS = '/sys/fs/cgroup/cpuacct/slurm/uid_*/job_*'
+
+# The node's uptime comes first, so that the CPU time of the jobs can
+# be divided by the time that passed on the node itself.
+CGROUP_SCRIPT = "; ".join((
+    f"echo {SEPARATOR} $(cut -d' ' -f1 /proc/uptime)",
+    f"for d in {V2_JOBS}; do [ -d $d ] || continue; "
+        "echo ${d##*/} $(sed -n 's/^usage_usec //p' $d/cpu.stat) $(cat $d/memory.current); done",
+    f"for d in {V1_JOBS}; do [ -d $d ] || continue; "
+        "echo ${d##*/} $(($(cat $d/cpuacct.usage)/1000)) "
+        "$(cat /sys/fs/cgroup/memory/slurm/${d#*/slurm/}/memory.usage_in_bytes); done"
+    ))
+
+
+def parse_cgroups(text:str) -> Tuple[Optional[float], Dict[str, Tuple[int, int]]]:
+    """
+    The output of CGROUP_SCRIPT, from the separator on, as the uptime
+    of the node in seconds and job id -> (CPU microseconds, memory
+    bytes). The uptime is None if the output has no separator.
+    """
+    lines = text.strip().split('\n')
+    header = lines[0].split()
+    if not header or header[0] != SEPARATOR:
+        return None, {}
+    try:
+        uptime = float(header[1])
+    except (IndexError, ValueError) as e:
+        return None, {}
+
+    jobs = {}
+    for line in lines[1:]:
+        fields = line.split()
+        if len(fields) != 3 or not fields[0].startswith('job_'): continue
+        try:
+            jobs[fields[0][4:]] = (int(fields[1]), int(fields[2]))
+        except ValueError as e:
+            continue
+    return uptime, jobs
+
+
+def job_usage(before:Optional[Tuple[float, dict]], after:Tuple[float, dict]) -> List[dict]:
+    """
+    One compact record per job in the later reading: its id, the cores
+    it used between the two readings (None for a job that was not in
+    the earlier one), and its memory in GB.
+    """
+    uptime, jobs = after
+    then, previous = before if before is not None else (None, {})
+    seconds = uptime - then if then is not None else 0
+
+    usage = []
+    for job, (cpu_usec, mem) in sorted(jobs.items()):
+        cores = None
+        if seconds > 0 and job in previous:
+            cores = round(max(0, cpu_usec - previous[job][0]) / 1e6 / seconds, 2)
+        usage.append(dict(id=job, cores=cores, mem=round(mem / 1e9, 2)))
+    return usage
@@ -0,0 +1,204 @@
+# -*- coding: utf-8 -*-
+"""
+The details of one node, for the drill-down pane of the map: the
+processes using the most CPU and the most memory, where the memory
+goes, and how busy each core is. They are fetched with one ssh, only
+when they are asked for, and kept for a short while so that going
+back and forth between the map and a node does not probe it again.
+"""
+
+import typing
+from   typing import *
+
+###
+# Credits
+###
+__author__ = 'Alina Enikeeva'
+__copyright__ = 'Copyright 2022, University of Richmond'
+__credits__ = None
+__version__ = 0.1
+__maintainer__ = 'Alina Enikeeva, George Flanagin'
+__email__ = 'hpc@richmond.edu'
+__status__ = 'in progress'
+__license__ = 'MIT'
+
+
+###
+# Standard imports, starting with os and sys
+###
+min_py = (3, 8)
+import os
+import sys
+if sys.version_info < min_py:
+    print(f"This program requires Python {min_py[0]}.{min_py[1]}, or higher.")
+    sys.exit(os.EX_SOFTWARE)
+
+###
+# Other standard distro imports
+###
+import time
+
+###
+# imports that are a part of this project
+###
+from   procstat import parse_stat, utilization
+from   view_utils import SloppyDict, dorunrun_many
+
+###
+# global objects
+###
+verbose = False
+
+SEPARATOR = '@@'
+PS = "ps -eo pid,user,pcpu,rss,comm --no-headers --sort=-{} | head -{}"
+MEMINFO_KEYS = ('MemTotal', 'MemFree', 'MemAvailable', 'Buffers', 'Cached',
+    'Shmem', 'SwapTotal', 'SwapFree')
+
+
+def detail_command(node:str, top:int=10, interval:float=0.5) -> List[str]:
+    """
+    One ssh for everything: the top processes by CPU and by RSS, the
+    meminfo, and two readings of /proc/stat, interval seconds apart.
+    """
+    remote = "; ".join((
+        PS.format('pcpu', top), f"echo {SEPARATOR}",
+        PS.format('rss', top), f"echo {SEPARATOR}",
+        "cat /proc/meminfo", f"echo {SEPARATOR}",
+        "grep ^cpu /proc/stat", f"sleep {interval}", f"echo {SEPARATOR}",
+        "grep ^cpu /proc/stat"))
+    return ['ssh', '-o', 'ConnectTimeout=1', node, remote]
+
+
+def parse_processes(text:str) -> List[dict]:
+    processes = []
+    for line in text.strip().split('\n'):
+        fields = line.split(None, 4)
+        if len(fields) < 5: continue
+        try:
+            processes.append(dict(pid=int(fields[0]), user=fields[1],
+                cpu=float(fields[2]), rss_mb=int(fields[3]) / 1024, command=fields[4]))
+        except ValueError as e:
+            continue
+    return processes
+
+
+def parse_meminfo(text:str) -> Dict[str, float]:
+    """
+    The interesting lines of /proc/meminfo, in GB.
+    """
+    memory = {}
+    for line in text.split('\n'):
+        key, _, value = line.partition(':')
+        if key in MEMINFO_KEYS and value.split():
+            memory[key] = int(value.split()[0]) / 1e6
+    return memory
+
+
+def parse_detail(stdout:str) -> SloppyDict:
+    parts = stdout.split(f"{SEPARATOR}\n")
+    parts += [""] * (5 - len(parts))
+    cores = utilization(parse_stat(parts[3]), parse_stat(parts[4]))
+    return SloppyDict(
+        top_cpu = parse_processes(parts[0]),
+        top_rss = parse_processes(parts[1]),
+        memory = parse_meminfo(parts[2]),
+        total = cores.pop('cpu', None),
+        cores = sorted(cores.items(), key=lambda c: int(c[0][3:]))
+        )
+
+
+class DetailCache: pass
+
+class DetailCache:
+    """
+    The details of the nodes that have been looked at, each kept for
+    ttl seconds.
+
+    Usage:
+        details = DetailCache(ttl=15)
+        detail = details.get('spdr16')
+
+    Node names are only unique within a cluster, so with --clusters the
+    details are kept by cluster and node.
+    """
+    __slots__ = {
+        'ttl': 'seconds that the details of a node are reused',
+        'timeout': 'seconds allowed for the ssh',
+        'entries': '(cluster, node) -> its details'
+        }
+
+    __values__ = (15.0, 10.0, None)
+
+    __defaults__ = dict(zip(__slots__.keys(), __values__))
+
+    def __init__(self, **kwargs) -> None:
+        for k, v in DetailCache.__defaults__.items():
+            setattr(self, k, v)
+
+        for k, v in kwargs.items():
+            if k in DetailCache.__slots__:
+                setattr(self, k, v)
+
+        self.entries = {}
+
+
+    def get(self, node:str, cluster:str=None, refresh:bool=False) -> SloppyDict:
+        """
+        The details of the node of the cluster (None for the local one),
+        fetched if they are not cached, are too old, or refresh is True.
+        If the ssh fails, the details have an error, and are not cached.
+        """
+        now = time.time()
+        for k in [ k for k, v in self.entries.items() if now - v.time > self.ttl ]:
+            del self.entries[k]
+
+        key = (cluster, node)
+        if not refresh and key in self.entries:
+            return self.entries[key]
+
+        start = time.perf_counter()
+        _, result = next(dorunrun_many({node: detail_command(node)}, timeout=self.timeout))
+        if not result['OK']:
+            return SloppyDict(node=node, cluster=cluster, time=time.time(),
+                seconds=time.perf_counter() - start, error=f"{result['name']} {result['stderr']}".strip())
+
+        detail = parse_detail(result['stdout'])
+        detail.update(node=node, cluster=cluster, time=time.time(),
+            seconds=time.perf_counter() - start)
+        self.entries[key] = detail
+        return detail
+
+
+def format_detail(detail:SloppyDict, per_line:int=8) -> List[str]:
+    """
+    The lines of the drill-down pane.
+    """
+    age = time.time() - detail.time
+    name = f"{detail.cluster}:{detail.node}" if detail.get('cluster') else detail.node
+    lines = [f"{name}: fetched {age:.0f}s ago in {detail.seconds:.2f}s", ""]
+    if detail.get('error'):
+        return lines + [f"Could not get the details: {detail.error}"]
+
+    for title, key in (("Top CPU", 'top_cpu'), ("Top memory", 'top_rss')):
+        lines.append(f"{title}:")
+        lines.append(f"  {'PID':>8} {'USER':<10} {'%CPU':>6} {'RSS MB':>9}  COMMAND")
+        for p in detail[key]:
+            lines.append(f"  {p['pid']:>8} {p['user'][:10]:<10} {p['cpu']:>6.1f} {p['rss_mb']:>9.0f}  {p['command']}")
+        lines.append("")
+
+    m = detail.memory
+    if m:
+        used = m.get('MemTotal', 0) - m.get('MemAvailable', m.get('MemFree', 0))
+        swap = m.get('SwapTotal', 0) - m.get('SwapFree', 0)
+        lines.append(f"Memory (GB): total {m.get('MemTotal', 0):.1f}  used {used:.1f}  "
+            f"free {m.get('MemFree', 0):.1f}  cached {m.get('Cached', 0):.1f}  "
+            f"buffers {m.get('Buffers', 0):.1f}  shmem {m.get('Shmem', 0):.1f}  swap used {swap:.1f}")
+        lines.append("")
+
+    if detail.cores:
+        total = "" if detail.total is None else f", {detail.total*100:.0f}% overall"
+        lines.append(f"Per-core utilization ({len(detail.cores)} cores{total}):")
+        cells = [ f"{cpu[3:]:>4}:{u*100:4.0f}%" for cpu, u in detail.cores ]
+        for i in range(0, len(cells), per_line):
+            lines.append("  " + "  ".join(cells[i:i+per_line]))
+    return lines
@@ -0,0 +1,167 @@
+# -*- coding: utf-8 -*-
+"""
+When will a job of a given size fit? Each running job will have ended
+by its end time, and then gives its cores and memory back to its
+nodes. So a node's free cores and memory only go up as time passes
+(until new jobs start), and for each node they are kept as steps:
+
+    times      [ now,  t1,  t2, ... ]
+    free cores [  c0,  c1,  c2, ... ]   (c0 <= c1 <= c2 ...)
+    free mem   [  m0,  m1,  m2, ... ]
+
+Both lists are sorted, so the first step at which a request fits is
+found by bisecting each of them, and taking the later of the two.
+The first step is what is free now, as placement counts it: neither
+allocated nor in use by the load, so that a node that is idle to SLURM
+but busy is not forecast to fit now. The later steps add each record's
+releases, which the one squeue query of the refresh attaches.
+"""
+
+import typing
+from   typing import *
+
+###
+# Credits
+###
+__author__ = 'Alina Enikeeva'
+__copyright__ = 'Copyright 2022, University of Richmond'
+__credits__ = None
+__version__ = 0.1
+__maintainer__ = 'Alina Enikeeva, George Flanagin'
+__email__ = 'hpc@richmond.edu'
+__status__ = 'in progress'
+__license__ = 'MIT'
+
+
+###
+# Standard imports, starting with os and sys
+###
+min_py = (3, 8)
+import os
+import sys
+if sys.version_info < min_py:
+    print(f"This program requires Python {min_py[0]}.{min_py[1]}, or higher.")
+    sys.exit(os.EX_SOFTWARE)
+
+###
+# Other standard distro imports
+###
+from   bisect import bisect_left
+import time
+
+###
+# imports that are a part of this project
+###
+from   placement import free_cores, free_mem, open_states
+from   view_utils import SloppyDict
+
+###
+# global objects
+###
+verbose = False
+
+# The states of the nodes whose jobs will end, and that can then take
+# another job. Down and drained nodes never become available.
+forecast_states = open_states + ('alloc', 'comp')
+
+
+def steps(rec:SloppyDict) -> Tuple[List[float], List[int], List[int]]:
+    """
+    The times at which the node's free cores and memory change, with
+    what is free from then on. The first time is 0, for now.
+    """
+    times = [0.0]
+    cores = [free_cores(rec)]
+    mem = [free_mem(rec)]
+    for end, job_cores, job_mem in sorted(tuple(_) for _ in rec.get('releases') or ()):
+        if end == times[-1]:
+            cores[-1] += job_cores
+            mem[-1] += job_mem
+        else:
+            times.append(end)
+            cores.append(cores[-1] + job_cores)
+            mem.append(mem[-1] + job_mem)
+
+    # The jobs' memory can be given per CPU and rounded, so the sums
+    # can go past what the node has.
+    cores = [ min(_, rec.total_cores) for _ in cores ]
+    mem = [ min(_, rec.total_mem) for _ in mem ]
+    return times, cores, mem
+
+
+class Forecast: pass
+
+class Forecast:
+    """
+    The steps of each node, built once per refresh. The nodes whose
+    load is not known are left out.
+
+    Usage:
+        forecast = Forecast(records)
+        when, rec = forecast.earliest(request)
+    """
+    __slots__ = {
+        'nodes': 'record key -> (record, times, free cores, free memory)',
+        'made': 'the time of the snapshot that the forecast is from'
+        }
+
+    __values__ = (None, None)
+
+    __defaults__ = dict(zip(__slots__.keys(), __values__))
+
+    def __init__(self, records:Iterable[SloppyDict]=(), made:float=None) -> None:
+        for k, v in Forecast.__defaults__.items():
+            setattr(self, k, v)
+        self.made = time.time() if made is None else made
+        self.nodes = {}
+        for rec in records:
+            # As for placement.fits, a node whose probe failed (or has
+            # not come back yet) might be busier than it looks.
+            if (rec.status in forecast_states and rec.used_cores is not None
+                and not rec.get('probing')):
+                key = f"{rec.cluster}:{rec.node}" if rec.get('cluster') else rec.node
+                self.nodes[key] = (rec,) + steps(rec)
+
+
+    def when(self, key:str, request:SloppyDict) -> Optional[float]:
+        """
+        The earliest time at which the node fits the request, with the
+        time of the snapshot for now. None if it
+        never will with the jobs that are running, or is not forecast.
+        """
+        if key not in self.nodes: return None
+        rec, times, cores, mem = self.nodes[key]
+        i = max(bisect_left(cores, request.cores), bisect_left(mem, request.mem))
+        if i == len(times): return None
+        return max(times[i], self.made)
+
+
+    def earliest(self, request:SloppyDict, per_cluster:int=1) -> List[Tuple[float, SloppyDict]]:
+        """
+        The nodes that will fit the request soonest, per_cluster of them
+        from each cluster, as (time, record), soonest first within each
+        cluster.
+        """
+        candidates = {}
+        for key, (rec, *_) in self.nodes.items():
+            t = self.when(key, request)
+            if t is not None:
+                candidates.setdefault(rec.get('cluster', ''), []).append((t, rec))
+
+        best = []
+        for cluster in sorted(candidates):
+            best.extend(sorted(candidates[cluster], key=lambda c: (c[0], c[1].node))[:per_cluster])
+        return best
+
+
+def describe_wait(t:float, now:float=None) -> str:
+    """
+    e.g., now, or 14:30 (in 1h12m).
+    """
+    now = time.time() if now is None else now
+    seconds = t - now
+    if seconds <= 0: return "now"
+    hours, minutes = divmod(int(seconds + 59) // 60, 60)
+    wait = f"{hours}h{minutes:02d}m" if hours else f"{minutes}m"
+    stamp = time.strftime('%H:%M' if seconds < 86400 else '%m/%d %H:%M', time.localtime(t))
+    return f"{stamp} (in {wait})"
@@ -0,0 +1,518 @@
+# -*- coding: utf-8 -*-
+"""
+A compact, on-disk time-series store for the per-node samples that
+activity-view collects on each refresh.
+
+Each node has one file per resolution (raw, 1m, 5m, 1h). A file is a
+small header followed by fixed-size blocks. Every block is columnar:
+a header with the base time and the base value of each column, then
+one column of uint32 time offsets, then one column of int32 deltas
+for each metric. Because the blocks are fixed-size and ordered by
+time, a range query can mmap the file, binary search the block
+headers, and decode only the blocks that overlap the range.
+
+The 1m, 5m and 1h rollups are maintained as the raw samples arrive,
+and each resolution has its own retention period.
+"""
+
+import typing
+from   typing import *
+
+###
+# Credits
+###
+__author__ = 'Alina Enikeeva'
+__copyright__ = 'Copyright 2022, University of Richmond'
+__credits__ = None
+__version__ = 0.1
+__maintainer__ = 'Alina Enikeeva, George Flanagin'
+__email__ = 'hpc@richmond.edu'
+__status__ = 'in progress'
+__license__ = 'MIT'
+
+
+###
+# Standard imports, starting with os and sys
+###
+min_py = (3, 8)
+import os
+import sys
+if sys.version_info < min_py:
+    print(f"This program requires Python {min_py[0]}.{min_py[1]}, or higher.")
+    sys.exit(os.EX_SOFTWARE)
+
+###
+# Other standard distro imports
+###
+import argparse
+from   array import array
+import bisect
+import contextlib
+import csv
+from   datetime import datetime, timedelta
+import mmap
+import re
+import struct
+import time
+
+###
+# imports that are a part of this project
+###
+from   hostlist import NodeSet
+from   wrapper import trap
+
+###
+# global objects
+###
+verbose = False
+
+# The metrics kept for each sample, and the number of raw samples
+# that went into a row (always 1 for raw, more for rollups).
+COLUMNS = ('alloc_cores', 'total_cores', 'used_cores',
+    'alloc_mem', 'used_mem', 'total_mem', 'samples')
+
+# Values are stored as integers in hundredths.
+SCALE = 100
+
+# Width of each rollup bucket in seconds. Raw rows are not bucketed.
+RESOLUTIONS = {'raw': 0, '1m': 60, '5m': 300, '1h': 3600}
+
+DEFAULT_RETENTION = {
+    'raw': 2 * 86400,
+    '1m': 14 * 86400,
+    '5m': 90 * 86400,
+    '1h': 5 * 365 * 86400
+    }
+
+BLOCK_ROWS = 512
+MAGIC = b'AVTS'
+FILE_VERSION = 1
+FILE_HEADER = struct.Struct('<4sHHI')
+BLOCK_HEADER = struct.Struct('<qII' + 'q' * len(COLUMNS))
+
+INT32_MAX = (1 << 31) - 1
+UINT32_MAX = (1 << 32) - 1
+
+
+def block_size(block_rows:int=BLOCK_ROWS) -> int:
+    """
+    Size in bytes of one block: its header, the time column, and
+    one column for each metric.
+    """
+    return BLOCK_HEADER.size + block_rows * 4 * (1 + len(COLUMNS))
+
+
+def _from_le(typecode:str, buf:bytes) -> array:
+    """
+    Decode a little-endian column into an array.
+    """
+    a = array(typecode)
+    a.frombytes(buf)
+    if sys.byteorder == 'big': a.byteswap()
+    return a
+
+
+class BlockTimes:
+    """
+    A read-only sequence view of the base times of the blocks in an
+    mmap'd series, so that bisect can search it without decoding
+    anything else.
+    """
+    __slots__ = ('mm', 'nblocks', 'bsize')
+
+    def __init__(self, mm:mmap.mmap, nblocks:int, bsize:int) -> None:
+        self.mm = mm
+        self.nblocks = nblocks
+        self.bsize = bsize
+
+    def __len__(self) -> int:
+        return self.nblocks
+
+    def __getitem__(self, i:int) -> int:
+        return struct.unpack_from('<q', self.mm, FILE_HEADER.size + i * self.bsize)[0]
+
+
+class HistoryStore: pass
+
+class HistoryStore:
+    """
+    Append samples as they arrive, and read back ranges of them.
+
+    Usage:
+        store = HistoryStore('/some/dir')
+        store.append('spdr12', time.time(), {'used_cores':37.4, ... })
+        for node, t, row in store.query(['spdr12'], start, end): ...
+        store.close()
+    """
+    __slots__ = {
+        'directory': 'where the series files are kept',
+        'retention': 'seconds of history kept, by resolution',
+        'block_rows': 'number of rows in each block',
+        'tails': 'cached location of the last block of each open series',
+        'partial': 'the rollup buckets that are still being filled'
+        }
+
+    def __init__(self, directory:str, retention:dict=None, block_rows:int=BLOCK_ROWS) -> None:
+        self.directory = os.path.expanduser(directory)
+        self.retention = dict(DEFAULT_RETENTION)
+        self.retention.update(retention or {})
+        self.block_rows = block_rows
+        self.tails = {}
+        self.partial = {}
+        for resolution in RESOLUTIONS:
+            os.makedirs(os.path.join(self.directory, resolution), exist_ok=True)
+
+
+    def path(self, resolution:str, node:str) -> str:
+        """
+        The file that holds one node's series at one resolution.
+        """
+        return os.path.join(self.directory, resolution, f"{node.replace(os.sep, '_')}.avts")
+
+
+    def nodes(self, resolution:str='raw') -> List[str]:
+        """
+        The nodes for which we have any history.
+        """
+        return sorted(_[:-5] for _ in os.listdir(os.path.join(self.directory, resolution))
+            if _.endswith('.avts'))
+
+
+    ###
+    # Writing
+    ###
+    def append(self, node:str, t:float, sample:dict) -> None:
+        """
+        Record one raw sample, and fold it into the rollups. Missing
+        metrics are stored as zero.
+        """
+        values = [ float(sample.get(k, 0) or 0) for k in COLUMNS[:-1] ] + [1.0]
+        t = int(t)
+        self._write_row('raw', node, t, values)
+
+        for resolution, width in RESOLUTIONS.items():
+            if not width: continue
+            bucket = t - t % width
+            acc = self.partial.get((resolution, node))
+            if acc is not None and acc[0] != bucket:
+                self._flush_bucket(resolution, node, acc)
+                acc = None
+            if acc is None:
+                acc = self.partial[(resolution, node)] = [bucket, [0.0] * len(COLUMNS)]
+            sums = acc[1]
+            for i, v in enumerate(values[:-1]):
+                sums[i] += v
+            sums[-1] += 1
+
+
+    def close(self) -> None:
+        """
+        Write the rollup buckets that are still open.
+        """
+        for (resolution, node), acc in self.partial.items():
+            self._flush_bucket(resolution, node, acc)
+        self.partial = {}
+
+
+    def _flush_bucket(self, resolution:str, node:str, acc:list) -> None:
+        bucket, sums = acc
+        n = sums[-1]
+        if not n: return
+        self._write_row(resolution, node, bucket, [ s / n for s in sums[:-1] ] + [n], merge=True)
+
+
+    def _tail(self, fd:int, key:tuple) -> list:
+        """
+        Find (and remember) the number of blocks in the file, and the
+        header of the last one: [nblocks, base_t, count, bases].
+        """
+        if key in self.tails: return self.tails[key]
+
+        bsize = block_size(self.block_rows)
+        size = os.fstat(fd).st_size
+        if size < FILE_HEADER.size:
+            os.pwrite(fd, FILE_HEADER.pack(MAGIC, FILE_VERSION, len(COLUMNS), self.block_rows), 0)
+            size = FILE_HEADER.size
+
+        magic, version, ncols, block_rows = FILE_HEADER.unpack(os.pread(fd, FILE_HEADER.size, 0))
+        if magic != MAGIC or ncols != len(COLUMNS) or block_rows != self.block_rows:
+            raise Exception(f"{key[1]} has an incompatible {key[0]} history file.")
+
+        nblocks = (size - FILE_HEADER.size) // bsize
+        if not nblocks:
+            tail = [0, 0, 0, ()]
+        else:
+            header = BLOCK_HEADER.unpack(
+                os.pread(fd, BLOCK_HEADER.size, FILE_HEADER.size + (nblocks-1) * bsize))
+            tail = [nblocks, header[0], header[1], header[3:]]
+
+        self.tails[key] = tail
+        return tail
+
+
+    def _write_row(self, resolution:str, node:str, t:int, values:list, merge:bool=False) -> None:
+        """
+        Add a row to the end of a series, starting a new block when the
+        current one is full or the row cannot be expressed as a delta
+        from the block's base values. If merge is True and the last row
+        has the same time, the two rows are combined (this happens when
+        a rollup bucket is flushed at exit, and resumed after a restart).
+        """
+        key = (resolution, node)
+        ints = [ int(round(v * SCALE)) for v in values ]
+        bsize = block_size(self.block_rows)
+        rows = self.block_rows
+
+        fd = os.open(self.path(resolution, node), os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            nblocks, base_t, count, bases = self._tail(fd, key)
+            offset = FILE_HEADER.size + (nblocks - 1) * bsize
+
+            merged = merge and count and base_t + self._last_time(fd, offset, count) == t
+            if merged:
+                old = self._read_row(fd, offset, count - 1, bases)
+                n_old, n_new = old[-1], ints[-1]
+                ints = [ int(round((o * n_old + v * n_new) / (n_old + n_new)))
+                    for o, v in zip(old[:-1], ints[:-1]) ] + [n_old + n_new]
+                count -= 1
+
+            fits = (nblocks and count < rows and 0 <= t - base_t <= UINT32_MAX and
+                all(abs(v - b) <= INT32_MAX for v, b in zip(ints, bases)))
+
+            if not fits:
+                # The merged row replaces the old one, which must not be
+                # left behind in the old block. If it was the block's only
+                # row, the block is started again in place.
+                if merged:
+                    os.pwrite(fd, struct.pack('<I', count), offset + 8)
+                if not (merged and count == 0):
+                    nblocks += 1
+                base_t, count, bases = t, 0, tuple(ints)
+                offset = FILE_HEADER.size + (nblocks - 1) * bsize
+                os.pwrite(fd, BLOCK_HEADER.pack(base_t, 0, 0, *bases)
+                    + bytes(bsize - BLOCK_HEADER.size), offset)
+
+            data = offset + BLOCK_HEADER.size
+            os.pwrite(fd, struct.pack('<I', t - base_t), data + count * 4)
+            for i, (v, b) in enumerate(zip(ints, bases)):
+                os.pwrite(fd, struct.pack('<i', v - b), data + rows * 4 * (1 + i) + count * 4)
+            count += 1
+            os.pwrite(fd, struct.pack('<I', count), offset + 8)
+            self.tails[key] = [nblocks, base_t, count, bases]
+
+        finally:
+            os.close(fd)
+
+        if not fits: self._expire(resolution, node)
+
+
+    def _last_time(self, fd:int, offset:int, count:int) -> int:
+        return struct.unpack('<I', os.pread(fd, 4, offset + BLOCK_HEADER.size + (count-1) * 4))[0]
+
+
+    def _read_row(self, fd:int, offset:int, i:int, bases:tuple) -> List[int]:
+        data = offset + BLOCK_HEADER.size
+        return [ b + struct.unpack('<i', os.pread(fd, 4, data + self.block_rows * 4 * (1 + c) + i * 4))[0]
+            for c, b in enumerate(bases) ]
+
+
+    def _expire(self, resolution:str, node:str) -> None:
+        """
+        Drop the leading blocks whose rows are all older than the
+        retention period. A block is entirely expired when the block
+        after it starts before the cutoff. This only runs when a new
+        block is started, so its cost is amortized over many rows.
+        """
+        cutoff = int(time.time()) - self.retention.get(resolution, DEFAULT_RETENTION[resolution])
+        filename = self.path(resolution, node)
+        bsize = block_size(self.block_rows)
+
+        with open(filename, 'rb') as f:
+            size = os.fstat(f.fileno()).st_size
+            nblocks = (size - FILE_HEADER.size) // bsize
+            if nblocks < 2: return
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                times = BlockTimes(mm, nblocks, bsize)
+                expired = max(0, bisect.bisect_left(times, cutoff, 1) - 1)
+                if not expired: return
+                tmp = f"{filename}.tmp"
+                with open(tmp, 'wb') as out:
+                    out.write(mm[:FILE_HEADER.size])
+                    out.write(mm[FILE_HEADER.size + expired * bsize:])
+
+        os.replace(tmp, filename)
+        self.tails.pop((resolution, node), None)
+
+
+    ###
+    # Reading
+    ###
+    def blocks(self, node:str, start:float, end:float,
+        resolution:str='raw') -> Iterator[Tuple[int, bytes, Dict[str, Tuple[int, bytes]]]]:
+        """
+        Yield one (base time, time offsets, {column: (base, deltas)})
+        for each block that overlaps [start, end], with the offsets and
+        deltas still as the little-endian uint32 and int32 bytes of the
+        file, cut to the rows in the range. Nothing is decoded, so a
+        caller with a vectorized library can decode whole columns at
+        once.
+        """
+        filename = self.path(resolution, node)
+        if not os.path.isfile(filename): return
+
+        start, end = int(start), int(end)
+
+        with open(filename, 'rb') as f:
+            size = os.fstat(f.fileno()).st_size
+            if size <= FILE_HEADER.size: return
+
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                # The file knows its own block size.
+                magic, version, ncols, rows = FILE_HEADER.unpack_from(mm, 0)
+                if magic != MAGIC or ncols != len(COLUMNS):
+                    raise Exception(f"{filename} is not a compatible history file.")
+                bsize = block_size(rows)
+                nblocks = (size - FILE_HEADER.size) // bsize
+
+                times = BlockTimes(mm, nblocks, bsize)
+                first = max(0, bisect.bisect_right(times, start) - 1)
+
+                for b in range(first, nblocks):
+                    offset = FILE_HEADER.size + b * bsize
+                    header = BLOCK_HEADER.unpack_from(mm, offset)
+                    base_t, count, bases = header[0], header[1], header[3:]
+                    if base_t > end: break
+
+                    # A block that is wholly in the range is taken as it
+                    # is. Otherwise the offsets are sorted, so the range
+                    # is found without adding the base time to each.
+                    data = offset + BLOCK_HEADER.size
+                    last = struct.unpack_from('<I', mm, data + (count - 1) * 4)[0] if count else 0
+                    if start <= base_t and base_t + last <= end:
+                        lo, hi = 0, count
+                    else:
+                        t = _from_le('I', mm[data:data + count * 4])
+                        lo = bisect.bisect_left(t, start - base_t)
+                        hi = bisect.bisect_right(t, end - base_t)
+                    if lo >= hi: continue
+
+                    columns = {}
+                    for c, (name, base) in enumerate(zip(COLUMNS, bases)):
+                        col = data + rows * 4 * (1 + c)
+                        columns[name] = (base, mm[col + lo * 4:col + hi * 4])
+
+                    yield base_t, mm[data + lo * 4:data + hi * 4], columns
+
+
+    def series(self, node:str, start:float, end:float,
+        resolution:str='raw') -> Iterator[Tuple[array, Dict[str, array]]]:
+        """
+        Yield one (times, {column: values}) pair for each block that
+        overlaps [start, end]. The arrays are still in stored units:
+        times are absolute seconds, and the values are in hundredths.
+        This is the form to use for computing over long ranges.
+        """
+        for base_t, offsets, raw in self.blocks(node, start, end, resolution):
+            t = array('q', (base_t + _ for _ in _from_le('I', offsets)))
+            columns = { name: array('q', (base + _ for _ in _from_le('i', deltas)))
+                for name, (base, deltas) in raw.items() }
+            yield t, columns
+
+
+    def query(self, nodes:Iterable[str], start:float, end:float,
+        resolution:str='auto') -> Iterator[Tuple[str, int, dict]]:
+        """
+        Yield (node, time, {column: value}) for every stored row in
+        [start, end], one node at a time. Only the blocks overlapping
+        the range are read.
+        """
+        if resolution == 'auto': resolution = pick_resolution(end - start)
+        if resolution not in RESOLUTIONS:
+            raise Exception(f"Unknown resolution {resolution}")
+
+        for node in nodes:
+            for t, columns in self.series(node, start, end, resolution):
+                names = tuple(columns.keys())
+                for i, when in enumerate(t):
+                    yield node, when, { k: columns[k][i] / SCALE for k in names }
+
+
+def pick_resolution(span:float) -> str:
+    """
+    Choose the coarsest resolution that still gives a useful number
+    of rows for a range of this length.
+    """
+    if span <= 6 * 3600: return 'raw'
+    if span <= 2 * 86400: return '1m'
+    if span <= 14 * 86400: return '5m'
+    return '1h'
+
+
+relative_time = re.compile(r'^-(\d+)([smhdw])$')
+units = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400, 'w': 7 * 86400}
+
+def parse_when(s:str, now:float=None) -> float:
+    """
+    Interpret a time given on the command line. Accepted are 'now',
+    relative times like -90m, -6h, -2d, and anything that
+    datetime.fromisoformat understands, e.g. 2026-10-13T09:00.
+    """
+    now = time.time() if now is None else now
+    s = s.strip().lower()
+    if s == 'now': return now
+    if (m := relative_time.match(s)):
+        return now - int(m.group(1)) * units[m.group(2)]
+    try:
+        return datetime.fromisoformat(s).timestamp()
+    except ValueError:
+        raise Exception(f"Cannot interpret {s} as a time.") from None
+
+
+@trap
+def history_store_main(myargs:argparse.Namespace) -> int:
+    store = HistoryStore(myargs.dir)
+    start = parse_when(myargs.start)
+    end = parse_when(myargs.end)
+    nodes = NodeSet(store.nodes())
+    if myargs.nodes: nodes &= NodeSet(myargs.nodes)
+    columns = myargs.columns.split(',') if myargs.columns else list(COLUMNS[:-1])
+
+    writer = csv.writer(sys.stdout)
+    writer.writerow(['node', 'time'] + columns)
+    for node, t, row in store.query(nodes, start, end, myargs.resolution):
+        writer.writerow([node, datetime.fromtimestamp(t).isoformat()] + [ row[_] for _ in columns ])
+
+    return os.EX_OK
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(prog="history_store",
+        description="Read a time range of the per-node history recorded by activityview --history.")
+
+    parser.add_argument('-d', '--dir', type=str, required=True,
+        help="The history directory given to activityview --history.")
+    parser.add_argument('-n', '--nodes', type=str, default="",
+        help="Nodes to report, as names or hostlist expressions (spdr[01-30]). Defaults to all of them.")
+    parser.add_argument('--start', type=str, default="-1h",
+        help="Start of the range: now, -90m, -6h, -2d, or an ISO date/time. Defaults to -1h. "
+        "Relative times need the = form, e.g. --start=-6h.")
+    parser.add_argument('--end', type=str, default="now",
+        help="End of the range, in the same forms as --start. Defaults to now.")
+    parser.add_argument('--resolution', type=str, default="auto",
+        choices=('auto',) + tuple(RESOLUTIONS.keys()),
+        help="Which series to read. auto picks one based on the length of the range.")
+    parser.add_argument('-c', '--columns', type=str, default="",
+        help=f"Comma separated columns to print from {', '.join(COLUMNS)}.")
+    parser.add_argument('-o', '--output', type=str, default="",
+        help="Output file name")
+
+    myargs = parser.parse_args()
+
+    try:
+        outfile = sys.stdout if not myargs.output else open(myargs.output, 'w')
+        with contextlib.redirect_stdout(outfile):
+            sys.exit(globals()[f"{os.path.basename(__file__)[:-3]}_main"](myargs))
+
+    except Exception as e:
+        print(f"Escaped or re-raised exception: {e}")
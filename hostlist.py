@@ -0,0 +1,335 @@
+# -*- coding: utf-8 -*-
+"""
+Sets of node names, kept as SLURM hostlist ranges.
+
+    >>> a = NodeSet('spdr[01-30,50-61]')
+    >>> b = NodeSet('spdr[25-55]')
+    >>> str(a - b)
+    'spdr[01-24,56-61]'
+
+A name is split at its last run of digits into a prefix, a number and
+a suffix; names with the same prefix, suffix and number of digits form
+a family, and each family is a sorted list of disjoint ranges. Union,
+intersection and difference work family by family on the ranges, so
+their cost depends on the number of ranges, not the number of nodes.
+"""
+
+import typing
+from   typing import *
+
+###
+# Credits
+###
+__author__ = 'Alina Enikeeva'
+__copyright__ = 'Copyright 2022, University of Richmond'
+__credits__ = None
+__version__ = 0.1
+__maintainer__ = 'Alina Enikeeva, George Flanagin'
+__email__ = 'hpc@richmond.edu'
+__status__ = 'in progress'
+__license__ = 'MIT'
+
+
+###
+# Standard imports, starting with os and sys
+###
+min_py = (3, 8)
+import os
+import sys
+if sys.version_info < min_py:
+    print(f"This program requires Python {min_py[0]}.{min_py[1]}, or higher.")
+    sys.exit(os.EX_SOFTWARE)
+
+###
+# Other standard distro imports
+###
+import bisect
+import re
+
+###
+# global objects
+###
+verbose = False
+
+name_parts = re.compile(r'^(.*?)(\d+)(\D*)$')
+separators = re.compile(r'[\s,]+')
+
+
+###
+# Operations on sorted lists of disjoint, half-open ranges.
+###
+def coalesce(ranges:Iterable[Tuple[int, int]]) -> List[Tuple[int, int]]:
+    """
+    Sort the ranges and join the ones that overlap or touch.
+    """
+    result = []
+    for lo, hi in sorted(ranges):
+        if result and lo <= result[-1][1]:
+            if hi > result[-1][1]: result[-1] = (result[-1][0], hi)
+        else:
+            result.append((lo, hi))
+    return result
+
+
+def intersect(a:List[Tuple[int, int]], b:List[Tuple[int, int]]) -> List[Tuple[int, int]]:
+    result = []
+    i = j = 0
+    while i < len(a) and j < len(b):
+        lo = max(a[i][0], b[j][0])
+        hi = min(a[i][1], b[j][1])
+        if lo < hi: result.append((lo, hi))
+        if a[i][1] < b[j][1]: i += 1
+        else: j += 1
+    return result
+
+
+def subtract(a:List[Tuple[int, int]], b:List[Tuple[int, int]]) -> List[Tuple[int, int]]:
+    result = []
+    j = 0
+    for lo, hi in a:
+        while j < len(b) and b[j][1] <= lo: j += 1
+        k = j
+        while k < len(b) and b[k][0] < hi:
+            if b[k][0] > lo: result.append((lo, b[k][0]))
+            lo = max(lo, b[k][1])
+            k += 1
+        if lo < hi: result.append((lo, hi))
+    return result
+
+
+def split_name(name:str) -> Tuple[Tuple[str, int, str], int]:
+    """
+    The family of a name, and its number in the family. A family is
+    (prefix, number of digits, suffix); names without digits are in
+    a family of their own with 0 digits.
+    """
+    m = name_parts.match(name)
+    if m is None: return (name, 0, ''), 0
+    prefix, digits, suffix = m.groups()
+    return (prefix, len(digits), suffix), int(digits)
+
+
+def widths(lo:int, hi:int, width:int) -> Iterable[Tuple[int, int, int]]:
+    """
+    Split the range lo..hi-1, written with at least width digits,
+    into the parts whose names have 1, 2, 3 ... digits.
+    """
+    while lo < hi:
+        end = min(hi, 10 ** width)
+        if lo < end: yield lo, end, width
+        lo = max(lo, end)
+        width += 1
+
+
+class NodeSet: pass
+
+class NodeSet:
+    """
+    An immutable set of node names. It can be built from a hostlist
+    expression, or from any iterable of names and expressions, and
+    str() gives back the shortest hostlist expression for it.
+
+    Usage:
+        up = NodeSet('spdr[01-61]') - NodeSet(down_nodes)
+        if 'spdr16' in up: ...
+    """
+    __slots__ = {
+        'families': 'dict of (prefix, digits, suffix) -> sorted list of (lo, hi) ranges'
+        }
+
+    def __init__(self, nodes:Union[str, Iterable[str]]=None) -> None:
+        self.families = {}
+        if not nodes: return
+        if isinstance(nodes, NodeSet):
+            self.families = dict(nodes.families)
+            return
+
+        numbers = {}
+        for term in NodeSet.terms([nodes] if isinstance(nodes, str) else nodes):
+            if isinstance(term, tuple):
+                family, lo, hi = term
+                numbers.setdefault(family, []).append((lo, hi))
+            else:
+                family, n = split_name(term)
+                numbers.setdefault(family, []).append((n, n+1))
+
+        self.families = { family: coalesce(ranges) for family, ranges in numbers.items() }
+
+
+    @staticmethod
+    def terms(expressions:Iterable[str]) -> Iterable[Union[str, tuple]]:
+        """
+        Yield the names, and the (family, lo, hi) ranges, that make up
+        the expressions.
+        """
+        for expression in expressions:
+            for term in NodeSet.split(expression):
+                yield from NodeSet.expand(term)
+
+
+    @staticmethod
+    def split(expression:str) -> List[str]:
+        """
+        Split at the commas and whitespace that are not inside brackets.
+        """
+        terms = []
+        depth = start = 0
+        for i, c in enumerate(expression):
+            if c == '[': depth += 1
+            elif c == ']': depth -= 1
+            elif depth == 0 and (c == ',' or c.isspace()):
+                terms.append(expression[start:i])
+                start = i + 1
+        if depth: raise Exception(f"Unbalanced brackets in {expression!r}")
+        terms.append(expression[start:])
+        return [ _ for _ in terms if _ ]
+
+
+    @staticmethod
+    def expand(term:str) -> Iterable[Union[str, tuple]]:
+        """
+        One term of a hostlist, such as spdr[01-30,50-61]. A bracket is
+        turned into ranges directly when its numbers are the last digits
+        of the names; otherwise (rack[1-2]-node[01-04], say) the names
+        are expanded.
+        """
+        open_ = term.find('[')
+        if open_ < 0:
+            yield term
+            return
+
+        close = term.find(']', open_)
+        prefix, body, rest = term[:open_], term[open_+1:close], term[close+1:]
+        pieces = []
+        for piece in body.split(','):
+            lo, _, hi = piece.partition('-')
+            if not lo.isdigit() or (hi and not hi.isdigit()):
+                raise Exception(f"Cannot interpret {piece!r} in {term!r}")
+            pieces.append((lo, hi or lo))
+
+        if '[' in rest or any(_.isdigit() for _ in rest) or prefix[-1:].isdigit():
+            for lo, hi in pieces:
+                for n in range(int(lo), int(hi)+1):
+                    yield from NodeSet.expand(f"{prefix}{n:0{len(lo)}d}{rest}")
+            return
+
+        for lo, hi in pieces:
+            for a, b, width in widths(int(lo), int(hi)+1, len(lo)):
+                yield (prefix, width, rest), a, b
+
+
+    @classmethod
+    def from_families(cls, families:dict) -> NodeSet:
+        s = cls()
+        s.families = { k: v for k, v in families.items() if v }
+        return s
+
+
+    def __bool__(self) -> bool:
+        return bool(self.families)
+
+
+    def __contains__(self, name:str) -> bool:
+        family, n = split_name(name)
+        ranges = self.families.get(family)
+        if not ranges: return False
+        i = bisect.bisect_right(ranges, (n, float('inf'))) - 1
+        return i >= 0 and ranges[i][0] <= n < ranges[i][1]
+
+
+    def __eq__(self, other:object) -> bool:
+        if not isinstance(other, NodeSet): return NotImplemented
+        return self.families == other.families
+
+
+    def __hash__(self) -> int:
+        return hash(tuple(sorted((k, tuple(v)) for k, v in self.families.items())))
+
+
+    def __iter__(self) -> Iterator[str]:
+        """
+        The names, in order.
+        """
+        for family in sorted(self.families):
+            prefix, digits, suffix = family
+            if not digits:
+                yield prefix
+                continue
+            for lo, hi in self.families[family]:
+                for n in range(lo, hi):
+                    yield f"{prefix}{n:0{digits}d}{suffix}"
+
+
+    def __len__(self) -> int:
+        return sum(hi - lo for ranges in self.families.values() for lo, hi in ranges)
+
+
+    def __le__(self, other:NodeSet) -> bool:
+        return not (self - other)
+
+
+    def __or__(self, other:NodeSet) -> NodeSet:
+        families = dict(self.families)
+        for family, ranges in other.families.items():
+            families[family] = coalesce(families.get(family, []) + ranges)
+        return NodeSet.from_families(families)
+
+
+    def __and__(self, other:NodeSet) -> NodeSet:
+        return NodeSet.from_families({ family: intersect(ranges, other.families[family])
+            for family, ranges in self.families.items() if family in other.families })
+
+
+    def __sub__(self, other:NodeSet) -> NodeSet:
+        return NodeSet.from_families({ family:
+            subtract(ranges, other.families[family]) if family in other.families else ranges
+            for family, ranges in self.families.items() })
+
+
+    union = __or__
+    intersection = __and__
+    difference = __sub__
+    issubset = __le__
+
+
+    def __repr__(self) -> str:
+        return f"NodeSet({str(self)!r})"
+
+
+    def __str__(self) -> str:
+        """
+        The hostlist expression. Ranges that run on from one number of
+        digits to the next (spdr[8-12]) are written as one range.
+        """
+        groups = {}
+        bare = set()
+        for (prefix, digits, suffix), ranges in self.families.items():
+            if not digits:
+                bare.add((prefix, suffix))
+            for lo, hi in ranges if digits else ():
+                groups.setdefault((prefix, suffix), []).append((lo, hi, digits))
+
+        terms = []
+        for (prefix, suffix) in sorted(bare | set(groups)):
+            # A name without digits is a term of its own, even when a
+            # numbered family has the same prefix (login, login[1-2]).
+            if (prefix, suffix) in bare:
+                terms.append(prefix)
+            ranges = groups.get((prefix, suffix))
+            if not ranges: continue
+            ranges.sort(key=lambda r: (r[0], r[2]))
+            merged = []
+            for lo, hi, digits in ranges:
+                if (merged and merged[-1][1] == lo and digits == len(str(lo))
+                    and merged[-1][2] == len(str(merged[-1][0]))):
+                    merged[-1] = (merged[-1][0], hi, merged[-1][2])
+                else:
+                    merged.append((lo, hi, digits))
+
+            pieces = [ f"{lo:0{d}d}" if hi - lo == 1 else f"{lo:0{d}d}-{hi-1:0{d}d}"
+                for lo, hi, d in merged ]
+            if len(pieces) == 1 and merged[0][1] - merged[0][0] == 1:
+                terms.append(f"{prefix}{pieces[0]}{suffix}")
+            else:
+                terms.append(f"{prefix}[{','.join(pieces)}]{suffix}")
+        return ",".join(terms)
@@ -0,0 +1,186 @@
+# -*- coding: utf-8 -*-
+"""
+Which jobs, and whose, are on each node. One squeue query per refresh
+lists the running jobs of the whole cluster; each job's node list is
+a hostlist expression, which is expanded once to build an index from
+node to jobs. The index is then joined with the snapshot in memory,
+so no SLURM command is run for any one node.
+
+The same query gives each job's end time (its time limit, as SLURM
+will enforce it), which is what the availability forecast is built on.
+"""
+
+import typing
+from   typing import *
+
+###
+# Credits
+###
+__author__ = 'Alina Enikeeva'
+__copyright__ = 'Copyright 2022, University of Richmond'
+__credits__ = None
+__version__ = 0.1
+__maintainer__ = 'Alina Enikeeva, George Flanagin'
+__email__ = 'hpc@richmond.edu'
+__status__ = 'in progress'
+__license__ = 'MIT'
+
+
+###
+# Standard imports, starting with os and sys
+###
+min_py = (3, 8)
+import os
+import sys
+if sys.version_info < min_py:
+    print(f"This program requires Python {min_py[0]}.{min_py[1]}, or higher.")
+    sys.exit(os.EX_SOFTWARE)
+
+###
+# Other standard distro imports
+###
+import math
+import time
+
+###
+# imports that are a part of this project
+###
+from   hostlist import NodeSet
+from   placement import parse_memory
+from   view_utils import SloppyDict, dorunrun
+
+###
+# global objects
+###
+verbose = False
+
+# job id, user, CPUs, memory per node, number of nodes, node list,
+# end time.
+SQUEUE_FIELDS = ('id', 'user', 'cpus', 'mem', 'count', 'nodes', 'end')
+SQUEUE_FORMAT = '%i|%u|%C|%m|%D|%N|%e'
+
+
+def squeue_command(cluster:str=None) -> str:
+    cluster = "" if cluster is None else f"-M {cluster} "
+    return f'squeue {cluster}-h -t R -o "{SQUEUE_FORMAT}"'
+
+
+def parse_job(line:str) -> Optional[SloppyDict]:
+    """
+    One line of squeue output, or None if it cannot be read.
+    """
+    values = line.split('|')
+    if len(values) != len(SQUEUE_FIELDS): return None
+    job = SloppyDict(zip(SQUEUE_FIELDS, values))
+    try:
+        job.cpus = int(job.cpus)
+        job.count = max(1, int(job.count))
+    except ValueError as e:
+        return None
+
+    # squeue gives the memory as, e.g., 4G or 4000M; a trailing c or n
+    # says whether it is per CPU or per node.
+    try:
+        per_cpu = job.mem.endswith('c')
+        mem = parse_memory(job.mem.rstrip('cn'))
+        job.mem = mem * math.ceil(job.cpus / job.count) if per_cpu else mem
+    except (ValueError, IndexError) as e:
+        job.mem = None
+
+    job.cpus_per_node = math.ceil(job.cpus / job.count)
+    job.end = parse_time(job.end)
+    return job
+
+
+def parse_time(s:str) -> Optional[float]:
+    """
+    squeue's times, e.g., 2022-10-19T14:30:00, in the local time zone,
+    as seconds since the epoch. Jobs with no time limit have none.
+    """
+    try:
+        return time.mktime(time.strptime(s.strip(), '%Y-%m-%dT%H:%M:%S'))
+    except ValueError as e:
+        return None
+
+
+class JobIndex: pass
+
+class JobIndex:
+    """
+    The running jobs, indexed by node.
+
+    Usage:
+        index = JobIndex.query()
+        for job in index.on('spdr16'): ...
+    """
+    __slots__ = {
+        'jobs': 'list of the jobs, as SloppyDicts',
+        'by_node': 'node name -> list of its jobs'
+        }
+
+    __values__ = (None, None)
+
+    __defaults__ = dict(zip(__slots__.keys(), __values__))
+
+    def __init__(self, lines:Iterable[str]=()) -> None:
+        for k, v in JobIndex.__defaults__.items():
+            setattr(self, k, v)
+        self.jobs = []
+        self.by_node = {}
+        for line in lines:
+            job = parse_job(line)
+            if job is None: continue
+            self.jobs.append(job)
+            for node in NodeSet(job.nodes):
+                self.by_node.setdefault(node, []).append(job)
+
+
+    @classmethod
+    def query(cls, cluster:str=None) -> JobIndex:
+        """
+        Run squeue once, and index what it says.
+        """
+        result = dorunrun(squeue_command(cluster), return_datatype=dict)
+        if not result['OK']: return cls()
+        return cls( _ for _ in result['stdout'].split('\n')
+            if _.strip() and not _.startswith('CLUSTER:') )
+
+
+    def on(self, node:str) -> List[SloppyDict]:
+        return self.by_node.get(node, [])
+
+
+    def top_jobs(self, node:str, n:int=3) -> List[dict]:
+        """
+        The n jobs with the most CPUs on the node.
+        """
+        jobs = sorted(self.on(node), key=lambda job: (-job.cpus_per_node, job.id))
+        return [ dict(id=job.id, user=job.user, cpus=job.cpus_per_node, mem=job.mem) for job in jobs[:n] ]
+
+
+    def top_users(self, node:str, n:int=3) -> List[Tuple[str, int]]:
+        """
+        The n users with the most CPUs on the node, and their CPUs.
+        """
+        users = {}
+        for job in self.on(node):
+            users[job.user] = users.get(job.user, 0) + job.cpus_per_node
+        return sorted(users.items(), key=lambda u: (-u[1], u[0]))[:n]
+
+
+    def releases(self, node:str) -> List[Tuple[float, int, int]]:
+        """
+        When the jobs on the node will end, at the latest, and the cores
+        and GB of memory that each will give back, soonest first. Jobs
+        with no end time never give theirs back, and are left out.
+        """
+        return sorted( (job.end, job.cpus_per_node, job.mem or 0)
+            for job in self.on(node) if job.end is not None )
+
+
+    def attach(self, rec:SloppyDict, n:int=3) -> None:
+        """
+        Add the node's top jobs and users to its record.
+        """
+        rec.jobs = self.top_jobs(rec.node, n)
+        rec.users = self.top_users(rec.node, n)
@@ -0,0 +1,149 @@
+# -*- coding: utf-8 -*-
+"""
+Where would a job fit? A request is written as cores=N,mem=M, with the
+memory in GB or with a K, M, G or T suffix:
+
+    --place cores=16,mem=64G
+
+A node fits if it is idle or mixed, answered its probe, and has enough
+cores and memory that are neither allocated by SLURM nor, judging by
+its load and memory use, busy anyway. The nodes that fit best are the
+ones with the most free cores, and then the most free memory.
+"""
+
+import typing
+from   typing import *
+
+###
+# Credits
+###
+__author__ = 'Alina Enikeeva'
+__copyright__ = 'Copyright 2022, University of Richmond'
+__credits__ = None
+__version__ = 0.1
+__maintainer__ = 'Alina Enikeeva, George Flanagin'
+__email__ = 'hpc@richmond.edu'
+__status__ = 'in progress'
+__license__ = 'MIT'
+
+
+###
+# Standard imports, starting with os and sys
+###
+min_py = (3, 8)
+import os
+import sys
+if sys.version_info < min_py:
+    print(f"This program requires Python {min_py[0]}.{min_py[1]}, or higher.")
+    sys.exit(os.EX_SOFTWARE)
+
+###
+# Other standard distro imports
+###
+import math
+
+###
+# imports that are a part of this project
+###
+from   view_utils import SloppyDict
+
+###
+# global objects
+###
+verbose = False
+
+# GB per unit.
+memory_units = {'k': 1e-6, 'm': 1e-3, 'g': 1, 't': 1000}
+
+# The states in which a node can take another job.
+open_states = ('idle', 'mix')
+
+
+def parse_memory(s:str) -> int:
+    """
+    GB, rounded up, from 64, 64G, 64GB, 512M, 1T and so on.
+    """
+    s = s.strip().lower().rstrip('b')
+    if s[-1:] in memory_units:
+        return math.ceil(float(s[:-1]) * memory_units[s[-1]])
+    return math.ceil(float(s))
+
+
+def parse_request(spec:str) -> SloppyDict:
+    """
+    cores=N,mem=M -> SloppyDict(cores=N, mem=M in GB). Either may be
+    left out, and is then 0.
+    """
+    request = SloppyDict(cores=0, mem=0)
+    for item in ( _.strip() for _ in spec.split(',') ):
+        if not item: continue
+        k, sep, v = item.partition('=')
+        k = k.strip().lower()
+        if not sep or k not in request:
+            raise Exception(f"Cannot interpret {item!r} in {spec!r}; expected cores=N,mem=M.")
+        try:
+            request[k] = parse_memory(v) if k == 'mem' else int(v)
+        except ValueError as e:
+            raise Exception(f"Cannot interpret {item!r} in {spec!r}; expected cores=N,mem=M.") from None
+    return request
+
+
+def describe_request(request:SloppyDict) -> str:
+    return f"cores={request.cores},mem={request.mem}G"
+
+
+def free_cores(rec:SloppyDict) -> float:
+    """
+    Cores that are neither allocated nor, by the load, in use.
+    """
+    used = rec.used_cores if rec.used_cores is not None else 0
+    return max(0, rec.total_cores - max(rec.alloc_cores, used))
+
+
+def free_mem(rec:SloppyDict) -> int:
+    """
+    GB that are neither allocated nor in use.
+    """
+    used = rec.used_mem if rec.used_mem is not None else 0
+    return max(0, rec.total_mem - max(rec.alloc_mem, used))
+
+
+def may_fit(rec:SloppyDict, request:SloppyDict) -> bool:
+    """
+    Whether the node could fit the request by what SLURM has allocated
+    alone, before its load and memory are known.
+    """
+    return (rec.status in open_states
+        and rec.total_cores - rec.alloc_cores >= request.cores
+        and rec.total_mem - rec.alloc_mem >= request.mem)
+
+
+def fits(rec:SloppyDict, request:SloppyDict) -> bool:
+    return (rec.status in open_states and rec.used_cores is not None
+        and not rec.get('probing')
+        and free_cores(rec) >= request.cores and free_mem(rec) >= request.mem)
+
+
+def suggest(records:Iterable[SloppyDict], request:SloppyDict, per_cluster:int=1) -> List[SloppyDict]:
+    """
+    The best nodes for the request, per_cluster of them from each
+    cluster, best first within each cluster.
+    """
+    candidates = {}
+    for rec in records:
+        if fits(rec, request):
+            candidates.setdefault(rec.get('cluster', ''), []).append(rec)
+
+    best = []
+    for cluster in sorted(candidates):
+        ranked = sorted(candidates[cluster], key=lambda rec: (-free_cores(rec), -free_mem(rec), rec.node))
+        best.extend(ranked[:per_cluster])
+    return best
+
+
+def describe(rec:SloppyDict) -> str:
+    """
+    e.g., spdr03 (40 cores, 700 GB free), with the cluster if there is one.
+    """
+    name = f"{rec.cluster}:{rec.node}" if rec.get('cluster') else rec.node
+    return f"{name} ({free_cores(rec):.0f} cores, {free_mem(rec)} GB free)"
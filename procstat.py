@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+"""
+CPU utilization from the counters in /proc/stat. The counters only
+ever go up, so utilization is the busy share of the ticks between two
+readings:
+
+    cpu  user nice system idle iowait irq softirq steal ...
+
+Idle and iowait ticks are not busy; everything else is.
+"""
+
+import typing
+from   typing import *
+
+###
+# Credits
+###
+__author__ = 'Alina Enikeeva'
+__copyright__ = 'Copyright 2022, University of Richmond'
+__credits__ = None
+__version__ = 0.1
+__maintainer__ = 'Alina Enikeeva, George Flanagin'
+__email__ = 'hpc@richmond.edu'
+__status__ = 'in progress'
+__license__ = 'MIT'
+
+
+###
+# Standard imports, starting with os and sys
+###
+min_py = (3, 8)
+import os
+import sys
+if sys.version_info < min_py:
+    print(f"This program requires Python {min_py[0]}.{min_py[1]}, or higher.")
+    sys.exit(os.EX_SOFTWARE)
+
+###
+# global objects
+###
+verbose = False
+
+
+def parse_stat(text:str) -> Dict[str, Tuple[int, int]]:
+    """
+    The cpu lines of /proc/stat, as cpu name -> (busy ticks, total ticks).
+    The name of the total over all the cores is 'cpu'.
+    """
+    counters = {}
+    for line in text.split('\n'):
+        if not line.startswith('cpu'): continue
+        fields = line.split()
+        try:
+            ticks = [ int(_) for _ in fields[1:9] ]
+        except ValueError as e:
+            continue
+        idle = sum(ticks[3:5])
+        total = sum(ticks)
+        counters[fields[0]] = (total - idle, total)
+    return counters
+
+
+def utilization(before:Dict[str, Tuple[int, int]],
+    after:Dict[str, Tuple[int, int]]) -> Dict[str, float]:
+    """
+    cpu name -> fraction of the time that it was busy between the two
+    readings. CPUs that are missing from either reading, or whose
+    counters did not advance, are left out.
+    """
+    result = {}
+    for cpu, (busy, total) in after.items():
+        if cpu not in before: continue
+        dtotal = total - before[cpu][1]
+        if dtotal <= 0: continue
+        result[cpu] = min(1.0, max(0.0, (busy - before[cpu][0]) / dtotal))
+    return result
@@ -0,0 +1,204 @@
+# -*- coding: utf-8 -*-
+"""
+CPU and allocation profiles of each refresh, for activityview --profile.
+
+For each refresh, cProfile and tracemalloc are run around the refresh
+and two files are written to the profile directory:
+
+    refresh-00042.prof -- the cProfile data, for pstats or snakeviz.
+    refresh-00042.txt  -- the top functions by cumulative time, and
+                          the top allocation sites during the refresh.
+
+Only the most recent refreshes are kept.
+
+Much of a refresh runs in the threads of its thread pools, which
+cProfile does not see before Python 3.12. Each thread of those pools
+that is started during the refresh gets a profiler of its own, which
+profile_thread() starts, and their data are merged with those of the
+thread that runs the refresh. Whether the threads are daemons does not
+matter: in the map, they are started by a daemon thread, and are
+daemons too. Since 3.12, one profiler sees every thread.
+"""
+
+import typing
+from   typing import *
+
+###
+# Credits
+###
+__author__ = 'Alina Enikeeva'
+__copyright__ = 'Copyright 2022, University of Richmond'
+__credits__ = None
+__version__ = 0.1
+__maintainer__ = 'Alina Enikeeva, George Flanagin'
+__email__ = 'hpc@richmond.edu'
+__status__ = 'in progress'
+__license__ = 'MIT'
+
+
+###
+# Standard imports, starting with os and sys
+###
+min_py = (3, 8)
+import os
+import sys
+if sys.version_info < min_py:
+    print(f"This program requires Python {min_py[0]}.{min_py[1]}, or higher.")
+    sys.exit(os.EX_SOFTWARE)
+
+###
+# Other standard distro imports
+###
+import contextlib
+import cProfile
+import glob
+import io
+import pstats
+import threading
+import time
+import tracemalloc
+
+###
+# global objects
+###
+verbose = False
+
+# Since Python 3.12, cProfile sees all of the threads.
+profiles_all_threads = sys.version_info >= (3, 12)
+
+
+# The lists of profiles of the thread_profiles() that are under way.
+collecting = []
+collecting_lock = threading.Lock()
+
+
+@contextlib.contextmanager
+def thread_profiles() -> Iterator[List[cProfile.Profile]]:
+    """
+    Yield a list of the profiles of the threads that call profile_thread()
+    while the with statement runs. The refresh's thread pools do, and
+    other threads, such as the log writer and the probe sessions' reader,
+    do not, as they outlive the refresh.
+    """
+    profiles = []
+    with collecting_lock:
+        collecting.append(profiles)
+    try:
+        yield profiles
+    finally:
+        with collecting_lock:
+            collecting.remove(profiles)
+
+
+def profile_thread() -> None:
+    """
+    The initializer of a refresh's thread pools, e.g.,
+    ThreadPoolExecutor(initializer=profile_thread): profile the rest
+    of this thread's life, if a refresh is being profiled.
+    """
+    if profiles_all_threads: return
+    with collecting_lock:
+        if not collecting: return
+        profile = cProfile.Profile()
+        collecting[-1].append(profile)
+    profile.enable()
+
+
+class RefreshProfiler: pass
+
+class RefreshProfiler:
+    """
+    Usage:
+        profiler = RefreshProfiler('/some/dir')
+        with profiler.refresh():
+            ... one refresh ...
+    """
+    __slots__ = {
+        'directory': 'where the profiles are written',
+        'keep': 'number of refreshes whose profiles are kept',
+        'top': 'number of functions and allocation sites in the text report',
+        'count': 'number of refreshes profiled so far'
+        }
+
+    __values__ = (None, 20, 25, 0)
+
+    __defaults__ = dict(zip(__slots__.keys(), __values__))
+
+    def __init__(self, directory:str, **kwargs) -> None:
+        for k, v in RefreshProfiler.__defaults__.items():
+            setattr(self, k, v)
+
+        for k, v in kwargs.items():
+            if k in RefreshProfiler.__slots__:
+                setattr(self, k, v)
+
+        self.directory = os.path.expanduser(directory)
+        os.makedirs(self.directory, exist_ok=True)
+
+        # Continue the numbering of an earlier run in the same directory.
+        done = sorted(glob.glob(os.path.join(self.directory, 'refresh-*.prof')))
+        if done:
+            self.count = int(os.path.basename(done[-1])[8:-5])
+
+
+    @contextlib.contextmanager
+    def refresh(self) -> Iterator[None]:
+        """
+        Profile the body of the with statement as one refresh.
+        """
+        self.count += 1
+        started_tracing = not tracemalloc.is_tracing()
+        if started_tracing: tracemalloc.start(10)
+        before = tracemalloc.take_snapshot()
+        profile = cProfile.Profile()
+        start = time.perf_counter()
+
+        with thread_profiles() as workers:
+            profile.enable()
+            try:
+                yield
+            finally:
+                profile.disable()
+                elapsed = time.perf_counter() - start
+                after = tracemalloc.take_snapshot()
+                current, peak = tracemalloc.get_traced_memory()
+                if started_tracing: tracemalloc.stop()
+                self.write([profile] + workers, after.compare_to(before, 'lineno'), elapsed, current, peak)
+                self.rotate()
+
+
+    def write(self, profiles:List[cProfile.Profile], growth:list,
+        elapsed:float, current:int, peak:int) -> None:
+        """
+        Write the .prof and .txt files for this refresh, with the
+        profiles of all of its threads merged.
+        """
+        stem = os.path.join(self.directory, f"refresh-{self.count:05d}")
+        text = io.StringIO()
+        stats = pstats.Stats(profiles[0], stream=text)
+        for profile in profiles[1:]:
+            stats.add(profile)
+        stats.dump_stats(f"{stem}.prof")
+
+        text.write(f"refresh {self.count} at {time.strftime('%Y-%m-%d %H:%M:%S')} "
+            f"took {elapsed:.3f}s; traced memory {current/1e6:.1f} MB, peak {peak/1e6:.1f} MB\n\n")
+        text.write(f"Top {self.top} allocation sites during the refresh:\n")
+        for stat in growth[:self.top]:
+            text.write(f"    {stat}\n")
+        text.write("\n")
+        stats.sort_stats('cumulative').print_stats(self.top)
+
+        with open(f"{stem}.txt", 'w') as f:
+            f.write(text.getvalue())
+
+
+    def rotate(self) -> None:
+        """
+        Remove all but the newest self.keep refreshes.
+        """
+        for n in range(self.count - self.keep, 0, -1):
+            stem = os.path.join(self.directory, f"refresh-{n:05d}")
+            if not os.path.exists(f"{stem}.prof"): break
+            for suffix in ('.prof', '.txt'):
+                with contextlib.suppress(FileNotFoundError):
+                    os.unlink(f"{stem}{suffix}")
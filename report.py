@@ -0,0 +1,424 @@
+# -*- coding: utf-8 -*-
+"""
+Utilization and efficiency reports over the history that activityview
+--history records. For each node, for each partition, and for all of
+them together, over any range of time:
+
+    the average cores and memory allocated, used and present,
+    the median and 95th percentile of the cores and memory used,
+    the efficiency, i.e., the used core-hours over the allocated ones,
+    the hours spent allocated but idle, and overcommitted, by the same
+    rules as the anomaly detector, and the core-hours behind each.
+
+Every row is weighted by the time it stands for: the width of the
+bucket for the rollups, and the time until the next sample (but no
+more than --max-gap) for the raw series. The nodes are read one at a
+time, so the memory needed depends on the length of the range, not on
+the number of nodes. The percentiles come from fixed-width histograms
+of the time spent at each level of use, so that they can be added up
+across nodes; they are rounded down to the width of a bin.
+
+With numpy, each node's columns are decoded straight from the history
+files and reduced in a few vectorized passes. Without it, the same
+numbers are computed row by row, which is much slower.
+"""
+
+import typing
+from   typing import *
+
+###
+# Credits
+###
+__author__ = 'Alina Enikeeva'
+__copyright__ = 'Copyright 2022, University of Richmond'
+__credits__ = None
+__version__ = 0.1
+__maintainer__ = 'Alina Enikeeva, George Flanagin'
+__email__ = 'hpc@richmond.edu'
+__status__ = 'in progress'
+__license__ = 'MIT'
+
+
+###
+# Standard imports, starting with os and sys
+###
+min_py = (3, 8)
+import os
+import sys
+if sys.version_info < min_py:
+    print(f"This program requires Python {min_py[0]}.{min_py[1]}, or higher.")
+    sys.exit(os.EX_SOFTWARE)
+
+###
+# Other standard distro imports
+###
+import argparse
+import contextlib
+import csv
+from   datetime import datetime
+import json
+import statistics
+
+try:
+    import numpy as np
+    use_numpy = True
+except ImportError as e:
+    use_numpy = False
+
+###
+# imports that are a part of this project
+###
+from   anomaly import AnomalyDetector
+from   history_store import HistoryStore, RESOLUTIONS, SCALE, parse_when, pick_resolution
+from   hostlist import NodeSet
+from   view_utils import dorunrun_many
+from   wrapper import trap
+
+###
+# global objects
+###
+verbose = False
+
+# The columns that are averaged over time.
+AVERAGED = ('alloc_cores', 'used_cores', 'total_cores', 'alloc_mem', 'used_mem', 'total_mem')
+
+# The histograms of the cores and the memory used: 4096 bins each, of
+# a quarter of a core (up to 1024 cores) and of 4 GB (up to 16 TB).
+# The last bin takes anything larger.
+CORE_BIN, MEM_BIN, BINS = 0.25, 4.0, 4096
+
+FIELDS = ('scope', 'name', 'nodes', 'hours',
+    'avg_alloc_cores', 'avg_used_cores', 'avg_total_cores', 'p50_used_cores', 'p95_used_cores',
+    'avg_alloc_mem', 'avg_used_mem', 'avg_total_mem', 'p50_used_mem', 'p95_used_mem',
+    'cpu_efficiency', 'mem_efficiency',
+    'idle_alloc_hours', 'idle_alloc_core_hours', 'overcommit_hours', 'overcommit_core_hours')
+
+
+def durations(t:list, width:int, max_gap:float) -> list:
+    """
+    The seconds that each row stands for: the width of the bucket for
+    a rollup, and otherwise the time to the next row, capped at
+    max_gap. The last raw row is given the median spacing. No rows
+    stand for nothing.
+    """
+    if width or not len(t):
+        return np.full(len(t), float(width)) if use_numpy else [float(width)] * len(t)
+
+    if use_numpy:
+        gaps = np.diff(t).astype(float)
+        last = np.median(gaps) if len(gaps) else 0.0
+        return np.minimum(np.append(gaps, last), max_gap)
+
+    gaps = [ float(b - a) for a, b in zip(t, t[1:]) ]
+    last = statistics.median(gaps) if gaps else 0.0
+    return [ min(_, max_gap) for _ in gaps + [last] ]
+
+
+def read_node(store:HistoryStore, node:str, start:float, end:float,
+    resolution:str) -> Tuple[list, Dict[str, list]]:
+    """
+    All of the node's rows in [start, end], as its times and its
+    averaged columns in cores and GB. With numpy, the blocks are
+    joined and decoded in one pass per column.
+    """
+    if not use_numpy:
+        t, columns = [], { _: [] for _ in AVERAGED }
+        for times, values in store.series(node, start, end, resolution):
+            t.extend(times)
+            for name in AVERAGED:
+                columns[name].extend( _ / SCALE for _ in values[name] )
+        return t, columns
+
+    blocks = list(store.blocks(node, start, end, resolution))
+    if not blocks: return np.empty(0, np.int64), {}
+
+    counts = np.array([ len(_[1]) // 4 for _ in blocks ])
+    t = (np.frombuffer(b''.join(_[1] for _ in blocks), '<u4') +
+        np.repeat(np.array([ _[0] for _ in blocks ], np.int64), counts))
+
+    columns = {}
+    for name in AVERAGED:
+        deltas = np.frombuffer(b''.join(_[2][name][1] for _ in blocks), '<i4')
+        bases = np.repeat(np.array([ _[2][name][0] for _ in blocks ], np.int64), counts)
+        columns[name] = (deltas + bases) / SCALE
+    return t, columns
+
+
+class Tally: pass
+
+class Tally:
+    """
+    The sums behind one row of the report. Tallies add up, so that a
+    partition's is the sum of its nodes'.
+
+    Usage:
+        tally = Tally()
+        tally.add(dt, columns)
+        total.merge(tally)
+        row = total.row('partition', 'basic')
+    """
+    __slots__ = {
+        'nodes': 'number of nodes tallied',
+        'idle_fraction': 'fraction of the allocated cores below which a node is idle',
+        'overload_margin': 'fraction of the cores by which load may exceed the allocation',
+        'seconds': 'node-seconds of history',
+        'sums': 'column -> its integral over time',
+        'idle_seconds': 'node-seconds allocated but idle',
+        'idle_core_seconds': 'core-seconds allocated but not used',
+        'over_seconds': 'node-seconds overcommitted',
+        'over_core_seconds': 'core-seconds used beyond the allocation',
+        'core_hist': 'seconds spent at each quarter core used',
+        'mem_hist': 'seconds spent at each 4 GB used'
+        }
+
+    __values__ = (0, AnomalyDetector.__defaults__['idle_fraction'],
+        AnomalyDetector.__defaults__['overload_margin'], 0.0, None, 0.0, 0.0, 0.0, 0.0, None, None)
+
+    __defaults__ = dict(zip(__slots__.keys(), __values__))
+
+    def __init__(self, **kwargs) -> None:
+        for k, v in Tally.__defaults__.items():
+            setattr(self, k, v)
+
+        for k, v in kwargs.items():
+            if k in Tally.__slots__:
+                setattr(self, k, v)
+
+        self.sums = dict.fromkeys(AVERAGED, 0.0)
+        self.core_hist = np.zeros(BINS) if use_numpy else [0.0] * BINS
+        self.mem_hist = np.zeros(BINS) if use_numpy else [0.0] * BINS
+
+
+    def add(self, dt:list, columns:Dict[str, list]) -> None:
+        """
+        Add one node's rows, dt being the seconds that each stands for.
+        A node with no rows in the range counts, but adds nothing.
+        """
+        self.nodes += 1
+        if not len(dt) or not columns: return
+        if use_numpy:
+            self._add_arrays(dt, columns)
+        else:
+            self._add_rows(dt, columns)
+
+
+    def _add_arrays(self, dt:list, columns:Dict[str, list]) -> None:
+        alloc, used, total = columns['alloc_cores'], columns['used_cores'], columns['total_cores']
+
+        self.seconds += dt.sum()
+        for name in AVERAGED:
+            self.sums[name] += np.dot(columns[name], dt)
+
+        idle = (alloc > 0) & (used < np.maximum(self.idle_fraction * alloc, 0.5))
+        over = (used > total) | (used > alloc + np.maximum(self.overload_margin * total, 1))
+        self.idle_seconds += dt[idle].sum()
+        self.over_seconds += dt[over].sum()
+        self.idle_core_seconds += np.dot(np.maximum(alloc - used, 0), dt)
+        self.over_core_seconds += np.dot(np.maximum(used - alloc, 0), dt)
+
+        for hist, values, width in ((self.core_hist, used, CORE_BIN),
+                (self.mem_hist, columns['used_mem'], MEM_BIN)):
+            bins = np.clip((values / width).astype(np.int64), 0, BINS - 1)
+            hist += np.bincount(bins, weights=dt, minlength=BINS)
+
+
+    def _add_rows(self, dt:List[float], columns:Dict[str, List[float]]) -> None:
+        rows = zip(dt, *(columns[_] for _ in AVERAGED))
+        for seconds, alloc, used, total, alloc_mem, used_mem, total_mem in rows:
+            self.seconds += seconds
+            for name, v in zip(AVERAGED, (alloc, used, total, alloc_mem, used_mem, total_mem)):
+                self.sums[name] += v * seconds
+
+            if alloc > 0 and used < max(self.idle_fraction * alloc, 0.5):
+                self.idle_seconds += seconds
+            if used > total or used > alloc + max(self.overload_margin * total, 1):
+                self.over_seconds += seconds
+            self.idle_core_seconds += max(alloc - used, 0) * seconds
+            self.over_core_seconds += max(used - alloc, 0) * seconds
+
+            self.core_hist[min(max(int(used / CORE_BIN), 0), BINS - 1)] += seconds
+            self.mem_hist[min(max(int(used_mem / MEM_BIN), 0), BINS - 1)] += seconds
+
+
+    def merge(self, other:Tally) -> None:
+        self.nodes += other.nodes
+        self.seconds += other.seconds
+        for name in AVERAGED:
+            self.sums[name] += other.sums[name]
+        for k in ('idle_seconds', 'idle_core_seconds', 'over_seconds', 'over_core_seconds'):
+            setattr(self, k, getattr(self, k) + getattr(other, k))
+        if use_numpy:
+            self.core_hist += other.core_hist
+            self.mem_hist += other.mem_hist
+        else:
+            self.core_hist = [ a + b for a, b in zip(self.core_hist, other.core_hist) ]
+            self.mem_hist = [ a + b for a, b in zip(self.mem_hist, other.mem_hist) ]
+
+
+    def percentile(self, hist:list, width:float, p:float) -> Optional[float]:
+        """
+        The level of use below which the nodes spent p percent of the
+        time, to the width of a bin.
+        """
+        if not self.seconds: return None
+        target = self.seconds * p / 100
+        if use_numpy:
+            i = int(np.searchsorted(np.cumsum(hist), target))
+        else:
+            i, running = 0, hist[0]
+            while running < target and i < BINS - 1:
+                i += 1
+                running += hist[i]
+        return min(i, BINS - 1) * width
+
+
+    def row(self, scope:str, name:str) -> dict:
+        """
+        The report's row. The averages are per node for a node, and
+        for the whole group otherwise: the integral over time divided
+        by the average node's hours of history.
+        """
+        row = dict.fromkeys(FIELDS)
+        row.update(scope=scope, name=name, nodes=self.nodes, hours=round(float(self.seconds) / 3600, 2))
+        if not self.seconds: return row
+
+        # As Python floats: numpy rounds halves differently.
+        span = float(self.seconds) / self.nodes
+        for column in AVERAGED:
+            row[f"avg_{column}"] = round(float(self.sums[column]) / span, 2)
+        for p in (50, 95):
+            row[f"p{p}_used_cores"] = self.percentile(self.core_hist, CORE_BIN, p)
+            row[f"p{p}_used_mem"] = self.percentile(self.mem_hist, MEM_BIN, p)
+        for kind, alloc, used in (('cpu', 'alloc_cores', 'used_cores'), ('mem', 'alloc_mem', 'used_mem')):
+            if self.sums[alloc]:
+                row[f"{kind}_efficiency"] = round(float(self.sums[used] / self.sums[alloc]), 3)
+
+        row.update(
+            idle_alloc_hours = round(float(self.idle_seconds) / 3600, 2),
+            idle_alloc_core_hours = round(float(self.idle_core_seconds) / 3600, 2),
+            overcommit_hours = round(float(self.over_seconds) / 3600, 2),
+            overcommit_core_hours = round(float(self.over_core_seconds) / 3600, 2))
+        return row
+
+
+def parse_partitions(specs:List[str]) -> Dict[str, NodeSet]:
+    """
+    NAME=HOSTLIST, as given to --partition, into name -> NodeSet.
+    """
+    partitions = {}
+    for spec in specs:
+        name, _, nodes = spec.partition('=')
+        if not name or not nodes:
+            raise Exception(f"Cannot interpret {spec} as NAME=HOSTLIST.")
+        partitions[name] = partitions.get(name, NodeSet()) | NodeSet(nodes)
+    return partitions
+
+
+def sinfo_partitions() -> Dict[str, NodeSet]:
+    """
+    The partitions of the local cluster and their nodes, or nothing if
+    sinfo cannot be run here.
+    """
+    _, result = next(dorunrun_many(['sinfo -h -o "%R %N"'], timeout=30))
+    if not result['OK']: return {}
+    return parse_partitions([ '='.join(_.split(None, 1))
+        for _ in result['stdout'].split('\n') if len(_.split()) == 2 ])
+
+
+def report(store:HistoryStore, nodes:Iterable[str], partitions:Dict[str, NodeSet],
+    start:float, end:float, resolution:str, max_gap:float, **thresholds) -> Iterator[dict]:
+    """
+    Yield a row for each node as it is read, and then one for each
+    partition and one for all the nodes together. A node kept under
+    cluster:node is matched to the partitions by its own name.
+    """
+    width = RESOLUTIONS[resolution]
+    groups = { name: Tally(**thresholds) for name in partitions }
+    everything = Tally(**thresholds)
+
+    for node in nodes:
+        t, columns = read_node(store, node, start, end, resolution)
+        tally = Tally(**thresholds)
+        tally.add(durations(t, width, max_gap), columns)
+        yield tally.row('node', node)
+
+        everything.merge(tally)
+        for name, members in partitions.items():
+            if node.rsplit(':', 1)[-1] in members:
+                groups[name].merge(tally)
+
+    for name in sorted(groups):
+        yield groups[name].row('partition', name)
+    yield everything.row('all', 'all')
+
+
+@trap
+def report_main(myargs:argparse.Namespace) -> int:
+    start = parse_when(myargs.start)
+    end = parse_when(myargs.end)
+    resolution = pick_resolution(end - start) if myargs.resolution == 'auto' else myargs.resolution
+
+    store = HistoryStore(myargs.dir)
+    nodes = NodeSet(store.nodes(resolution))
+    if myargs.nodes: nodes &= NodeSet(myargs.nodes)
+    partitions = parse_partitions(myargs.partition) if myargs.partition else sinfo_partitions()
+
+    rows = report(store, nodes, partitions, start, end, resolution, myargs.max_gap,
+        idle_fraction=myargs.idle_fraction, overload_margin=myargs.overload_margin)
+    if myargs.summary:
+        rows = ( _ for _ in rows if _['scope'] != 'node' )
+
+    if myargs.format == 'json':
+        print(json.dumps(dict(start=datetime.fromtimestamp(start).isoformat(),
+            end=datetime.fromtimestamp(end).isoformat(), resolution=resolution,
+            rows=list(rows)), indent=4))
+    else:
+        writer = csv.DictWriter(sys.stdout, fieldnames=FIELDS)
+        writer.writeheader()
+        writer.writerows(rows)
+
+    return os.EX_OK
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(prog="report",
+        description="Utilization and efficiency of the nodes, from the history recorded by activityview --history.")
+
+    parser.add_argument('-d', '--dir', type=str, required=True,
+        help="The history directory given to activityview --history.")
+    parser.add_argument('-n', '--nodes', type=str, default="",
+        help="Nodes to report, as names or hostlist expressions (spdr[01-30]). Defaults to all of them.")
+    parser.add_argument('-p', '--partition', type=str, action='append', default=[],
+        help="A partition, as NAME=HOSTLIST, e.g. basic=spdr[01-30]. May be repeated. "
+        "Without it, the partitions are taken from sinfo, if it can be run.")
+    parser.add_argument('--start', type=str, default="-1d",
+        help="Start of the range: now, -90m, -6h, -2d, or an ISO date/time. Defaults to -1d. "
+        "Relative times need the = form, e.g. --start=-30d.")
+    parser.add_argument('--end', type=str, default="now",
+        help="End of the range, in the same forms as --start. Defaults to now.")
+    parser.add_argument('--resolution', type=str, default="auto",
+        choices=('auto',) + tuple(RESOLUTIONS.keys()),
+        help="Which series to read. auto picks one based on the length of the range.")
+    parser.add_argument('--max-gap', type=float, default=300.0,
+        help="Most seconds that one raw sample may stand for. Only that much of a longer gap is counted.")
+    parser.add_argument('--idle-fraction', type=float, default=Tally.__defaults__['idle_fraction'],
+        help="Fraction of the allocated cores below which an allocated node is idle.")
+    parser.add_argument('--overload-margin', type=float, default=Tally.__defaults__['overload_margin'],
+        help="Fraction of the cores by which use may exceed the allocation before it is overcommitted.")
+    parser.add_argument('-s', '--summary', action='store_true',
+        help="Only report the partitions and the total, not each node.")
+    parser.add_argument('--format', type=str, default="csv", choices=('csv', 'json'),
+        help="Output format.")
+    parser.add_argument('-o', '--output', type=str, default="",
+        help="Output file name")
+
+    myargs = parser.parse_args()
+
+    try:
+        outfile = sys.stdout if not myargs.output else open(myargs.output, 'w')
+        with contextlib.redirect_stdout(outfile):
+            sys.exit(globals()[f"{os.path.basename(__file__)[:-3]}_main"](myargs))
+
+    except Exception as e:
+        print(f"Escaped or re-raised exception: {e}")
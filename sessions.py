@@ -0,0 +1,361 @@
+# -*- coding: utf-8 -*-
+"""
+Long-lived probe sessions: one ssh per node, started once, that runs a
+small sampling loop on the node and writes a short record every
+interval:
+
+    <load average>
+    <the first lines of /proc/meminfo>
+    <the cpu line of /proc/stat>
+    [the cgroup lines, with --cgroups]
+    @@sample
+
+One thread reads all the sessions through a selector, and turns each
+record into a reading of the node as it arrives, so a refresh only
+has to take the latest reading of each node, without starting any
+processes. The busy cores come from the change in the CPU counters
+between two records of the same session, and the cores the jobs use
+from the change in their cgroup counters, in the same way as for the
+probes.
+
+A session that ends, or that has written nothing for two intervals
+and a timeout, is killed and started again after a back-off that
+doubles with each failure in a row, up to a limit, with some jitter
+so that the nodes of a rack that went down together do not all come
+back at once.
+"""
+
+import typing
+from   typing import *
+
+###
+# Credits
+###
+__author__ = 'Alina Enikeeva'
+__copyright__ = 'Copyright 2022, University of Richmond'
+__credits__ = None
+__version__ = 0.1
+__maintainer__ = 'Alina Enikeeva, George Flanagin'
+__email__ = 'hpc@richmond.edu'
+__status__ = 'in progress'
+__license__ = 'MIT'
+
+
+###
+# Standard imports, starting with os and sys
+###
+min_py = (3, 8)
+import os
+import sys
+if sys.version_info < min_py:
+    print(f"This program requires Python {min_py[0]}.{min_py[1]}, or higher.")
+    sys.exit(os.EX_SOFTWARE)
+
+###
+# Other standard distro imports
+###
+import random
+import selectors
+import signal
+import subprocess
+import threading
+import time
+
+###
+# imports that are a part of this project
+###
+from   cgroups import job_usage
+from   procstat import utilization
+from   view_utils import SloppyDict
+
+###
+# global objects
+###
+verbose = False
+
+SAMPLE_END = '@@sample'
+CORES = '@@cores'
+
+
+def session_command(node:str, script:str, interval:float) -> List[str]:
+    """
+    The ssh that keeps running script on the node every interval
+    seconds, after saying once how many cores the node has. ssh's
+    keepalives notice a node that has gone away without closing the
+    connection.
+    """
+    remote = (f"echo {CORES} $(grep -c '^cpu[0-9]' /proc/stat); "
+        f"while :; do {script}; echo {SAMPLE_END}; sleep {interval:g}; done")
+    return ['ssh', '-o', 'ConnectTimeout=1', '-o', 'ServerAliveInterval=10',
+        '-o', 'ServerAliveCountMax=3', node, remote]
+
+
+class Session:
+    """
+    The state of one node's session.
+    """
+    __slots__ = ('node', 'proc', 'partial', 'lines', 'cores', 'last', 'heard',
+        'failures', 'retry_at')
+
+    def __init__(self, node:str) -> None:
+        self.node = node
+        self.proc = None
+        self.partial = b''
+        self.lines = []
+        self.cores = None
+        self.last = None
+        self.heard = 0.0
+        self.failures = 0
+        self.retry_at = 0.0
+
+
+class ProbeSessions: pass
+
+class ProbeSessions:
+    """
+    The sessions of one cluster's nodes, and the latest reading of each.
+
+    Usage:
+        sessions = ProbeSessions(script=..., parse=parse_probe, interval=60)
+        for node, reading in sessions.readings(nodes, wait=10): ...
+        sessions.close()
+    """
+    __slots__ = {
+        'script': 'the shell commands that take one sample on the node',
+        'parse': 'turns one record into a sample with load, mem, counters and cgroups',
+        'interval': 'seconds between the samples of a session',
+        'timeout': 'seconds allowed for a session to connect, or to be late',
+        'max_backoff': 'most seconds to wait before starting a failed session again',
+        'command': 'node, script, interval -> the command that starts a session',
+        'sessions': 'node -> its Session',
+        'latest': 'node -> its latest reading',
+        'wanted': 'the nodes that should have a session',
+        'selector': 'the selector that the reader waits on',
+        'arrived': 'Condition, notified when a reading arrives; it also guards the state',
+        'stopping': 'Event, set to stop the reader',
+        'reader': 'the thread that reads the sessions'
+        }
+
+    __values__ = ("", None, 60.0, 10.0, 300.0, session_command,
+        None, None, None, None, None, None, None)
+
+    __defaults__ = dict(zip(__slots__.keys(), __values__))
+
+    def __init__(self, **kwargs) -> None:
+        for k, v in ProbeSessions.__defaults__.items():
+            setattr(self, k, v)
+
+        for k, v in kwargs.items():
+            if k in ProbeSessions.__slots__:
+                setattr(self, k, v)
+
+        self.sessions = {}
+        self.latest = {}
+        self.wanted = set()
+        self.selector = selectors.DefaultSelector()
+        self.arrived = threading.Condition()
+        self.stopping = threading.Event()
+        self.reader = threading.Thread(target=self._read, name='probe-sessions', daemon=True)
+        self.reader.start()
+
+
+    @property
+    def stale(self) -> float:
+        """
+        Seconds after which a reading is too old to use, and a session
+        that has said nothing for that long is given up on.
+        """
+        return 2 * self.interval + self.timeout
+
+
+    ###
+    # What the collector calls
+    ###
+    def want(self, nodes:Iterable[str]) -> None:
+        """
+        Start sessions for these nodes, as well as those already running.
+        """
+        with self.arrived:
+            self.wanted.update(nodes)
+
+
+    def retain(self, nodes:Iterable[str]) -> None:
+        """
+        Keep the sessions of these nodes only; the others are ended.
+        """
+        with self.arrived:
+            self.wanted.intersection_update(nodes)
+
+
+    def readings(self, nodes:Iterable[str], wait:float) -> Iterator[Tuple[str, Optional[SloppyDict]]]:
+        """
+        Yield (node, reading) for each of the nodes: first those with a
+        recent reading, and then, for up to wait seconds, the others as
+        their readings arrive. Those that have none by then come last,
+        with None.
+        """
+        nodes = set(nodes)
+        self.want(nodes)
+        deadline = time.monotonic() + wait
+        while nodes:
+            with self.arrived:
+                now = time.monotonic()
+                ready = { node: self.latest[node] for node in nodes
+                    if node in self.latest and now - self.latest[node].time <= self.stale }
+                if not ready and now < deadline:
+                    self.arrived.wait(min(deadline - now, 0.5))
+                    continue
+            if not ready: break
+            for node, reading in ready.items():
+                nodes.discard(node)
+                yield node, reading
+
+        for node in nodes:
+            yield node, None
+
+
+    def close(self) -> None:
+        """
+        Stop the reader, and end all of the sessions.
+        """
+        self.stopping.set()
+        self.reader.join(timeout=5)
+        with self.arrived:
+            for session in self.sessions.values():
+                self._end(session)
+            self.sessions = {}
+        self.selector.close()
+
+
+    ###
+    # The reader
+    ###
+    def _read(self) -> None:
+        while not self.stopping.is_set():
+            with self.arrived:
+                self._manage(time.monotonic())
+
+            if not self.selector.get_map():
+                self.stopping.wait(0.5)
+                continue
+
+            events = self.selector.select(0.5)
+
+            with self.arrived:
+                for key, _ in events:
+                    session = key.data
+                    try:
+                        chunk = os.read(key.fd, 65536)
+                    except OSError as e:
+                        chunk = b''
+                    if chunk:
+                        self._receive(session, chunk)
+                    else:
+                        self._fail(session)
+
+
+    def _manage(self, now:float) -> None:
+        """
+        Start the sessions that are wanted and due, end those that are
+        not wanted any more, and give up on those that have gone quiet.
+        """
+        for node in [ _ for _ in self.sessions if _ not in self.wanted ]:
+            self._end(self.sessions.pop(node))
+            self.latest.pop(node, None)
+
+        for node in self.wanted:
+            session = self.sessions.get(node)
+            if session is None:
+                session = self.sessions[node] = Session(node)
+            if session.proc is None and now >= session.retry_at:
+                self._start(session, now)
+            elif session.proc is not None and now - session.heard > self.stale:
+                self._fail(session)
+
+
+    def _start(self, session:Session, now:float) -> None:
+        try:
+            session.proc = subprocess.Popen(self.command(session.node, self.script, self.interval),
+                stdin=subprocess.DEVNULL,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.DEVNULL,
+                start_new_session=True)
+        except OSError as e:
+            session.proc = None
+            self._back_off(session, now)
+            return
+
+        session.partial, session.lines, session.last = b'', [], None
+        session.heard = now
+        self.selector.register(session.proc.stdout, selectors.EVENT_READ, session)
+
+
+    def _end(self, session:Session) -> None:
+        """
+        Kill the session's ssh, and forget its pipe.
+        """
+        if session.proc is None: return
+        try:
+            self.selector.unregister(session.proc.stdout)
+        except (KeyError, ValueError) as e:
+            pass
+        try:
+            os.killpg(session.proc.pid, signal.SIGKILL)
+        except ProcessLookupError as e:
+            pass
+        session.proc.wait()
+        session.proc.stdout.close()
+        session.proc = None
+
+
+    def _fail(self, session:Session) -> None:
+        self._end(session)
+        self._back_off(session, time.monotonic())
+
+
+    def _back_off(self, session:Session, now:float) -> None:
+        session.failures += 1
+        delay = min(self.max_backoff, 2 ** min(session.failures, 16))
+        session.retry_at = now + delay * random.uniform(0.5, 1.0)
+
+
+    def _receive(self, session:Session, chunk:bytes) -> None:
+        """
+        Split the output into lines, and read each complete record.
+        """
+        *complete, session.partial = (session.partial + chunk).split(b'\n')
+        for line in complete:
+            line = line.decode('utf-8', errors='replace')
+            if line.startswith(CORES):
+                try:
+                    session.cores = int(line.split()[1])
+                except (IndexError, ValueError) as e:
+                    session.cores = None
+            elif line == SAMPLE_END:
+                self._record(session, "\n".join(session.lines))
+                session.lines = []
+            else:
+                session.lines.append(line)
+
+
+    def _record(self, session:Session, text:str) -> None:
+        """
+        One complete record: the busy cores since the session's last
+        record (or the load average, for its first), the memory, and the
+        cores and memory used by each job.
+        """
+        sample = self.parse(text)
+        busy = sample.load
+        jobs = None
+        if session.last is not None and sample.counters and session.cores:
+            cpu = utilization(session.last.counters, sample.counters).get('cpu')
+            if cpu is not None: busy = round(cpu * session.cores, 2)
+        if sample.cgroups is not None:
+            jobs = job_usage(session.last.cgroups if session.last is not None else None, sample.cgroups)
+
+        now = time.monotonic()
+        session.last = sample
+        session.heard = now
+        session.failures = 0
+        self.latest[session.node] = SloppyDict(busy=busy, mem=sample.mem, job_usage=jobs, time=now)
+        self.arrived.notify_all()
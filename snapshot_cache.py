@@ -0,0 +1,298 @@
+# -*- coding: utf-8 -*-
+"""
+The last snapshot that activity-view collected, kept in the user's
+cache directory ($XDG_CACHE_HOME/activity-view, or ~/.cache/activity-view)
+so that the map can be drawn as soon as the program starts, while
+the first collection is still running.
+
+The snapshot is written as a CompactTree, replacing the previous one
+atomically, and it is only used again with the same choice of nodes
+(--input and --nodes) that it was collected with.
+
+A SharedSnapshot is the other kind of cache: one that every viewer on
+a login node can use, so that only one of them collects in each
+interval. It is written as JSON rather than pickled, because it may
+have been written by another user.
+"""
+
+import typing
+from   typing import *
+
+###
+# Credits
+###
+__author__ = 'Alina Enikeeva'
+__copyright__ = 'Copyright 2022, University of Richmond'
+__credits__ = None
+__version__ = 0.1
+__maintainer__ = 'Alina Enikeeva, George Flanagin'
+__email__ = 'hpc@richmond.edu'
+__status__ = 'in progress'
+__license__ = 'MIT'
+
+
+###
+# Standard imports, starting with os and sys
+###
+min_py = (3, 8)
+import os
+import sys
+if sys.version_info < min_py:
+    print(f"This program requires Python {min_py[0]}.{min_py[1]}, or higher.")
+    sys.exit(os.EX_SOFTWARE)
+
+###
+# Other standard distro imports
+###
+import contextlib
+import fcntl
+import glob
+import hashlib
+import json
+import pwd
+import tempfile
+import time
+
+###
+# imports that are a part of this project
+###
+from   view_utils import CompactTree, SloppyDict
+
+###
+# global objects
+###
+verbose = False
+
+CACHE_NAME = 'snapshot.bin'
+CACHE_VERSION = 1
+SHARED_DIR = os.path.join(tempfile.gettempdir(), 'activity-view-shared')
+LOCK_POLL = 0.2
+
+
+def cache_dir() -> str:
+    """
+    The per-user cache directory, following the XDG convention.
+    """
+    base = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(base, 'activity-view')
+
+
+def save_snapshot(snapshot:Dict[str, dict], selection:str,
+    name:str=CACHE_NAME, when:float=None) -> bool:
+    """
+    Replace the cached snapshot. The cache is only a convenience, so
+    a failure to write it is reported but not raised.
+
+    snapshot -- node name -> record, as from get_info().
+    selection -- identifies the nodes that were asked for.
+    name -- the file in the cache directory; each cluster has its own.
+    when -- the time of the snapshot; defaults to now.
+    """
+    tree = CompactTree({
+        'version': CACHE_VERSION,
+        'time': time.time() if when is None else when,
+        'selection': selection,
+        'nodes': { node: dict(rec) for node, rec in snapshot.items() }
+        })
+
+    directory = cache_dir()
+    tmp = os.path.join(directory, f".{name}.{os.getpid()}")
+    try:
+        os.makedirs(directory, mode=0o700, exist_ok=True)
+        with open(tmp, 'wb') as f:
+            f.write(tree.to_bytes())
+        os.replace(tmp, os.path.join(directory, name))
+        return True
+
+    except OSError as e:
+        with contextlib.suppress(OSError):
+            os.unlink(tmp)
+        return False
+
+
+def load_snapshot(selection:str, name:str=CACHE_NAME) -> Optional[Tuple[float, Dict[str, SloppyDict]]]:
+    """
+    The time and the records of the cached snapshot, or None if there
+    is no usable one for this selection of nodes.
+    """
+    try:
+        with open(os.path.join(cache_dir(), name), 'rb') as f:
+            tree = CompactTree.from_bytes(f.read())
+    except Exception as e:
+        return None
+
+    if (not isinstance(tree, CompactTree) or tree.get('version') != CACHE_VERSION
+        or tree.get('selection') != selection):
+        return None
+
+    return tree['time'], { node: SloppyDict(rec.as_dict())
+        for node, rec in tree.get('nodes', {}).items() }
+
+
+def parse_users(spec:str) -> Tuple[int, ...]:
+    """
+    user,user,... -> their uids. A user is a name or a uid.
+    """
+    uids = []
+    for user in ( _ for _ in spec.split(',') if _.strip() ):
+        user = user.strip()
+        try:
+            uids.append(int(user) if user.isdigit() else pwd.getpwnam(user).pw_uid)
+        except KeyError as e:
+            raise Exception(f"Unknown user {user!r} in {spec!r}.") from None
+    return tuple(uids)
+
+
+class SharedSnapshot: pass
+
+class SharedSnapshot:
+    """
+    A snapshot that the viewers on one host share. The first viewer to
+    find it missing or older than ttl seconds takes the lock and
+    collects; the others wait for the lock, and then find the new
+    snapshot and use it. There is no daemon: the lock is an flock on a
+    file next to the snapshot, and it is released if the viewer that
+    holds it dies. A viewer that has waited ttl seconds for the lock
+    collects on its own, so that a hung collection, or anyone holding
+    the lock, cannot stop the others.
+
+    Anyone can write to the directory, so only the snapshots of this
+    user, and of the trusted users, are used.
+
+    Usage:
+        shared = SharedSnapshot(key=selection(), ttl=60)
+        snapshot, collected = shared.get_or_collect(collect)
+    """
+    __slots__ = {
+        'directory': 'where the snapshots and their locks are kept',
+        'key': 'identifies what was collected; only snapshots with the same key are used',
+        'ttl': 'seconds for which a snapshot is fresh',
+        'trusted': 'uids, besides this user\'s, whose snapshots are used'
+        }
+
+    __values__ = (SHARED_DIR, "", 60.0, ())
+
+    __defaults__ = dict(zip(__slots__.keys(), __values__))
+
+    def __init__(self, **kwargs) -> None:
+        for k, v in SharedSnapshot.__defaults__.items():
+            setattr(self, k, v)
+
+        for k, v in kwargs.items():
+            if k in SharedSnapshot.__slots__:
+                setattr(self, k, v)
+
+
+    @property
+    def stem(self) -> str:
+        """
+        Each key has its own files, so that viewers of different nodes
+        do not take turns overwriting one snapshot.
+        """
+        return os.path.join(self.directory, hashlib.sha1(self.key.encode()).hexdigest()[:16])
+
+
+    @property
+    def path(self) -> str:
+        """
+        Each user writes their own copy, because the directory is sticky,
+        like /tmp, and one user cannot replace another's file.
+        """
+        return f"{self.stem}.{os.getuid()}.json"
+
+
+    def fresh(self) -> Optional[Dict[str, SloppyDict]]:
+        """
+        The newest shared snapshot for this key, written by this user or
+        a trusted one, if it is less than ttl seconds old.
+        """
+        owners = {os.getuid(), *self.trusted}
+        best = None
+        for path in glob.glob(f"{glob.escape(self.stem)}.*.json"):
+            try:
+                with open(os.open(path, os.O_RDONLY | os.O_NOFOLLOW)) as f:
+                    if os.fstat(f.fileno()).st_uid not in owners: continue
+                    data = json.load(f)
+                if (data.get('version') != CACHE_VERSION or data.get('key') != self.key
+                    or time.time() - data['time'] > self.ttl):
+                    continue
+                if best is None or data['time'] > best['time']: best = data
+            except Exception as e:
+                continue
+
+        if best is None: return None
+        return { node: SloppyDict(rec) for node, rec in best['nodes'].items() }
+
+
+    def publish(self, snapshot:Dict[str, dict]) -> bool:
+        """
+        Replace the shared snapshot atomically, readable by everyone.
+        Like save_snapshot, a failure is reported but not raised.
+        """
+        tmp = f"{self.path}.{os.getpid()}"
+        try:
+            with open(tmp, 'w') as f:
+                json.dump({'version': CACHE_VERSION, 'key': self.key, 'time': time.time(),
+                    'nodes': snapshot}, f)
+            os.chmod(tmp, 0o644)
+            os.replace(tmp, self.path)
+            return True
+
+        except (OSError, TypeError, ValueError) as e:
+            with contextlib.suppress(OSError):
+                os.unlink(tmp)
+            return False
+
+
+    def open_lock(self) -> Optional[int]:
+        """
+        A descriptor of the lock file, which is created if need be. A
+        read-only descriptor is enough for flock, so a lock file that
+        another user created can be used.
+        """
+        try:
+            if not os.path.isdir(self.directory):
+                os.makedirs(self.directory, exist_ok=True)
+                with contextlib.suppress(OSError):
+                    os.chmod(self.directory, 0o1777)
+            fd = os.open(f"{self.stem}.lock", os.O_RDONLY | os.O_CREAT, 0o644)
+        except OSError as e:
+            return None
+        with contextlib.suppress(OSError):
+            os.fchmod(fd, 0o644)
+        return fd
+
+
+    def get_or_collect(self, collect:Callable[[], dict]) -> Tuple[dict, bool]:
+        """
+        A fresh snapshot, from the shared cache if there is one, or else
+        from collect(), which is then shared. Only one viewer at a time
+        collects. If the lock cannot be had, or not within ttl seconds,
+        this viewer collects on its own.
+
+        returns -- the snapshot, and whether this viewer collected it.
+        """
+        snapshot = self.fresh()
+        if snapshot is not None: return snapshot, False
+
+        fd = self.open_lock()
+        if fd is None: return collect(), True
+
+        try:
+            deadline = time.monotonic() + self.ttl
+            while True:
+                try:
+                    fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    break
+                except BlockingIOError as e:
+                    if time.monotonic() >= deadline: break
+                    time.sleep(LOCK_POLL)
+
+            # Another viewer may have collected while this one waited.
+            snapshot = self.fresh()
+            if snapshot is not None: return snapshot, False
+            snapshot = collect()
+            self.publish(snapshot)
+            return snapshot, True
+        finally:
+            os.close(fd)
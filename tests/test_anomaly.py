@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+"""
+AnomalyDetector raises a flag only once its condition has held for
+`sustain` samples in a row.
+
+    python3 -m pytest tests
+"""
+
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from   anomaly import AnomalyDetector, IDLE, MEMFULL, OVERLOADED, SURGE
+
+
+def sample(**kwargs) -> dict:
+    values = dict(node='spdr01', alloc_cores=26, total_cores=52,
+        used_cores=25.0, used_mem=100, total_mem=384)
+    values.update(kwargs)
+    return values
+
+
+@pytest.mark.parametrize('flag, values', [
+    (OVERLOADED, dict(used_cores=51.0, alloc_cores=8)),
+    (OVERLOADED, dict(used_cores=60.0, alloc_cores=52)),
+    (IDLE, dict(used_cores=0.2)),
+    (MEMFULL, dict(used_mem=380)),
+    ])
+@pytest.mark.parametrize('sustain', [1, 3, 5])
+def test_sustain(flag:str, values:dict, sustain:int) -> None:
+    detector = AnomalyDetector(sustain=sustain)
+    raised = [ flag in detector.update(sample(**values)) for _ in range(sustain + 2) ]
+    assert raised == [False] * (sustain - 1) + [True] * 3
+
+
+@pytest.mark.parametrize('flag, values', [
+    (OVERLOADED, dict(used_cores=51.0, alloc_cores=8)),
+    (IDLE, dict(used_cores=0.2)),
+    (MEMFULL, dict(used_mem=380)),
+    ])
+def test_a_break_starts_over(flag:str, values:dict) -> None:
+    detector = AnomalyDetector(sustain=3)
+    samples = [values, values, {}, values, values, values]
+    raised = [ flag in detector.update(sample(**v)) for v in samples ]
+    assert raised == [False, False, False, False, False, True]
+
+
+def test_no_answer_leaves_the_streak_alone() -> None:
+    detector = AnomalyDetector(sustain=3)
+    samples = [dict(used_mem=380), dict(used_mem=380), dict(used_cores=None), dict(used_mem=380)]
+    raised = [ detector.update(sample(**v)) for v in samples ]
+    assert raised == [(), (), (), (MEMFULL,)]
+
+
+@pytest.mark.parametrize('warmup', [2, 5])
+def test_surge_after_warmup(warmup:int) -> None:
+    detector = AnomalyDetector(warmup=warmup)
+    for i in range(warmup - 1):
+        detector.update(sample())
+    assert SURGE not in detector.update(sample(used_cores=50.0))
+
+    detector = AnomalyDetector(warmup=warmup)
+    for i in range(warmup):
+        detector.update(sample())
+    assert SURGE in detector.update(sample(used_cores=50.0))
@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+"""
+CompactTree keeps its counts of nodes and leaves right as it changes,
+and comes back the same from pickle.
+
+    python3 -m pytest tests
+"""
+
+import os
+import pickle
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from   view_utils import CompactTree
+
+
+def counts(d:dict) -> tuple:
+    """
+    The nodes and leaves of nested dicts, counted the long way: each
+    key is a node, as is each value that is not a dict, and an empty
+    dict is a leaf.
+    """
+    nodes = leaves = 0
+    for v in d.values():
+        if isinstance(v, dict):
+            n, l = counts(v)
+            nodes, leaves = nodes + 1 + n, leaves + (l if v else 1)
+        else:
+            nodes, leaves = nodes + 2, leaves + 1
+    return nodes, leaves
+
+
+def check(t:CompactTree) -> None:
+    """
+    Every subtree's counts are those of its contents, and every
+    subtree knows its parent.
+    """
+    assert (len(t), ~t) == counts(t.as_dict())
+    for v in dict.values(t):
+        if isinstance(v, CompactTree):
+            assert v._parent is t
+            check(v)
+
+
+SNAPSHOT = {
+    'spdr01': {'cores': 52, 'load': 7.25, 'jobs': {'1001': 'alice', '1002': 'bob'}},
+    'spdr02': {'cores': 52, 'load': None, 'jobs': {}},
+    'gpu01': {'gpus': {}, 'blob': b'\x00' * 1000},
+    }
+
+
+def grow(t:CompactTree) -> None: t.spdr03.jobs['1003'] = 'carol'
+def replace_leaf(t:CompactTree) -> None: t.spdr01['cores'] = {'allocated': 8, 'total': 52}
+def replace_tree(t:CompactTree) -> None: t.spdr01['jobs'] = 0
+def fill_empty(t:CompactTree) -> None: t.spdr02.jobs['1004'] = 'dave'
+def empty_out(t:CompactTree) -> None: t.spdr01.jobs.clear()
+def delete(t:CompactTree) -> None: del t.spdr01.jobs['1001']
+def delete_last(t:CompactTree) -> None: del t.spdr01.jobs['1001']; del t.spdr01.jobs['1002']
+def pop(t:CompactTree) -> None: t.pop('spdr01')
+def popitem(t:CompactTree) -> None: t.gpu01.popitem()
+def setdefault(t:CompactTree) -> None: t.setdefault('spdr04', {'cores': 8})
+def update(t:CompactTree) -> None: t.spdr02.update(load=1.5, jobs={'1005': 'erin'})
+def ior(t:CompactTree) -> None: t.spdr02 |= {'load': 2.5}
+def ilshift(t:CompactTree) -> None: t.gpu01 <<= ['a', 'b']
+def move(t:CompactTree) -> None: t.spdr02['moved'] = t.spdr01.jobs
+def into_itself(t:CompactTree) -> None: t.spdr01.jobs['me'] = t.spdr01
+def clear(t:CompactTree) -> None: t.clear()
+
+
+@pytest.mark.parametrize('change', [grow, replace_leaf, replace_tree, fill_empty,
+    empty_out, delete, delete_last, pop, popitem, setdefault, update, ior, ilshift,
+    move, into_itself, clear])
+def test_counts(change:object) -> None:
+    t = CompactTree(SNAPSHOT)
+    check(t)
+    change(t)
+    check(t)
+
+
+def test_move_leaves_the_source_alone() -> None:
+    t = CompactTree(SNAPSHOT)
+    move(t)
+    t.spdr02.moved['1006'] = 'frank'
+    assert '1006' not in t.spdr01.jobs
+    check(t)
+
+
+@pytest.mark.parametrize('protocol', range(2, pickle.HIGHEST_PROTOCOL + 1))
+def test_pickle_round_trip(protocol:int) -> None:
+    t = CompactTree(SNAPSHOT)
+    u = pickle.loads(pickle.dumps(t, protocol=protocol))
+    assert isinstance(u, CompactTree)
+    assert u.as_dict() == SNAPSHOT
+    check(u)
+
+    # The counts still follow changes after the round trip.
+    u.spdr01.jobs['1007'] = 'grace'
+    check(u)
+
+
+@pytest.mark.parametrize('out_of_band', [False, True])
+def test_to_bytes(out_of_band:bool) -> None:
+    buffers = [] if out_of_band else None
+    blob = CompactTree(SNAPSHOT).to_bytes(buffers)
+    assert (len(blob) < 1000) == out_of_band
+
+    u = CompactTree.from_bytes(blob, buffers)
+    assert bytes(u.gpu01.blob) == SNAPSHOT['gpu01']['blob']
+    check(u)
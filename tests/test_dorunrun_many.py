@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+"""
+dorunrun_many: exit codes, per-command timeouts, the batch deadline,
+and cancellation.
+
+    python3 -m pytest tests
+"""
+
+import os
+import sys
+import threading
+import time
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from   view_utils import TIMEOUT_CODE, dorunrun_many
+
+
+def alive(pid:int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError as e:
+        return False
+    return True
+
+
+@pytest.mark.parametrize('command, code, stdout', [
+    ("echo hello", 0, 'hello'),
+    (['sh', '-c', 'echo out; exit 3'], 3, 'out'),
+    (['sh', '-c', 'exit 255'], 255, ''),
+    ("no-such-command-anywhere --help", 127, ''),
+    ])
+def test_exit_codes(command:object, code:int, stdout:str) -> None:
+    (key, result), = dorunrun_many([command])
+    assert key == 0
+    assert result['code'] == code
+    assert result['OK'] == (code == 0)
+    assert result['stdout'] == stdout
+
+
+@pytest.mark.parametrize('command', [
+    "sleep 30",
+    # The grandchild holds the pipes open after its parent is killed.
+    ['sh', '-c', 'sleep 30 & sleep 30'],
+    ])
+def test_timeout(command:object) -> None:
+    started = time.monotonic()
+    results = dict(dorunrun_many({'slow':command, 'fast':"true"}, timeout=0.3))
+    assert time.monotonic() - started < 5
+    assert results['fast']['code'] == 0
+    assert results['slow']['code'] == TIMEOUT_CODE
+    assert results['slow']['name'] == 'TIMEOUT'
+
+
+def test_deadline() -> None:
+    started = time.monotonic()
+    results = list(dorunrun_many(["true"] + ["sleep 30"] * 3, max_concurrent=2, deadline=0.5))
+    assert time.monotonic() - started < 5
+    assert sorted(key for key, _ in results) == [0, 1, 2, 3]
+    codes = dict((key, result['code']) for key, result in results)
+    assert codes == {0:0, 1:TIMEOUT_CODE, 2:TIMEOUT_CODE, 3:TIMEOUT_CODE}
+
+
+@pytest.mark.parametrize('delay', [0, 0.3])
+def test_cancel(tmp_path, delay:float) -> None:
+    cancel = threading.Event()
+    timer = threading.Timer(delay, cancel.set)
+    command = ['sh', '-c', f'echo $$ >> {tmp_path}/pids; exec sleep 30']
+    timer.start()
+    time.sleep(0.05 if not delay else 0)
+
+    started = time.monotonic()
+    results = list(dorunrun_many([command] * 3, cancel=cancel))
+    timer.join()
+    assert time.monotonic() - started < 5
+    assert results == []
+
+    pids = tmp_path / 'pids'
+    assert pids.exists() == bool(delay)
+    if delay:
+        assert not any(alive(int(_)) for _ in pids.read_text().split())
@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+"""
+Forecast: when each node will fit a request, by the end times of its
+jobs, and which nodes are left out.
+
+    python3 -m pytest tests
+"""
+
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from   forecast import Forecast, describe_wait, steps
+from   placement import parse_request
+from   view_utils import SloppyDict
+
+NOW = 1_700_000_000.0
+
+
+def node(name:str='spdr01', **kwargs) -> SloppyDict:
+    """
+    A node with 52 cores and 384 GB, 48 cores and 352 GB of them
+    allocated to jobs that end in one and in two hours.
+    """
+    rec = SloppyDict(node=name, status='mix', total_cores=52, alloc_cores=48,
+        used_cores=40.0, total_mem=384, alloc_mem=352, used_mem=200,
+        releases=[(NOW + 7200, 32, 256), (NOW + 3600, 16, 96)])
+    rec.update(kwargs)
+    return rec
+
+
+def test_steps() -> None:
+    times, cores, mem = steps(node())
+    assert times == [0.0, NOW + 3600, NOW + 7200]
+    assert cores == [4, 20, 52]
+    assert mem == [32, 128, 384]
+
+
+@pytest.mark.parametrize('spec, expected', [
+    ('cores=4,mem=32G', NOW),
+    ('cores=8', NOW + 3600),
+    ('mem=100G', NOW + 3600),
+    ('cores=8,mem=200G', NOW + 7200),
+    ('cores=52,mem=384G', NOW + 7200),
+    ('cores=64', None),
+    ])
+def test_when(spec:str, expected:float) -> None:
+    forecast = Forecast([node()], made=NOW)
+    assert forecast.when('spdr01', parse_request(spec)) == expected
+
+
+@pytest.mark.parametrize('rec', [
+    node(used_cores=None, used_mem=None),
+    node(probing=True),
+    node(status='down'),
+    node(status='drain'),
+    ])
+def test_left_out(rec:SloppyDict) -> None:
+    forecast = Forecast([rec], made=NOW)
+    assert forecast.nodes == {}
+    assert forecast.earliest(parse_request('cores=1')) == []
+
+
+def test_earliest_per_cluster() -> None:
+    records = [
+        node('spdr01'),
+        node('spdr02', releases=[(NOW + 600, 48, 352)]),
+        node('spdr03', used_cores=None),
+        node('spdr01', cluster='blue', releases=[(NOW + 60, 48, 352)]),
+        ]
+    best = Forecast(records, made=NOW).earliest(parse_request('cores=16'))
+    assert [ (t, rec.get('cluster', ''), rec.node) for t, rec in best ] == [
+        (NOW + 600, '', 'spdr02'), (NOW + 60, 'blue', 'spdr01')]
+
+
+@pytest.mark.parametrize('seconds, expected', [
+    (-5, 'now'),
+    (0, 'now'),
+    (30, '(in 1m)'),
+    (3600 * 2 + 60 * 5, '(in 2h05m)'),
+    ])
+def test_describe_wait(seconds:int, expected:str) -> None:
+    assert describe_wait(NOW + seconds, NOW).endswith(expected)
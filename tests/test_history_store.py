@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+"""
+HistoryStore: what is appended reads back, the rollups merge across
+restarts, and old blocks expire.
+
+    python3 -m pytest tests
+"""
+
+import os
+import sys
+import time
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from   history_store import COLUMNS, FILE_HEADER, HistoryStore, block_size
+
+# Recent enough that nothing expires.
+T0 = int(time.time()) // 3600 * 3600 - 3600
+
+
+def sample(**kwargs) -> dict:
+    values = dict(alloc_cores=8, total_cores=52, used_cores=7.25,
+        alloc_mem=64, used_mem=31.5, total_mem=384)
+    values.update(kwargs)
+    return values
+
+
+def rows(store:HistoryStore, node:str, resolution:str) -> list:
+    return [ (t, row) for _, t, row in store.query([node], T0 - 86400, T0 + 86400, resolution) ]
+
+
+@pytest.mark.parametrize('values', [
+    sample(),
+    sample(used_cores=0.01, used_mem=0),
+    sample(used_cores=1023.99, used_mem=1536000.5, total_mem=1536000),
+    sample(alloc_cores=0, used_cores=-0.5),
+    ])
+def test_round_trip(tmp_path, values:dict) -> None:
+    store = HistoryStore(str(tmp_path), block_rows=4)
+    for i in range(10):
+        store.append('spdr01', T0 + i, values)
+    store.close()
+
+    got = rows(store, 'spdr01', 'raw')
+    assert [ t for t, _ in got ] == list(range(T0, T0 + 10))
+    for t, row in got:
+        for k in COLUMNS[:-1]:
+            assert row[k] == pytest.approx(values[k], abs=0.005)
+        assert row['samples'] == 1
+
+
+def test_rollup_merges_after_restart(tmp_path) -> None:
+    store = HistoryStore(str(tmp_path))
+    store.append('spdr01', T0, sample(used_cores=2))
+    store.append('spdr01', T0 + 10, sample(used_cores=4))
+    store.close()
+
+    store = HistoryStore(str(tmp_path))
+    store.append('spdr01', T0 + 20, sample(used_cores=9))
+    store.close()
+
+    got = rows(store, 'spdr01', '1m')
+    assert len(got) == 1
+    t, row = got[0]
+    assert t == T0
+    assert row['samples'] == 3
+    assert row['used_cores'] == pytest.approx(5.0)
+
+
+@pytest.mark.parametrize('earlier', [0, 1])
+def test_merge_into_a_new_block(tmp_path, earlier:int) -> None:
+    """
+    A merged row too far from its block's bases starts a new block,
+    and the row it replaces is not left behind.
+    """
+    store = HistoryStore(str(tmp_path))
+    for i in range(earlier):
+        store.append('spdr01', T0 - 60 * (earlier - i), sample())
+    store.append('spdr01', T0, sample())
+    store.close()
+
+    store = HistoryStore(str(tmp_path))
+    store.append('spdr01', T0 + 30, sample(total_mem=50_000_000))
+    store.close()
+
+    got = rows(store, 'spdr01', '1m')
+    assert [ t for t, _ in got ] == [ T0 - 60 * (earlier - i) for i in range(earlier) ] + [T0]
+    assert got[-1][1]['samples'] == 2
+    assert got[-1][1]['total_mem'] == pytest.approx((384 + 50_000_000) / 2)
+
+
+def test_expire(tmp_path) -> None:
+    now = int(time.time())
+    store = HistoryStore(str(tmp_path), retention={'raw': 100}, block_rows=4)
+    for t in range(now - 1000, now, 10):
+        store.append('spdr01', t, sample())
+    store.close()
+
+    times = [ t for _, t, _ in store.query(['spdr01'], now - 2000, now, 'raw') ]
+    cutoff = now - 100
+    assert times == sorted(times)
+    assert [ _ for _ in range(now - 1000, now, 10) if _ >= cutoff ] == [ _ for _ in times if _ >= cutoff ]
+    assert times[0] >= cutoff - 4 * 10 * 2
+
+    size = os.path.getsize(store.path('raw', 'spdr01'))
+    assert (size - FILE_HEADER.size) // block_size(4) <= 100 // (4 * 10) + 2
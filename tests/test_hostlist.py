@@ -0,0 +1,34 @@
+# -*- coding: utf-8 -*-
+"""
+NodeSet's hostlist expressions read back as the same set.
+
+    python3 -m pytest tests
+"""
+
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from   hostlist import NodeSet
+
+
+@pytest.mark.parametrize('names', [
+    ['login', 'login1', 'login2'],
+    ['spdr', 'spdr08', 'spdr09', 'spdr10'],
+    ['spdr8', 'spdr9', 'spdr10', 'spdr12'],
+    ['gpu01-ib', 'gpu02-ib', 'gpu', 'gpu-ib'],
+    ['a', 'b', 'b1', 'c10'],
+    ['login'],
+    [],
+    ])
+def test_round_trip(names:list) -> None:
+    s = NodeSet(names)
+    assert NodeSet(str(s)) == s
+    assert sorted(NodeSet(str(s))) == sorted(names)
+
+
+def test_bare_name_with_family() -> None:
+    assert str(NodeSet(['login', 'login1', 'login2'])) == 'login,login[1-2]'
@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+"""
+A refresh that the map runs in the background is profiled in all of
+its threads, against the simulated cluster in bench/.
+
+    python3 -m pytest tests
+"""
+
+import argparse
+import os
+import pstats
+import sys
+import time
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'bench'))
+
+import activityview
+from   bench_refresh import fake_path
+import placement
+from   profiling import RefreshProfiler
+import view_utils
+
+
+@pytest.mark.parametrize('jobs', [False, True])
+def test_background_refresh_profile(tmp_path, jobs:bool, monkeypatch) -> None:
+    monkeypatch.setenv('PATH', fake_path(str(tmp_path)))
+    monkeypatch.setenv('AV_BENCH_NODES', '8')
+    monkeypatch.setenv('AV_BENCH_LATENCY', '0.01')
+    monkeypatch.setenv('AV_BENCH_ROOT', str(tmp_path / 'nodes'))
+    monkeypatch.setenv('XDG_CACHE_HOME', str(tmp_path / 'cache'))
+    monkeypatch.chdir(tmp_path)
+
+    logger = view_utils.URLogger(level=view_utils.logging.WARNING, queued=True, burst=10)
+    monkeypatch.setattr(activityview, 'logger', logger, raising=False)
+    monkeypatch.setattr(activityview, 'collectors', [])
+    monkeypatch.setattr(activityview, 'profiler', RefreshProfiler(str(tmp_path / 'profile')))
+    monkeypatch.setattr(activityview, 'myargs', argparse.Namespace(input="", input_file="",
+        nodes="", clusters="", refresh=60, headless=False, format='text', history="",
+        probe_concurrency=64, probe_timeout=5.0, jobs=jobs, cgroups=False,
+        place=placement.parse_request('cores=8') if jobs else None,
+        stagger=False, sessions=False, no_cache=True, shared=None, shared_ttl=None),
+        raising=False)
+
+    refresher = activityview.BackgroundRefresh()
+    refresher.start()
+    deadline = time.monotonic() + 60
+    while refresher.running and time.monotonic() < deadline:
+        refresher.poll()
+        time.sleep(0.05)
+    logger.close()
+
+    assert not refresher.running
+    assert len(refresher.shown) == 8
+    stats = pstats.Stats(str(tmp_path / 'profile' / 'refresh-00001.prof'))
+    functions = { name for _, _, name in stats.stats }
+    assert {'get_info', 'collect', 'probe_nodes', 'dorunrun_many', 'SeekINFO'} <= functions
+    assert ('squeue_command' in functions) == jobs
@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+"""
+report.py: the rows of a small history, a node with nothing in the
+range, and the same rows with numpy as without it.
+
+    python3 -m pytest tests
+"""
+
+import os
+import random
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import report
+from   history_store import HistoryStore
+from   hostlist import NodeSet
+
+START = 1_700_000_000.0
+
+
+def sample(alloc:int, used:float, used_mem:float=100.0) -> dict:
+    return dict(alloc_cores=alloc, total_cores=52, used_cores=used,
+        alloc_mem=alloc * 8, used_mem=used_mem, total_mem=384)
+
+
+def rows(store:HistoryStore, nodes:str, start:float, end:float, resolution:str='raw',
+    partitions:dict=None) -> list:
+    return list(report.report(store, NodeSet(nodes), partitions or {}, start, end, resolution, 300.0))
+
+
+def random_store(directory:str) -> HistoryStore:
+    """
+    Three nodes over two hours, sampled about every 30 seconds, with
+    a few gaps longer than --max-gap.
+    """
+    store = HistoryStore(directory)
+    rng = random.Random(7)
+    for node in ('spdr01', 'spdr02', 'gpu01'):
+        t = START
+        while t < START + 7200:
+            alloc = rng.choice((0, 8, 26, 52))
+            store.append(node, t, dict(alloc_cores=alloc, total_cores=52,
+                used_cores=round(rng.uniform(0, 60), 2), alloc_mem=alloc * 8,
+                used_mem=round(rng.uniform(0, 400), 1), total_mem=384))
+            t += 30 if rng.random() > 0.02 else 900
+    store.close()
+    return HistoryStore(directory)
+
+
+@pytest.mark.parametrize('t, width, expected', [
+    ([], 0, []),
+    ([], 60, []),
+    ([100], 0, [0.0]),
+    ([100, 130, 160], 0, [30.0, 30.0, 30.0]),
+    ([100, 130, 1130, 1160], 0, [30.0, 300.0, 30.0, 30.0]),
+    ([100, 160], 60, [60.0, 60.0]),
+    ])
+def test_durations(t:list, width:int, expected:list, monkeypatch) -> None:
+    monkeypatch.setattr(report, 'use_numpy', False)
+    assert report.durations(t, width, 300.0) == expected
+
+
+def test_rows(tmp_path, monkeypatch) -> None:
+    """
+    An hour of a node that is allocated but idle, and an hour of one
+    that runs more than it was given.
+    """
+    monkeypatch.setattr(report, 'use_numpy', False)
+    store = HistoryStore(str(tmp_path))
+    for i in range(120):
+        store.append('spdr01', START + 30 * i, sample(26, 1.0))
+        store.append('spdr02', START + 30 * i, sample(8, 30.0, 300.0))
+    store.close()
+
+    spdr01, spdr02, basic, everything = rows(HistoryStore(str(tmp_path)), 'spdr[01-02]',
+        START, START + 3600, partitions={'basic': NodeSet('spdr01')})
+
+    assert spdr01['hours'] == 1.0
+    assert spdr01['avg_alloc_cores'] == 26.0
+    assert spdr01['avg_used_cores'] == 1.0
+    assert spdr01['idle_alloc_hours'] == 1.0
+    assert spdr01['idle_alloc_core_hours'] == 25.0
+    assert spdr01['overcommit_hours'] == 0.0
+    assert spdr01['cpu_efficiency'] == round(1 / 26, 3)
+
+    assert spdr02['idle_alloc_hours'] == 0.0
+    assert spdr02['overcommit_hours'] == 1.0
+    assert spdr02['overcommit_core_hours'] == 22.0
+    assert spdr02['p50_used_cores'] == 30.0
+    assert spdr02['p95_used_mem'] == 300.0
+
+    assert (basic['name'], basic['nodes'], basic['avg_used_cores']) == ('basic', 1, 1.0)
+    assert everything['nodes'] == 2
+    assert everything['avg_used_cores'] == 31.0
+    assert everything['hours'] == 2.0
+
+
+@pytest.mark.parametrize('numpy', [False, True])
+@pytest.mark.parametrize('resolution', ['raw', '1m'])
+def test_nothing_in_range(tmp_path, numpy:bool, resolution:str, monkeypatch) -> None:
+    """
+    A node with no rows in the range, because it has no history or
+    because its history is all from before the range.
+    """
+    if numpy: pytest.importorskip('numpy')
+    monkeypatch.setattr(report, 'use_numpy', numpy)
+    store = HistoryStore(str(tmp_path))
+    for i in range(10):
+        store.append('spdr01', START + 30 * i, sample(26, 1.0))
+    store.close()
+
+    later = START + 86400
+    got = rows(HistoryStore(str(tmp_path)), 'spdr[01-02]', later, later + 3600, resolution)
+    assert [ (_['name'], _['nodes'], _['hours']) for _ in got ] == [
+        ('spdr01', 1, 0.0), ('spdr02', 1, 0.0), ('all', 2, 0.0)]
+    assert all(_['avg_used_cores'] is None for _ in got)
+
+
+@pytest.mark.parametrize('resolution', ['raw', '1m', '5m'])
+def test_numpy_parity(tmp_path, resolution:str, monkeypatch) -> None:
+    pytest.importorskip('numpy')
+    store = random_store(str(tmp_path))
+    partitions = {'basic': NodeSet('spdr[01-02]'), 'gpu': NodeSet('gpu01')}
+
+    def both(numpy:bool) -> list:
+        monkeypatch.setattr(report, 'use_numpy', numpy)
+        return rows(store, 'spdr[01-02],gpu01', START, START + 7200, resolution, partitions)
+
+    with_numpy, without = both(True), both(False)
+    assert len(with_numpy) == len(without) == 6
+    for a, b in zip(with_numpy, without):
+        assert a.keys() == b.keys()
+        for k in a:
+            assert a[k] == pytest.approx(b[k], rel=1e-9, abs=1e-6), (a['name'], k)
@@ -0,0 +1,188 @@
+# -*- coding: utf-8 -*-
+"""
+Timing of the phases of a refresh, and of the probes of the nodes.
+A RefreshTimer is made for each refresh; the phases are timed with
+
+    with timer.phase('sinfo'):
+        ...
+
+and the probe latencies are added as they are reported. The summary
+is short enough for the status line of the map, and the breakdown is
+meant for the log.
+"""
+
+import typing
+from   typing import *
+
+###
+# Credits
+###
+__author__ = 'Alina Enikeeva'
+__copyright__ = 'Copyright 2022, University of Richmond'
+__credits__ = None
+__version__ = 0.1
+__maintainer__ = 'Alina Enikeeva, George Flanagin'
+__email__ = 'hpc@richmond.edu'
+__status__ = 'in progress'
+__license__ = 'MIT'
+
+
+###
+# Standard imports, starting with os and sys
+###
+min_py = (3, 8)
+import os
+import sys
+if sys.version_info < min_py:
+    print(f"This program requires Python {min_py[0]}.{min_py[1]}, or higher.")
+    sys.exit(os.EX_SOFTWARE)
+
+###
+# Other standard distro imports
+###
+import contextlib
+import heapq
+import math
+import threading
+import time
+
+###
+# global objects
+###
+verbose = False
+
+
+class LatencyHistogram:
+    """
+    Counts of latencies in logarithmic buckets, four per doubling,
+    starting at one millisecond. The percentiles are the upper bounds
+    of their buckets, so they are within 19% of the true value; the
+    maximum is exact. The slowest few nodes are also kept.
+    """
+    __slots__ = ('counts', 'n', 'max', 'slowest', 'keep')
+
+    BASE = 0.001
+    PER_DOUBLING = 4
+    BUCKETS = 80
+
+    def __init__(self, keep:int=5) -> None:
+        self.counts = [0] * LatencyHistogram.BUCKETS
+        self.n = 0
+        self.max = 0.0
+        self.slowest = []
+        self.keep = keep
+
+
+    def bucket(self, seconds:float) -> int:
+        if seconds <= LatencyHistogram.BASE: return 0
+        i = math.ceil(math.log2(seconds / LatencyHistogram.BASE) * LatencyHistogram.PER_DOUBLING)
+        return min(i, LatencyHistogram.BUCKETS - 1)
+
+
+    def upper(self, i:int) -> float:
+        return LatencyHistogram.BASE * 2 ** (i / LatencyHistogram.PER_DOUBLING)
+
+
+    def add(self, node:str, seconds:float) -> None:
+        self.counts[self.bucket(seconds)] += 1
+        self.n += 1
+        self.max = max(self.max, seconds)
+        if len(self.slowest) < self.keep:
+            heapq.heappush(self.slowest, (seconds, node))
+        else:
+            heapq.heappushpop(self.slowest, (seconds, node))
+
+
+    def percentile(self, p:float) -> float:
+        """
+        p is between 0 and 100.
+        """
+        if not self.n: return 0.0
+        rank = math.ceil(self.n * p / 100)
+        seen = 0
+        for i, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank:
+                return min(self.upper(i), self.max)
+        return self.max
+
+
+    def slowest_nodes(self) -> List[Tuple[str, float]]:
+        return [ (node, seconds) for seconds, node in sorted(self.slowest, reverse=True) ]
+
+
+class RefreshTimer:
+    """
+    The durations of the phases of one refresh, in the order they
+    were first entered, and the latencies of its node probes. The
+    collectors of several clusters may share one timer from their
+    own threads, and the log writer reads it from its own, so it is
+    read and written under the lock.
+    """
+    __slots__ = ('started', 'phases', 'probes', 'lock')
+
+    def __init__(self) -> None:
+        self.started = time.time()
+        self.phases = {}
+        self.probes = LatencyHistogram()
+        self.lock = threading.Lock()
+
+
+    @contextlib.contextmanager
+    def phase(self, name:str) -> Iterator[None]:
+        """
+        Time the body of a with statement. Repeated phases add up.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            with self.lock:
+                self.phases[name] = self.phases.get(name, 0.0) + time.perf_counter() - start
+
+
+    def probe(self, node:str, seconds:float) -> None:
+        with self.lock:
+            self.probes.add(node, seconds)
+
+
+    def summary(self) -> str:
+        """
+        One short line, e.g.
+            sinfo 0.04s ssh 2.69s parse 0.01s draw 0.02s | probe p50 0.31 p95 1.20 max 2.10 spdr16
+        """
+        with self.lock:
+            text = " ".join(f"{k} {v:.2f}s" for k, v in self.phases.items())
+            if self.probes.n:
+                slowest = self.probes.slowest_nodes()[0][0]
+                text += (f" | probe p50 {self.probes.percentile(50):.2f} p95 {self.probes.percentile(95):.2f}"
+                    f" max {self.probes.max:.2f} {slowest}")
+        return text
+
+
+    def as_dict(self) -> dict:
+        with self.lock:
+            return {
+                "phases": dict(self.phases),
+                "probes": {
+                    "count": self.probes.n,
+                    "p50": self.probes.percentile(50),
+                    "p95": self.probes.percentile(95),
+                    "max": self.probes.max,
+                    "slowest": self.probes.slowest_nodes()
+                    }
+                }
+
+
+    def breakdown(self) -> str:
+        """
+        Everything, on a few lines, for the log.
+        """
+        with self.lock:
+            lines = [ f"refresh phases: " + ", ".join(f"{k}={v:.3f}s" for k, v in self.phases.items()) ]
+            if self.probes.n:
+                lines.append(f"probes: n={self.probes.n} p50={self.probes.percentile(50):.3f}s "
+                    f"p95={self.probes.percentile(95):.3f}s max={self.probes.max:.3f}s")
+                lines.append("slowest: " + ", ".join(f"{node}={seconds:.3f}s"
+                    for node, seconds in self.probes.slowest_nodes()))
+        return "\n".join(lines)
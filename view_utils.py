@@ -34,16 +34,23 @@ if sys.version_info < min_py:
 # Other standard distro imports
 ###
 import argparse
+import atexit
 import contextlib
 import getpass
+import queue
+import selectors
 import shlex
+import signal
 import subprocess
+import threading
 import logging
 from   logging.handlers import RotatingFileHandler
 import pathlib
+import pickle
 import math
 import pprint
 from   functools import reduce
+import time
 
 
 
@@ -130,14 +137,22 @@ def draw_map() -> dict:
     return {"memory":memory_map, "cores":core_map}
 
 @trap
-def SeekINFO() -> tuple:
+def SeekINFO(cluster:str=None) -> tuple:
+    """
+    cluster is for sinfo -M; by default, the local cluster is queried.
+    """
     cmd = 'sinfo -o "%n %e %m %t %c %C"'
+    if cluster is not None: cmd = f'sinfo -M {cluster} -o "%n %e %m %t %c %C"'
     data = SloppyTree(dorunrun(cmd, return_datatype=dict))
     
     if not data.OK:
         verbose and print(f"sinfo failed: {data.code=}")
         return os.EX_DATAERR
 
+    # sinfo -M puts a CLUSTER: line before the header.
+    if cluster is not None:
+        data.stdout = "\n".join(_ for _ in data.stdout.split('\n') if not _.startswith('CLUSTER:'))
+
     verbose and print(data.stdout)
     return data
 
@@ -227,7 +242,7 @@ def dorunrun(command:Union[str, list],
         else:
             return {"OK":b_code, 
                     "code":i_code, 
-                    "name":ExitCode(i_code).name, 
+                    "name":exit_code_name(i_code), 
                     "stdout":s, 
                     "stderr":e}
         
@@ -238,6 +253,228 @@ def dorunrun(command:Union[str, list],
         raise Exception(f"Unexpected error: {str(e)}")
 
 
+# The exit code given to commands that dorunrun_many had to kill
+# because they ran out of time. It is the same as timeout(1)'s.
+TIMEOUT_CODE = 124
+
+class RunningCommand:
+    """
+    The bookkeeping for one of dorunrun_many's child processes.
+    """
+    __slots__ = ('key', 'proc', 'started', 'output', 'open_pipes', 'timed_out')
+
+    def __init__(self, key:object, proc:subprocess.Popen) -> None:
+        self.key = key
+        self.proc = proc
+        self.started = time.monotonic()
+        self.output = {'stdout':[], 'stderr':[]}
+        self.open_pipes = 2
+        self.timed_out = False
+
+    def kill(self) -> None:
+        """
+        Kill the command and anything it started.
+        """
+        self.timed_out = True
+        try:
+            os.killpg(self.proc.pid, signal.SIGKILL)
+        except ProcessLookupError as e:
+            pass
+
+    @property
+    def done(self) -> bool:
+        """
+        A killed command is done as soon as it has exited, even if
+        its children still hold the pipes open.
+        """
+        return (not self.open_pipes or self.timed_out) and self.proc.poll() is not None
+
+
+def _as_argv(command:Union[str, list]) -> List[str]:
+    """
+    The same conversions as dorunrun.
+    """
+    if isinstance(command, (list, tuple)):
+        return [str(_) for _ in command]
+    elif isinstance(command, str):
+        return shlex.split(command)
+    else:
+        raise Exception(f"Bad argument type to dorunrun_many: {command=}")
+
+
+def _as_result(code:int, stdout:str, stderr:str, elapsed:float, 
+    return_datatype:type) -> Union[str, bool, int, dict]:
+    """
+    Put the outcome of a command in the form that dorunrun would.
+    """
+    s = stdout[:-1] if stdout.endswith('\n') else stdout
+    e = stderr[:-1] if stderr.endswith('\n') else stderr
+
+    if return_datatype is int:
+        return code
+    elif return_datatype is str:
+        return s
+    elif return_datatype is bool:
+        return code == 0
+    else:
+        return {"OK":code == 0,
+                "code":code,
+                "name":"TIMEOUT" if code == TIMEOUT_CODE else exit_code_name(code),
+                "stdout":s,
+                "stderr":e,
+                "elapsed":elapsed}
+
+
+def dorunrun_many(commands:Union[Iterable, dict],
+    max_concurrent:int=32,
+    timeout:float=None,
+    deadline:float=None,
+    cancel:object=None,
+    offsets:dict=None,
+    return_datatype:type=dict,
+    ) -> Iterator[Tuple[object, Union[str, bool, int, dict]]]:
+    """
+    Run a batch of commands at the same time, and yield the results
+    as the commands finish.
+
+    commands -- a dict whose values are commands, or an iterable of
+        commands. Each command is a str or a list, as for dorunrun.
+    max_concurrent -- no more than this many commands run at once.
+    timeout -- seconds that any one command is allowed.
+    deadline -- seconds that the whole batch is allowed.
+    cancel -- anything with an is_set() method, e.g., threading.Event.
+        When it is set, the running commands are killed, and nothing
+        more is yielded. Closing the generator does the same.
+    offsets -- key -> seconds after the start of the batch before which
+        the command is not started, to spread the commands out over
+        time. The commands must come in the order of their offsets.
+    return_datatype -- as for dorunrun. The dict also has the key
+        "elapsed", the seconds the command ran.
+
+    yields -- (key, result) tuples, where key is the command's key in
+        the dict, or its index in the iterable. Commands that run out
+        of time, including those never started because the deadline
+        passed, have the exit code TIMEOUT_CODE. Commands that cannot
+        be started at all have the exit code 127.
+    """
+    return_datatype = dict if return_datatype not in (int, str, bool) else return_datatype
+    pending = iter(commands.items() if isinstance(commands, dict) else enumerate(commands))
+    exhausted = False
+    upcoming = None
+    running = {}
+    selector = selectors.DefaultSelector()
+    batch_starts = time.monotonic()
+    batch_ends = None if deadline is None else batch_starts + deadline
+
+    try:
+        while True:
+            if cancel is not None and cancel.is_set(): return
+
+            # Start commands until we reach the cap.
+            while not exhausted and len(running) < max_concurrent:
+                try:
+                    upcoming = upcoming or next(pending)
+                except StopIteration:
+                    exhausted = True
+                    break
+                key, command = upcoming
+                if offsets is not None and batch_starts + offsets.get(key, 0) > time.monotonic():
+                    break
+                upcoming = None
+
+                try:
+                    proc = subprocess.Popen(_as_argv(command),
+                        stdin=subprocess.DEVNULL,
+                        stdout=subprocess.PIPE,
+                        stderr=subprocess.PIPE,
+                        start_new_session=True)
+                except OSError as e:
+                    yield key, _as_result(127, "", str(e), 0.0, return_datatype)
+                    continue
+
+                job = running[proc.pid] = RunningCommand(key, proc)
+                selector.register(proc.stdout, selectors.EVENT_READ, (job, 'stdout'))
+                selector.register(proc.stderr, selectors.EVENT_READ, (job, 'stderr'))
+
+            if exhausted and not running: return
+
+            # Wait for output, but not past the next timeout, and not
+            # so long that we miss a cancellation or an exit. Commands
+            # that have closed their output are about to exit.
+            now = time.monotonic()
+            wait = 0.01 if any(not job.open_pipes for job in running.values()) else 0.5
+            if timeout is not None:
+                wait = min([wait] + [ job.started + timeout - now for job in running.values() ])
+            if batch_ends is not None:
+                wait = min(wait, batch_ends - now)
+            if upcoming is not None and len(running) < max_concurrent:
+                wait = min(wait, batch_starts + offsets.get(upcoming[0], 0) - now)
+
+            for selkey, _ in selector.select(max(wait, 0)):
+                job, name = selkey.data
+                chunk = os.read(selkey.fileobj.fileno(), 65536)
+                if chunk:
+                    job.output[name].append(chunk)
+                else:
+                    selector.unregister(selkey.fileobj)
+                    selkey.fileobj.close()
+                    job.open_pipes -= 1
+
+            now = time.monotonic()
+            for job in running.values():
+                if not job.timed_out and timeout is not None and now - job.started > timeout:
+                    job.kill()
+
+            if batch_ends is not None and now >= batch_ends:
+                for job in running.values():
+                    job.timed_out or job.kill()
+                if not exhausted:
+                    for key, command in ([upcoming] if upcoming else []) + list(pending):
+                        yield key, _as_result(TIMEOUT_CODE, "", "not started before the deadline", 
+                            0.0, return_datatype)
+                    exhausted, upcoming = True, None
+
+            for pid in [ pid for pid, job in running.items() if job.done ]:
+                job = running.pop(pid)
+                for pipe in (job.proc.stdout, job.proc.stderr):
+                    if not pipe.closed:
+                        selector.unregister(pipe)
+                        pipe.close()
+                out, err = ( b"".join(job.output[_]).decode('utf-8', errors='replace') 
+                    for _ in ('stdout', 'stderr') )
+                code = TIMEOUT_CODE if job.timed_out else job.proc.returncode
+                yield job.key, _as_result(code, out, err, now - job.started, return_datatype)
+
+    finally:
+        for job in running.values():
+            job.kill()
+            job.proc.wait()
+            for pipe in (job.proc.stdout, job.proc.stderr):
+                pipe.closed or pipe.close()
+        selector.close()
+
+
+def exit_code_name(code:int) -> str:
+    """
+    A name for any exit code, including those (like ssh's 255) that
+    are not in ExitCode. Negative codes are the signals that killed
+    the process, as subprocess reports them.
+    """
+    if code in ExitCode:
+        return ExitCode(code).name
+    if code < 0:
+        try:
+            return signal.Signals(-code).name
+        except ValueError as e:
+            return f"SIGNAL{-code}"
+    if 128 < code < 128 + signal.NSIG:
+        try:
+            return f"KILLEDBY{signal.Signals(code - 128).name}"
+        except ValueError as e:
+            pass
+    return f"EXIT{code}"
+
+
 
 
 class FakingIt(enum.EnumMeta):
@@ -306,6 +543,201 @@ def piddly(s:str) -> str:
     return f": {os.getppid()} <- {os.getpid()} : {s}"
 
 
+class Lazy:
+    """
+    Defer building an expensive log message until a handler formats
+    it, which never happens if the level is filtered out:
+
+        logger.info("%s", Lazy(timer.breakdown))
+    """
+    __slots__ = ('f', 'args')
+
+    def __init__(self, f:Callable, *args) -> None:
+        self.f = f
+        self.args = args
+
+    def __str__(self) -> str:
+        return str(self.f(*self.args))
+
+
+class BatchingFileHandler(RotatingFileHandler):
+    """
+    A RotatingFileHandler that can write many records with one write
+    and one flush.
+    """
+    def emit_batch(self, records:list) -> None:
+        text = []
+        for record in records:
+            try:
+                text.append(self.format(record) + self.terminator)
+            except Exception:
+                self.handleError(record)
+        if not text: return
+        text = "".join(text)
+
+        self.acquire()
+        try:
+            if self.stream is None:
+                self.stream = self._open()
+            if self.maxBytes > 0 and self.stream.tell() + len(text) >= self.maxBytes:
+                self.doRollover()
+            self.stream.write(text)
+            self.flush()
+        except Exception:
+            self.handleError(records[-1])
+        finally:
+            self.release()
+
+
+class QueueingHandler(logging.Handler):
+    """
+    Put records on a queue for a background thread to format and
+    write, in batches. The caller pays only for the put. A forked
+    child has no writer thread, so in a child the records are written
+    directly to the target handler.
+    """
+    def __init__(self, target:BatchingFileHandler, batch:int) -> None:
+        logging.Handler.__init__(self)
+        self.target = target
+        self.batch = batch
+        self.pid = os.getpid()
+        self.queue = queue.SimpleQueue()
+        self.thread = threading.Thread(target=self.run, name='URLogger', daemon=True)
+        self.thread.start()
+        atexit.register(self.close)
+
+
+    def handle(self, record:logging.LogRecord) -> bool:
+        """
+        No lock and no formatting here; the writer does that.
+        """
+        if os.getpid() != self.pid:
+            return self.target.handle(record)
+        self.queue.put(record)
+        return True
+
+
+    def run(self) -> None:
+        while True:
+            records = [self.queue.get()]
+            while len(records) < self.batch:
+                try:
+                    records.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            stop = None in records
+            self.target.emit_batch([ _ for _ in records if _ is not None ])
+            if stop: return
+
+
+    def close(self) -> None:
+        """
+        Write whatever is queued, and stop the writer.
+        """
+        if os.getpid() == self.pid and self.thread.is_alive():
+            self.queue.put(None)
+            self.thread.join(timeout=5)
+        logging.Handler.close(self)
+
+
+class RepeatFilter(logging.Filter):
+    """
+    Allow no more than burst records from one call site with the same
+    message and arguments in each window of seconds. The first record
+    after a window notes how many were suppressed in it. Messages whose
+    window has passed are forgotten about once per window; how many of
+    their repeats were suppressed is handed to emit, or, without it,
+    kept for flush, as are those that are still pending at the end.
+    """
+    def __init__(self, burst:int, window:float, emit:Callable=None) -> None:
+        logging.Filter.__init__(self)
+        self.burst = burst
+        self.window = window
+        self.emit = emit
+        self.seen = {}
+        self.pending = []
+        self.swept = 0.0
+
+
+    @staticmethod
+    def key(record:logging.LogRecord) -> tuple:
+        msg = record.msg if isinstance(record.msg, str) else None
+        args = record.args
+        try:
+            hash(args)
+        except TypeError as e:
+            args = repr(args)
+        return (record.pathname, record.lineno, msg, args)
+
+
+    @staticmethod
+    def note(record:logging.LogRecord, suppressed:int, created:float) -> logging.LogRecord:
+        """
+        A copy of record that says how many of its repeats were suppressed.
+        """
+        note = logging.makeLogRecord(record.__dict__)
+        note.msg = f"{record.getMessage()} [{suppressed} similar messages suppressed]"
+        note.args = ()
+        note.created = created
+        return note
+
+
+    def filter(self, record:logging.LogRecord) -> bool:
+        key = RepeatFilter.key(record)
+        seen = self.seen.get(key)
+
+        if seen is None or record.created - seen[0] >= self.window:
+            suppressed = seen[2] if seen else 0
+            self.seen[key] = [record.created, 1, 0, record]
+            if suppressed:
+                record.msg = f"{record.getMessage()} [{suppressed} similar messages suppressed]"
+                record.args = ()
+            allowed = True
+        else:
+            seen[1] += 1
+            allowed = seen[1] <= self.burst
+            seen[2] += not allowed
+
+        if record.created - self.swept >= self.window:
+            self.sweep(record.created)
+        return allowed
+
+
+    def sweep(self, now:float) -> None:
+        """
+        Forget the messages whose window has passed, so that neither
+        they nor the arguments in their records are kept forever.
+        """
+        self.swept = now
+        expired = [ k for k, seen in self.seen.items() if now - seen[0] >= self.window ]
+        notes = []
+        for k in expired:
+            created, count, suppressed, record = self.seen.pop(k)
+            if suppressed:
+                notes.append(RepeatFilter.note(record, suppressed, now))
+
+        if self.emit is None:
+            self.pending.extend(notes)
+        else:
+            for note in notes:
+                self.emit(note)
+
+
+    def flush(self) -> List[logging.LogRecord]:
+        """
+        A record for each message whose repeats are being suppressed,
+        with how many were, and forget them all.
+        """
+        pending, self.pending = self.pending, []
+        now = time.time()
+        for created, count, suppressed, record in self.seen.values():
+            if not suppressed: continue
+            pending.append(RepeatFilter.note(record, suppressed, now))
+        self.seen = {}
+        return pending
+
+
 class URLogger: pass
 
 class URLogger:
@@ -314,7 +746,12 @@ class URLogger:
         'formatter': 'format string for the logging records.', 
         'level': 'level of the logging object',
         'rotator': 'using the built-in log rotation system',
-        'thelogger': 'the logging object this class wraps'
+        'thelogger': 'the logging object this class wraps',
+        'queued': 'if True, records are written by a background thread',
+        'batch': 'the most records the background thread writes at once',
+        'burst': 'repeats of a message allowed per window; 0 allows all of them',
+        'window': 'seconds over which the repeats are counted',
+        'handler': 'the handler attached to thelogger'
         }
 
     __values__ = (
@@ -322,6 +759,11 @@ class URLogger:
         logging.Formatter('#%(levelname)-8s [%(asctime)s] (%(process)d) %(module)s: %(message)s'),
         logging.WARNING,
         None,
+        None,
+        False,
+        256,
+        0,
+        60,
         None)
 
     __defaults__ = dict(zip(__slots__.keys(), __values__))
@@ -346,15 +788,28 @@ class URLogger:
             sys.stderr.write(f"Cannot create or open {self.logfile}. {e}\n")
             raise e from None
 
-        self.rotator = RotatingFileHandler(self.logfile, maxBytes=1<<24, backupCount=2)
+        self.rotator = BatchingFileHandler(self.logfile, maxBytes=1<<24, backupCount=2)
             
         self.rotator.setLevel(self.level)
         self.rotator.setFormatter(self.formatter)
 
-        # setting up logger with handlers
+        # setting up logger with handlers. There is only one 'URLogger'
+        # logger, so remove what an earlier URLogger attached to it.
         self.thelogger = logging.getLogger('URLogger')
         self.thelogger.setLevel(self.level)
-        self.thelogger.addHandler(self.rotator)
+        for h in [ _ for _ in self.thelogger.handlers if getattr(_, 'urlogger', False) ]:
+            self.thelogger.removeHandler(h)
+            h.close()
+        for f in [ _ for _ in self.thelogger.filters if isinstance(_, RepeatFilter) ]:
+            self.thelogger.removeFilter(f)
+
+        self.handler = QueueingHandler(self.rotator, self.batch) if self.queued else self.rotator
+        self.handler.setLevel(self.level)
+        self.handler.urlogger = True
+        self.thelogger.addHandler(self.handler)
+        if self.burst:
+            self.thelogger.addFilter(RepeatFilter(self.burst, self.window, self.handler.handle))
+            atexit.register(self.flush)
 
 
     ###
@@ -382,6 +837,33 @@ class URLogger:
     def critical(self) -> object:
         return self.thelogger.critical
 
+    @property
+    def isEnabledFor(self) -> object:
+        return self.thelogger.isEnabledFor
+
+
+    def flush(self) -> None:
+        """
+        Report the repeats that are being suppressed.
+        """
+        if self.handler not in self.thelogger.handlers: return
+        for f in [ _ for _ in self.thelogger.filters if isinstance(_, RepeatFilter) ]:
+            for record in f.flush():
+                self.handler.handle(record)
+
+
+    def close(self) -> None:
+        """
+        Report the suppressed repeats, write any queued records, and
+        detach from the logger.
+        """
+        self.flush()
+        for f in [ _ for _ in self.thelogger.filters if isinstance(_, RepeatFilter) ]:
+            self.thelogger.removeFilter(f)
+        self.thelogger.removeHandler(self.handler)
+        self.handler.close()
+        self.rotator.close()
+
 
     ###
     # Tinker with the object model a little bit.
@@ -405,6 +887,7 @@ class URLogger:
         """
         self.level = level
         self.rotator.setLevel(self.level)
+        self.handler.setLevel(self.level)
         self.thelogger.setLevel(self.level)
         return self 
 
@@ -679,6 +1162,248 @@ class SloppyTree(dict):
                     print("the path: ", path)
 
 
+class CompactTree: pass
+class CompactTree(SloppyTree):
+    """
+    A SloppyTree for carrying snapshots around. Each subtree keeps
+    count of the nodes and leaves beneath it as it is changed, so that
+    len() and ~ do not walk the tree. Iterating over one gives its keys,
+    as for any dict. Pickling, and to_bytes(), reduce the tree to
+    nested plain dicts, which pickle handles without calling back into
+    Python; with protocol 5, bytes and bytearray leaves can be passed
+    out-of-band.
+
+    Usage:
+        t = CompactTree(snapshot)
+        blob = t.to_bytes()
+        t = CompactTree.from_bytes(blob)
+    """
+    __slots__ = ('_parent', '_nodes', '_leaves')
+
+    def __init__(self, data:dict=None) -> None:
+        dict.__init__(self)
+        object.__setattr__(self, '_parent', None)
+        object.__setattr__(self, '_nodes', 0)
+        object.__setattr__(self, '_leaves', 0)
+        if data: self._load(data)
+
+
+    def _load(self, data:dict) -> None:
+        """
+        Fill an empty tree from nested dicts, counting from the bottom
+        up rather than through __setitem__.
+        """
+        nodes = leaves = 0
+        for k, v in data.items():
+            if isinstance(v, dict):
+                child = CompactTree()
+                child._load(v)
+                object.__setattr__(child, '_parent', self)
+                v = child
+            elif isinstance(v, pickle.PickleBuffer):
+                v = v.raw()
+            dict.__setitem__(self, k, v)
+            n, l = CompactTree._weight(v)
+            nodes += n
+            leaves += l
+        object.__setattr__(self, '_nodes', nodes)
+        object.__setattr__(self, '_leaves', leaves)
+
+
+    @staticmethod
+    def _weight(v:object) -> Tuple[int, int]:
+        """
+        The nodes and leaves that a key with this value adds to its tree.
+        """
+        if isinstance(v, CompactTree):
+            return 1 + v._nodes, v._leaves if dict.__len__(v) else 1
+        return 2, 1
+
+
+    def _changed(self, nodes:int, leaves:int, was_empty:bool) -> None:
+        """
+        This subtree gained (or lost) nodes and leaves; pass the change
+        up to its ancestors. An empty subtree is itself a leaf, so the
+        count that the parent sees differs when the subtree fills or
+        empties.
+        """
+        before = 1 if was_empty else self._leaves
+        object.__setattr__(self, '_nodes', self._nodes + nodes)
+        object.__setattr__(self, '_leaves', self._leaves + leaves)
+        leaves = (self._leaves if dict.__len__(self) else 1) - before
+
+        node = self._parent
+        while node is not None:
+            object.__setattr__(node, '_nodes', node._nodes + nodes)
+            object.__setattr__(node, '_leaves', node._leaves + leaves)
+            node = node._parent
+
+
+    def _adopt(self, k:Hashable, v:object) -> object:
+        """
+        Subtrees have only one parent. Plain dicts are converted, and
+        a subtree that already belongs somewhere else is copied.
+        """
+        if isinstance(v, CompactTree):
+            if v._parent is self and dict.get(self, k) is v:
+                return v
+            ancestors = self
+            while ancestors is not None and ancestors is not v:
+                ancestors = ancestors._parent
+            if v._parent is not None or ancestors is v:
+                v = CompactTree(v.as_dict())
+        elif isinstance(v, dict):
+            v = CompactTree(v)
+        else:
+            return v
+
+        object.__setattr__(v, '_parent', self)
+        return v
+
+
+    def _release(self, v:object) -> None:
+        if isinstance(v, CompactTree):
+            object.__setattr__(v, '_parent', None)
+
+
+    def __setitem__(self, k:Hashable, v:object) -> None:
+        v = self._adopt(k, v)
+        was_empty = not dict.__len__(self)
+        nodes, leaves = CompactTree._weight(v)
+        if dict.__contains__(self, k):
+            old = dict.__getitem__(self, k)
+            if old is v: return
+            n, l = CompactTree._weight(old)
+            nodes -= n
+            leaves -= l
+            self._release(old)
+        dict.__setitem__(self, k, v)
+        self._changed(nodes, leaves, was_empty)
+
+
+    def __delitem__(self, k:Hashable) -> None:
+        old = dict.__getitem__(self, k)
+        nodes, leaves = CompactTree._weight(old)
+        dict.__delitem__(self, k)
+        self._release(old)
+        self._changed(-nodes, -leaves, False)
+
+
+    def __getattr__(self, k:str) -> object:
+        """
+        copy, pickle and friends probe for special methods with
+        getattr; those must not grow the tree.
+        """
+        if k.startswith('__'): raise AttributeError(k)
+        return self[k]
+
+
+    def __missing__(self, k:Hashable) -> object:
+        self[k] = CompactTree()
+        return dict.__getitem__(self, k)
+
+
+    def __ilshift__(self, keys:Union[list, tuple]) -> CompactTree:
+        for k in keys:
+            self[k] = CompactTree()
+        return self
+
+
+    def __ior__(self, other:dict) -> CompactTree:
+        self.update(other)
+        return self
+
+
+    def __invert__(self) -> int:
+        return self._leaves
+
+
+    def __iter__(self) -> Iterator:
+        return dict.__iter__(self)
+
+
+    def __len__(self) -> int:
+        return self._nodes
+
+
+    def clear(self) -> None:
+        for v in dict.values(self):
+            self._release(v)
+        nodes, leaves = self._nodes, self._leaves
+        was_empty = not dict.__len__(self)
+        dict.clear(self)
+        self._changed(-nodes, -leaves, was_empty)
+
+
+    def pop(self, k:Hashable, *default:object) -> object:
+        if dict.__contains__(self, k):
+            v = dict.__getitem__(self, k)
+            del self[k]
+            return v
+        if default: return default[0]
+        raise KeyError(k)
+
+
+    def popitem(self) -> Tuple[Hashable, object]:
+        k = next(reversed(dict.keys(self)))
+        return k, self.pop(k)
+
+
+    def setdefault(self, k:Hashable, default:object=None) -> object:
+        if not dict.__contains__(self, k):
+            self[k] = default
+        return dict.__getitem__(self, k)
+
+
+    def update(self, *args, **kwargs) -> None:
+        for k, v in dict(*args, **kwargs).items():
+            self[k] = v
+
+
+    def as_dict(self, out_of_band:bool=False) -> dict:
+        """
+        The tree as nested plain dicts. With out_of_band, bytes and
+        bytearray leaves are wrapped so that pickle protocol 5 can
+        hand them to a buffer_callback rather than copy them.
+        """
+        d = {}
+        for k, v in dict.items(self):
+            if isinstance(v, CompactTree):
+                v = v.as_dict(out_of_band)
+            elif out_of_band and isinstance(v, (bytes, bytearray)):
+                v = pickle.PickleBuffer(v)
+            d[k] = v
+        return d
+
+
+    @classmethod
+    def _from_dict(cls, data:dict) -> CompactTree:
+        return cls(data)
+
+
+    def __reduce_ex__(self, protocol:int) -> tuple:
+        return (CompactTree._from_dict, (self.as_dict(protocol >= 5),))
+
+
+    def to_bytes(self, buffers:list=None) -> bytes:
+        """
+        Serialize the tree. If buffers is a list, large binary leaves
+        are appended to it instead of being copied into the result;
+        the same list must then be given to from_bytes.
+        """
+        return pickle.dumps(self, protocol=5,
+            buffer_callback=None if buffers is None else buffers.append)
+
+
+    @staticmethod
+    def from_bytes(data:bytes, buffers:Iterable=None) -> CompactTree:
+        """
+        The reverse of to_bytes(). Leaves that were passed out-of-band
+        come back as memoryviews of the buffers.
+        """
+        return pickle.loads(data, buffers=buffers)
+
+
 if __name__ == "__main__":
     t = SloppyTree()
     t.a.b.c
@@ -80,9 +80,14 @@ def help_msg() -> str:
     d = "Notice the 3 numbers that follow. Just like cores, these \n numbers indicate SLURM-allocated, actually-used and total \n memory in GB.\n"
     e = "If the node is colored in green, that means that its load \n is less than 75% in terms of both memory and CPU usage.\n"
     f = "If the node is colored yellow, that means that either node's\n memory or CPUs are more than 75% occupied.\n"  
-    g = "The red color signifies anomaly - either the node is down or \n the number of cores used is more than 52.\n" 
+    g = "The red color signifies anomaly - either the node is down or \n the number of cores used is more than the node has.\n" 
+    h = "Flags after a row mark conditions that have lasted a few refreshes:\n !overloaded, !idle (allocated but unused), !memfull, and !surge.\n"
 
-    msg = "".join((a, b, c, d, e, f, g))
+    i = "With --jobs, the users with the most CPUs on the node follow,\n with their CPUs in parentheses; with --cgroups, so do its busiest\n jobs, as id:used/allocated cores.\n"
+
+    j = "Move between the nodes with the arrow keys (or j and k), and press\n Enter for the top processes, memory and per-core load of the node.\n"
+
+    msg = "".join((a, b, c, d, e, f, g, h, i, j))
 
     return msg
 
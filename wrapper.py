@@ -16,10 +16,17 @@ if sys.version_info < min_py:
 ##
 # Standard imports
 ##
+import atexit
 import contextlib
 import datetime
 from   functools import wraps
+import hashlib
 import inspect
+import linecache
+import queue
+import reprlib
+import tempfile
+import threading
 
 ###
 # An optional import for better printing.
@@ -43,6 +50,35 @@ __status__ = 'Production'
 __license__ = 'MIT'
 __required_version__ = (3,8)
 
+###
+# How trap behaves. The mode is read from ACTIVITYVIEW_TRAP when this
+# module is imported, and can be changed later with configure_trap().
+#
+#   full    -- dump every local of every frame, as it always has.
+#   bounded -- dump a size-limited summary of each distinct failure
+#              once, writing it from a background thread.
+#   off     -- functions decorated while the mode is off are not
+#              wrapped at all.
+###
+trap_config = {
+    'mode': os.environ.get('ACTIVITYVIEW_TRAP', 'full'),
+    'dump_dir': None,       # $PWD/YYYY-MM-DD when None.
+    'max_bytes': 1 << 16,   # largest bounded dump.
+    'max_frames': 20,       # innermost frames in a bounded dump.
+    'max_dumps': 100        # bounded dumps allowed in the dump directory.
+    }
+
+def configure_trap(**kwargs) -> dict:
+    """
+    Change any of the keys in trap_config, and return the config.
+    """
+    for k, v in kwargs.items():
+        if k not in trap_config:
+            raise Exception(f"Unknown trap setting {k}")
+        trap_config[k] = v
+    return trap_config
+
+
 def null_decorator(o:object) -> object:
     """
     The big nothing.
@@ -85,10 +121,224 @@ def printvars(f_locals:dict) -> None:
     return
 
 
+class DumpWriter:
+    """
+    Writes bounded dumps from a background thread, so the failing
+    process does not wait on the disk. Forked children usually leave
+    with os._exit, which would lose a queued dump, so a process other
+    than the one that imported this module writes its (small) dump
+    itself.
+    """
+    def __init__(self) -> None:
+        self.pid = os.getpid()
+        self.queue = None
+        self.thread = None
+        self.count = None
+
+
+    def write(self, name:str, text:bytes) -> None:
+        if os.getpid() != self.pid:
+            try:
+                publish(name, text)
+            except OSError as e:
+                pass
+            return
+
+        if self.thread is None:
+            self.queue = queue.SimpleQueue()
+            self.thread = threading.Thread(target=self.run, name='trap', daemon=True)
+            self.thread.start()
+            atexit.register(self.close)
+        self.queue.put((name, text))
+
+
+    def run(self) -> None:
+        while (item := self.queue.get()) is not None:
+            try:
+                publish(*item)
+            except OSError as e:
+                pass
+
+
+    def close(self) -> None:
+        if os.getpid() == self.pid and self.thread.is_alive():
+            self.queue.put(None)
+            self.thread.join(timeout=5)
+
+dump_writer = DumpWriter()
+
+
+def publish(name:str, text:bytes) -> None:
+    """
+    Write text to a temporary file next to name, and link it to name
+    only when it is complete, so that name is never seen empty or
+    half written. If name already exists, it is left as it is.
+    """
+    fd, temp_name = tempfile.mkstemp(dir=os.path.dirname(name), suffix='.tmp')
+    try:
+        with open(fd, 'wb') as f:
+            os.fchmod(f.fileno(), 0o644)
+            f.write(text)
+        os.link(temp_name, name)
+    except FileExistsError as e:
+        pass
+    finally:
+        os.unlink(temp_name)
+
+
+def tell(s:str) -> None:
+    """
+    Write to stderr, which may be gone (e.g., a closed pipe) by the
+    time the program fails.
+    """
+    try:
+        sys.stderr.write(s)
+    except (OSError, ValueError) as e:
+        pass
+
+
+brief = reprlib.Repr()
+brief.maxstring = brief.maxother = 160
+brief.maxlist = brief.maxtuple = brief.maxdict = brief.maxset = 8
+brief.maxlevel = 2
+
+
+def bounded_dump(e:Exception) -> None:
+    """
+    Write a summary of the frames of e, no larger than max_bytes, to
+    a file named for the failure's signature (the exception type and
+    the code locations). A failure that already has a dump file is
+    not dumped again, whichever process hits it.
+    """
+    global trap_config
+
+    frames = []
+    tb = e.__traceback__
+    while tb is not None:
+        if '__wrapper_marker_local__' not in tb.tb_frame.f_locals:
+            frames.append((tb.tb_frame, tb.tb_lineno))
+        tb = tb.tb_next
+    frames = frames[-trap_config['max_frames']:]
+
+    where = "|".join(f"{f.f_code.co_filename}:{line}:{f.f_code.co_name}" for f, line in frames)
+    signature = hashlib.sha1(f"{type(e).__qualname__}|{where}".encode()).hexdigest()[:16]
+
+    new_dir = trap_config['dump_dir'] or os.path.join(os.getcwd(), datetime.datetime.now().isoformat()[:10])
+    os.makedirs(new_dir, exist_ok=True)
+    if dump_writer.count is None:
+        dump_writer.count = sum(1 for _ in os.scandir(new_dir) if _.name.endswith('.dump'))
+    if dump_writer.count >= trap_config['max_dumps']:
+        tell(f"Exception: {e} (dump limit reached in {new_dir})\n")
+        return
+
+    candidate_name = os.path.join(new_dir, f"{signature}.dump")
+    if os.path.exists(candidate_name):
+        tell(f"Exception: {e} (already dumped to {candidate_name})\n")
+        return
+    dump_writer.count += 1
+    tell(f"Exception: {e}; writing dump to file {candidate_name}\n")
+
+    lines = [ f"Exception raised {type(e).__name__}: \"{brief.repr(str(e))[1:-1]}\"",
+        f"pid {os.getpid()} at {datetime.datetime.now().isoformat()}" ]
+    size = sum(len(_) for _ in lines)
+    for frame, line in frames:
+        code = frame.f_code
+        lines.append(f"**File <{code.co_filename}>, line {line}, in function {code.co_name}()\n"
+            f" {linecache.getline(code.co_filename, line).strip()}")
+        for k, v in frame.f_locals.items():
+            try:
+                lines.append(f"    {k} = {brief.repr(v)}")
+            except Exception:
+                lines.append(f"    Unable to print the value of {k}")
+        size += sum(len(_) for _ in lines[-len(frame.f_locals)-1:])
+        if size > trap_config['max_bytes']: break
+
+    text = ("\n".join(lines) + "\n").encode('utf-8', errors='replace')
+    if len(text) > trap_config['max_bytes']:
+        text = text[:trap_config['max_bytes']] + b"\n... truncated\n"
+
+    dump_writer.write(candidate_name, text)
+
+
+def dump_and_exit(e:Exception) -> None:
+    """
+    What trap does with an exception, called from the except clause
+    of the wrapper: dump the frames (a bounded summary of them in
+    bounded mode), and exit.
+    """
+    if trap_config['mode'] == 'bounded':
+        bounded_dump(e)
+        sys.exit(-1)
+
+    # Here is what happened:
+    print(f"Exception: {e}")
+
+    # Who am I?
+    pid = f'pid{os.getpid()}'
+
+    # First order of business: create a dump file. The file will be under
+    # $PWD with today's date.
+    today = datetime.datetime.now().isoformat()[:10]
+    new_dir = os.path.join(os.getcwd(), today)
+    os.makedirs(new_dir, exist_ok=True)
+
+    # The file name will be the pid under the $PWD/today's-date 
+    # directory.
+    candidate_name = os.path.join(new_dir, pid)
+    
+    sys.stderr.write(f"writing dump to file {candidate_name}\n")
+
+    with open(candidate_name, 'a') as f:
+        with contextlib.redirect_stdout(f):
+            # Protect against further failure -- log the exception.
+            try:
+                e_type, e_val, e_trace = sys.exc_info()
+            except Exception as e:
+                print(f"Exception while unwinding the stack: {e}")
+
+            print(f'Exception raised {e_type}: "{e_val}"')
+            
+            # iterate through the frames in reverse order so we print the
+            # most recent frame first
+            for frame_info in inspect.getinnerframes(e_trace):
+                f_locals = frame_info[0].f_locals
+        
+                # if there's a local variable named __wrapper_marker_local__, we assume
+                # the frame is from a call of this function, 'wrapper', and we skip
+                # it. The problem happened before the dumping function was called.
+                if '__wrapper_marker_local__' in f_locals: continue
+
+                # log the frame information
+                f, l, foo, code = frame_info[1:5]
+                print(f'**File <{f}>, line {l}, in function {foo}()\n {code[0].lstrip()}')
+
+                # log every local variable of the frame
+                printvars(f_locals)
+
+            print('\n')
+    sys.exit(-1)
+
+
 def show_exceptions_and_frames(func:object) -> None:
     """
     Print the names and values of each object in each stack frame.
+    In bounded mode, write a bounded summary instead. In off mode,
+    do not wrap func at all. A generator function is wrapped by a
+    generator, so that what goes wrong while it is iterated is trapped
+    as well, and not only the call that creates it.
     """
+    if trap_config['mode'] == 'off': return func
+
+    if inspect.isgeneratorfunction(func):
+        @wraps(func)
+        def generator_wrapper(*args, **kwds):
+            __wrapper_marker_local__ = None
+            try:
+                return (yield from func(*args, **kwds))
+            except Exception as e:
+                dump_and_exit(e)
+
+        return generator_wrapper
 
     @wraps(func)
     def wrapper(*args, **kwds):
@@ -105,53 +355,7 @@ def show_exceptions_and_frames(func:object) -> None:
             return func(*args, **kwds)
 
         except Exception as e:
-            # Here is what happened:
-            print(f"Exception: {e}")
-
-            # Who am I?
-            pid = f'pid{os.getpid()}'
-
-            # First order of business: create a dump file. The file will be under
-            # $PWD with today's date.
-            today = datetime.datetime.now().isoformat()[:10]
-            new_dir = os.path.join(os.getcwd(), today)
-            os.makedirs(new_dir, exist_ok=True)
-
-            # The file name will be the pid under the $PWD/today's-date 
-            # directory.
-            candidate_name = os.path.join(new_dir, pid)
-            
-            sys.stderr.write(f"writing dump to file {candidate_name}\n")
-
-            with open(candidate_name, 'a') as f:
-                with contextlib.redirect_stdout(f):
-                    # Protect against further failure -- log the exception.
-                    try:
-                        e_type, e_val, e_trace = sys.exc_info()
-                    except Exception as e:
-                        print(f"Exception while unwinding the stack: {e}")
-
-                    print(f'Exception raised {e_type}: "{e_val}"')
-                    
-                    # iterate through the frames in reverse order so we print the
-                    # most recent frame first
-                    for frame_info in inspect.getinnerframes(e_trace):
-                        f_locals = frame_info[0].f_locals
-                
-                        # if there's a local variable named __wrapper_marker_local__, we assume
-                        # the frame is from a call of this function, 'wrapper', and we skip
-                        # it. The problem happened before the dumping function was called.
-                        if '__wrapper_marker_local__' in f_locals: continue
-
-                        # log the frame information
-                        f, l, foo, code = frame_info[1:5]
-                        print(f'**File <{f}>, line {l}, in function {foo}()\n {code[0].lstrip()}')
-
-                        # log every local variable of the frame
-                        printvars(f_locals)
-
-                    print('\n')
-            sys.exit(-1)
+            dump_and_exit(e)
 
     return wrapper
 